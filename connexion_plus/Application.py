@@ -1,7 +1,54 @@
+import os
+import sys
+import time
 import logging
 from flask import Flask, jsonify
 
 from connexion import FlaskApp
+from connexion.apis.flask_api import FlaskApi
+from connexion.apis import flask_utils
+
+
+class StartupProfile(object):
+    """
+    Measures the time and the number of newly imported modules of every feature, while the App starts.
+
+    Call #mark after each feature, the steps will be a list of (name, seconds, modules).
+    """
+
+    def __init__(self):
+        self.steps = []
+        self._time = time.perf_counter()
+        self._modules = len(sys.modules)
+
+    def mark(self, name):
+        now, modules = time.perf_counter(), len(sys.modules)
+        self.steps.append((name, now - self._time, modules - self._modules))
+        self._time, self._modules = now, modules
+
+    def report(self):
+        lines = ["{:<16}{:>10.1f} ms{:>6} modules".format(name, seconds * 1000, modules)
+                 for name, seconds, modules in self.steps]
+        lines.append("{:<16}{:>10.1f} ms".format("total", sum(step[1] for step in self.steps) * 1000))
+        return "\n".join(lines)
+
+
+class SecuredFlaskApi(FlaskApi):
+    """
+    Marks the views of the operations with security requirements, so FlaskOptimize never serves them from its cache.
+    The cache is served before the view and so before the security checks of connexion.
+    """
+
+    def _add_operation_internal(self, method, path, operation):
+        flask_path = flask_utils.flaskify_path(path, operation.get_path_parameter_types())
+        endpoint_name = flask_utils.flaskify_endpoint(operation.operation_id, operation.randomize_endpoint)
+        function = operation.function
+
+        if operation.security:
+            # only this view is marked, the resolved function can be used by other operations
+            function._optimize_secured = True
+
+        self.blueprint.add_url_rule(flask_path, endpoint_name, function, methods=[method])
 
 
 class App(FlaskApp):
@@ -18,6 +65,7 @@ class App(FlaskApp):
         all=None,
         flaskName=None,
         *args,
+        use_profile=None,
         **kwargs,
     ):
         # TODO: Add more text here for current situation
@@ -28,22 +76,48 @@ class App(FlaskApp):
 
         *use_tracer* must be of type: bool (True for defaults, False for deactivating), 
         opentracing.Tracer (use it for configuration), dict (use default opentracing.Tracer and the given dict as config) or defaults: None
-
-        *use_metric* must be of type: bool (True for defaults, False for deactivating) or defaults: None
+        The sampler of the dict can have per operation rates and can be overwritten by the environment variables
+        TRACER_SAMPLER_TYPE and TRACER_SAMPLER_PARAM, see connexion_plus.Tracing#create_sampler.
+        Requests with server errors will always be sampled, set "sample_on_error" to False in the dict to disable it.
+        The requests matched by the keys "exclude_paths" (path prefixes, defaults to /metrics), "exclude_endpoints"
+        (defaults to static) and "exclude_methods" (defaults to OPTIONS) of the dict will not be traced.
+        The key "patches" of the dict selects the client integrations, which will be traced (defaults to the http clients),
+        see connexion_plus.Tracing#install_client_hooks.
+
+        *use_metric* must be of type: bool (True for defaults, False for deactivating), dict or defaults: None
+        The keys "path", "buckets", "default_labels" and "excluded_paths" of the dict are given to prometheus_flask_exporter.
+        "group_by" can be "operation" to label the requests with the connexion operation id instead of the path.
+        "multiprocess" (True or a directory, defaults to True, if the environment variable PROMETHEUS_MULTIPROC_DIR is set)
+        aggregates the metrics of all worker processes, see connexion_plus.Metrics#configure_multiprocess.
+        It raises a RuntimeError, if prometheus_client was imported before without the environment variable.
 
         *use_logging_level* must be of type: logging.{INFO, WARNING, ERROR, DEBUG}, defaults: DEBUG
         *use_optimizer* must be of type: bool (True for defaults, False for deactivating) or defaults: None
         *use_cors* must be of type: bool (True for defaults, False for deactivating) or defaults: None
         *use_default_error* must be of type: bool (True for defaults, False for deactivating) or defaults: None
-        *use_scheduler* must be of type: bool (True for defaults, False for deactivating) or defaults: None
+        *use_scheduler* must be of type: bool (True for defaults, False for deactivating), dict or defaults: None
+        If the key "lock_file" of the dict (or the environment variable SCHEDULER_LOCK_FILE) is set, only the worker process,
+        which holds the lock of this file, runs the scheduler. The others try again every "retry_interval" seconds (defaults to 30).
         *all* must be of type: bool (True for use all functions with defaults, False for deactivating all functions) or defaults: None
+
+        *use_profile* must be of type: bool (True logs the time and imported modules of every feature at startup) or defaults: None,
+        which uses the environment variable CONNEXION_PLUS_PROFILE. The steps are stored in #startup_profile.
         """
+        if use_profile is None:
+            use_profile = os.getenv("CONNEXION_PLUS_PROFILE", "").lower() in ("1", "true", "yes")
+
+        profile = StartupProfile() if use_profile else None
+
         if flaskName is None:
             flaskName = __name__
 
         super().__init__(flaskName, *args, **kwargs)
+        self.api_cls = SecuredFlaskApi
         logger = logging.getLogger("")
 
+        if profile is not None:
+            profile.mark("connexion")
+
         self.serviceName = name
         self.metrics = None
         self.tracing = None
@@ -51,6 +125,10 @@ class App(FlaskApp):
         self.cors = None
         self.default_errorhandler = None
         self.scheduler = None
+        self.startup_profile = None
+        self.tracing_handler = None
+        self.scheduler_election = None
+        self._pid = os.getpid()
 
         if all is not None and all is not False:
             use_tracer = True
@@ -107,29 +185,35 @@ class App(FlaskApp):
             for ex in default_exceptions:
                 self.app.register_error_handler(ex, self.default_errorhandler)
 
+            if profile is not None:
+                profile.mark("default_error")
+
         if use_scheduler is not None and use_scheduler is not False:
             logger.info("Add background scheduler to Flask")
             from flask_apscheduler import APScheduler
 
             self.scheduler = APScheduler()
             self.scheduler.init_app(self.app)
-            self.scheduler.start()
-
-        # add optimizer
-        if use_optimizer is not None and use_optimizer is not False:
-            logger.info("Add optimizer to Flask...")
-            from .Optimizer import FlaskOptimize
 
-            config = {"compress": False, "minify": False}
-            if isinstance(use_optimizer, dict):
-                config.update(use_optimizer)
+            config = use_scheduler if isinstance(use_scheduler, dict) else {}
+            lock_file = config.get("lock_file", os.getenv("SCHEDULER_LOCK_FILE"))
 
-            if isinstance(use_optimizer, bool) and use_optimizer:
-                config.update({"compress": True, "minify": True})
+            if lock_file:
+                # a preforking server starts an app per worker, but the jobs should run once
+                from .Prefork import LeaderElection
 
-            logger.info("use config {}.".format(config))
+                logger.info("elect the worker for the scheduler with {}.".format(lock_file))
+                self.scheduler_election = LeaderElection(
+                    lock_file, self._start_scheduler, config.get("retry_interval", 30))
+                self.scheduler_election.start()
+            else:
+                if "gunicorn" in sys.modules or "uwsgi" in sys.modules:
+                    logger.warning(
+                        "scheduler without lock_file: every worker of a preforking server runs the jobs.")
+                self.scheduler.start()
 
-            self.optimize = FlaskOptimize(self.app, config)
+            if profile is not None:
+                profile.mark("scheduler")
 
         # add CORS
         if use_cors is not None and use_cors is not False:
@@ -145,44 +229,59 @@ class App(FlaskApp):
 
             logger.info("CORS added.")
 
+            if profile is not None:
+                profile.mark("cors")
+
         # add prometheus
         if use_metric is not None and use_metric is not False:
-            # TODO: add configuration https://github.com/rycus86/prometheus_flask_exporter#configuration
+            config = use_metric if isinstance(use_metric, dict) else {}
+            options = {key: config[key] for key in ("path", "buckets", "default_labels", "excluded_paths") if key in config}
 
-            from prometheus_flask_exporter import PrometheusMetrics
+            group_by = config.get("group_by")
+            if group_by == "operation":
+                from .Metrics import group_by_operation
+
+                options["group_by"] = group_by_operation(self.app)
+            elif group_by is not None:
+                options["group_by"] = group_by
+
+            multiprocess = config.get("multiprocess", bool(os.getenv("PROMETHEUS_MULTIPROC_DIR")))
+            if multiprocess:
+                # every worker has its own counters, so a scrape of a single worker would be random
+                from .Metrics import configure_multiprocess
+
+                # before prometheus_client is imported, which chooses the storage of the metrics
+                directory = configure_multiprocess(multiprocess if isinstance(multiprocess, str) else None)
+
+                from prometheus_flask_exporter.multiprocess import MultiprocessInternalPrometheusMetrics
+
+                self.metrics = MultiprocessInternalPrometheusMetrics(self.app, **options)
+                logger.info("use multiprocess mode with {}.".format(directory))
+            else:
+                from prometheus_flask_exporter import PrometheusMetrics
+
+                self.metrics = PrometheusMetrics(self.app, **options)
 
-            self.metrics = PrometheusMetrics(self.app)
             logger.info("Add prometheus to Flask")
 
+            if profile is not None:
+                profile.mark("metrics")
+
         # add tracing
         if use_tracer is not None and use_tracer is not False:
             logger.info("Add opentracing to Flask...")
             # add tracing to all routes in flaskApp
-            from flask_opentracing import FlaskTracing
             import opentracing
-            from functools import wraps
-            from flask import request
-
-            def wrapper(fn):
-                @wraps(fn)
-                def request_func(*args, **kwargs):
-                    if request.path != "/metrics":
-                        return fn(*args, **kwargs)
-
-                return request_func
-
-            FlaskTracing._before_request_fn = wrapper(
-                FlaskTracing._before_request_fn)
-            FlaskTracing._after_request_fn = wrapper(
-                FlaskTracing._after_request_fn)
+            from .Tracing import ExcludingFlaskTracing, ExclusionMatcher
 
             config = None
             if not isinstance(use_tracer, opentracing.Tracer):
                 logger.info("use default one.")
                 from jaeger_client import Config as jConfig
+                from .Tracing import configure_sampler, default_sampler_config
 
                 tracer_config = {
-                    "sampler": {"type": "const", "param": 1, },
+                    "sampler": default_sampler_config,
                     "local_agent": {
                         "reporting_host": "jaeger-agent",
                         "reporting_port": 5775,
@@ -193,7 +292,9 @@ class App(FlaskApp):
                 if isinstance(use_tracer, dict):
                     tracer_config = use_tracer
 
-                if isinstance(use_metric, bool) and use_metric is True:
+                tracer_config = configure_sampler(tracer_config)
+
+                if use_metric is True or isinstance(use_metric, dict):
                     logger.info("Use metrics for tracer.")
                     from jaeger_client.metrics.prometheus import (
                         PrometheusMetricsFactory,
@@ -214,22 +315,111 @@ class App(FlaskApp):
             else:
                 logger.info("use given tracer config.")
 
-            tracer_obj = use_tracer if config is None else config.initialize_tracer()
-            self.tracing = FlaskTracing(tracer_obj, True, self.app)
+            if config is None:
+                tracer_obj = use_tracer
+            else:
+                # the spans are sent from a background thread, so the requests do not wait for the agent
+                from .Reporter import initialize_tracer
+
+                tracer_obj = initialize_tracer(config)
+            # probes and scrapes will not be traced, see connexion_plus.Tracing#ExclusionMatcher
+            self.tracing = ExcludingFlaskTracing(
+                tracer_obj, True, self.app, exclude=ExclusionMatcher.from_config(use_tracer))
 
-            # add tracer to everything to support spans through multiple microservices via rpc-calls
-            from opentracing_instrumentation.client_hooks import install_all_patches
+            # add tracer to the clients to support spans through multiple microservices via rpc-calls
+            from .Tracing import install_client_hooks
 
-            install_all_patches()
-            logger.info("All tracing relevant libs patched.")
+            install_client_hooks(use_tracer.get("patches") if isinstance(use_tracer, dict) else None)
 
             # add a TracingHandler for Logging
             from .TracingHandler import TracingHandler
 
-            th = TracingHandler(use_tracer)
-            th.setLevel(use_logging_level)
+            self.tracing_handler = TracingHandler(tracer_obj)
+            self.tracing_handler.setLevel(use_logging_level)
+            self.tracing_handler.init_app(self.app, self.tracing)
+
+            logging.getLogger("").addHandler(self.tracing_handler)
+
+            # registered after the TracingHandler, so it runs before it after the request and the handler sees the final sampling decision
+            if not isinstance(use_tracer, dict) or use_tracer.get("sample_on_error", True):
+                from .Tracing import sample_on_error
+
+                sample_on_error(self.app, self.tracing)
 
-            logging.getLogger("").addHandler(th)
             logger.info("Finished Tracer adding.")
 
+            if profile is not None:
+                profile.mark("tracer")
+
+        # add optimizer
+        # set up after metrics and tracing, because a cache hit is returned from its before_request
+        # and flask skips all before_request functions, which were registered after it
+        if use_optimizer is not None and use_optimizer is not False:
+            logger.info("Add optimizer to Flask...")
+            from .Optimizer import FlaskOptimize
+
+            config = {"compress": False, "minify": False}
+            if isinstance(use_optimizer, dict):
+                config.update(use_optimizer)
+
+            if isinstance(use_optimizer, bool) and use_optimizer:
+                config.update({"compress": True, "minify": True})
+
+            logger.info("use config {}.".format(config))
+
+            self.optimize = FlaskOptimize(self.app, config)
+
+            if self.metrics is not None:
+                self.optimize.init_metrics(self.metrics.registry)
+                logger.info("Add optimizer metrics to prometheus")
+
+            if profile is not None:
+                profile.mark("optimizer")
+
+        if profile is not None:
+            self.startup_profile = profile.steps
+            logger.info("Startup profile of Connexion-Plus:\n{}".format(profile.report()))
+
+        # threads and connections do not survive a fork of a preforking server
+        from .Prefork import register_after_fork
+
+        register_after_fork(self.post_fork)
+
         logger.info("--- Finished Connexion-Plus ---")
+
+    def _start_scheduler(self):
+        if not self.scheduler.running:
+            self.scheduler.start()
+
+    def post_fork(self):
+        """
+        Re-creates the resources, which cannot be shared with a forked worker process:
+        the reporter thread of the tracer, the connections and threads of the cache and the election of the scheduler.
+
+        It is called automatically after os.fork. Call it from the post fork hook of your server, if it forks in another way.
+        """
+        pid = os.getpid()
+        if pid == self._pid:
+            return
+        self._pid = pid
+
+        if self.optimize is not None:
+            self.optimize.after_fork()
+
+        if self.tracing is not None:
+            reporter = getattr(self.tracing.tracer, "reporter", None)
+            if hasattr(reporter, "after_fork"):
+                reporter.after_fork()
+
+        if self.tracing_handler is not None:
+            self.tracing_handler.after_fork()
+
+        if self.scheduler_election is not None:
+            self.scheduler_election.after_fork()
+        elif self.scheduler is not None:
+            # the thread of the scheduler stays in the parent process
+            logging.getLogger("").warning(
+                "scheduler without lock_file: the jobs do not run in worker {}.".format(pid))
+
+        logger = logging.getLogger("")
+        logger.info("Connexion-Plus: resources re-created for worker {}.".format(pid))
@@ -0,0 +1,938 @@
+import os
+import copy
+import time
+import uuid
+import struct
+import hashlib
+import json
+import heapq
+import bisect
+import threading
+from collections import OrderedDict
+from .Util import mark_untraced
+import logging
+
+logger = logging.getLogger('')
+
+
+def content_digest(body):
+    """
+    Returns a fast hash of the given body as hex string.
+    """
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class CacheEntry(object):
+    """
+    Compact record of a cached response, which can be replayed into fresh responses.
+
+    The body is stored uncompressed, *variants* holds the compressed bodies by their content encoding.
+
+    The digest of the body will be calculated on first access and stored with the entry.
+    *delta* is the time in seconds, which was needed to compute the response. It is used for the early refresh.
+
+    Binary format (big endian), see #dumps and #loads:
+        magic "CPCE", version (B), status (H), expires (d), delta (d), headers (H), variants (B)
+        digest length (B), digest
+        headers: name length (H), name, value length (H), value
+        body length (I), body
+        variants: encoding length (B), encoding, body length (I), body
+    """
+
+    MAGIC = b"CPCE"
+    VERSION = 3
+
+    # these headers will be set by the response itself or by the optimizer
+    skip_headers = frozenset(["content-length", "content-encoding",
+                              "transfer-encoding", "connection", "date", "set-cookie"])
+
+    _head = struct.Struct(">4sBHddHB")
+    _short = struct.Struct(">H")
+    _byte = struct.Struct(">B")
+    _long = struct.Struct(">I")
+
+    __slots__ = ("status", "headers", "body", "variants", "expires", "delta", "_digest")
+
+    def __init__(self, status, headers, body, variants=None, expires=0, digest=None, delta=0):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.variants = variants if variants is not None else {}
+        self.expires = expires
+        self.delta = delta
+        self._digest = digest
+
+    @property
+    def digest(self):
+        """
+        Returns the digest of the uncompressed body.
+        """
+        if self._digest is None:
+            self._digest = content_digest(self.body)
+        return self._digest
+
+    @property
+    def size(self):
+        """
+        Returns the size of all bodies in bytes.
+        """
+        return len(self.body) + sum(len(v) for v in self.variants.values())
+
+    @property
+    def mimetype(self):
+        """
+        Returns the mimetype of the stored response or None.
+        """
+        value = self.header("Content-Type")
+        return value.split(";")[0].strip() if value is not None else None
+
+    def header(self, name):
+        """
+        Returns the value of the given stored header or None.
+        """
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+    @classmethod
+    def from_response(cls, resp, timeout, delta=0):
+        """
+        Creates an entry from the uncompressed body and the headers of the given response.
+        """
+        headers = tuple((k, v) for k, v in resp.headers
+                        if k.lower() not in cls.skip_headers)
+        return cls(resp.status_code, headers, resp.get_data(), expires=time.time() + timeout, delta=delta)
+
+    def copy(self, variants=None):
+        """
+        Returns a copy of this entry, which shares the bodies. *variants* replaces the variants of the copy.
+        """
+        return CacheEntry(self.status, self.headers, self.body,
+                          dict(self.variants) if variants is None else variants,
+                          self.expires, self.digest, self.delta)
+
+    def to_response(self, encoding=None, vary=None):
+        """
+        Creates a new response from this entry. The body will not be copied.
+
+        If *encoding* is given, the corresponding variant will be used as body.
+        *vary* is a list of request headers, which will be merged into the stored Vary header.
+        """
+        from flask import Response
+
+        headers = list(self.headers)
+
+        if encoding is None:
+            body = self.body
+        else:
+            body = self.variants[encoding]
+            headers.append(("Content-Encoding", encoding))
+
+        resp = Response(body, status=self.status, headers=headers)
+        for header in vary or ():
+            resp.vary.add(header)
+
+        return resp
+
+    def dumps(self):
+        """
+        Serializes this entry into the binary format.
+        """
+        digest = self.digest.encode("ascii")
+        parts = [self._head.pack(self.MAGIC, self.VERSION, self.status, self.expires, self.delta,
+                                 len(self.headers), len(self.variants)),
+                 self._byte.pack(len(digest)), digest]
+
+        for name, value in self.headers:
+            for field in (name.encode("latin-1"), value.encode("latin-1")):
+                parts.append(self._short.pack(len(field)))
+                parts.append(field)
+
+        parts.append(self._long.pack(len(self.body)))
+        parts.append(self.body)
+
+        for encoding, body in self.variants.items():
+            encoding = encoding.encode("ascii")
+            parts.append(self._byte.pack(len(encoding)))
+            parts.append(encoding)
+            parts.append(self._long.pack(len(body)))
+            parts.append(body)
+
+        return b"".join(parts)
+
+    @classmethod
+    def loads(cls, data):
+        """
+        Deserializes an entry from the binary format. Raises ValueError, if the data is not a valid entry.
+        """
+        view = memoryview(data)
+
+        try:
+            magic, version, status, expires, delta, header_count, variant_count = cls._head.unpack_from(
+                view, 0)
+        except struct.error:
+            raise ValueError("Not a valid cache entry.")
+
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("Not a valid cache entry.")
+
+        offset = cls._head.size
+
+        def read(length_struct):
+            nonlocal offset
+            length, = length_struct.unpack_from(view, offset)
+            offset += length_struct.size
+            field = view[offset:offset + length]
+            if len(field) != length:
+                raise ValueError("Cache entry is truncated.")
+            offset += length
+            return field
+
+        try:
+            digest = str(read(cls._byte), "ascii") or None
+
+            headers = []
+            for _ in range(header_count):
+                name = str(read(cls._short), "latin-1")
+                value = str(read(cls._short), "latin-1")
+                headers.append((name, value))
+
+            body = bytes(read(cls._long))
+
+            variants = {}
+            for _ in range(variant_count):
+                encoding = str(read(cls._byte), "ascii")
+                variants[encoding] = bytes(read(cls._long))
+        except struct.error:
+            raise ValueError("Cache entry is truncated.")
+
+        return cls(status, tuple(headers), body, variants, expires, digest, delta)
+
+
+class Lease(object):
+    """
+    Permission to recompute the entry of a key. Other requests wait, until it is released.
+    """
+
+    __slots__ = ("id", "event")
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.event = threading.Event()
+
+
+class CacheBackend(object):
+    """
+    Interface for the storage, which is used by FlaskOptimize to cache responses.
+
+    Implement this class, if you want to use your own storage and give an instance to FlaskOptimize via the *cache* parameter.
+
+    The leases (#acquire, #release and #wait) are implemented in-process, so only one thread per key recomputes an entry.
+    Shared backends should extend them to work across processes.
+    """
+
+    _leases_lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the value for the given key or None, if there is no valid entry.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, timeout, tags=()):
+        """
+        Stores the value for the given key for *timeout* seconds.
+        *tags* are names for groups of entries, which can be invalidated together with #invalidate_tags.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """
+        Removes the entry for the given key. Returns True, if there was an entry.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        raise NotImplementedError
+
+    def invalidate_tags(self, tags):
+        """
+        Removes all entries, which were stored with one of the given tags. Returns the number of removed entries.
+        """
+        raise NotImplementedError
+
+    def invalidate_prefix(self, prefix):
+        """
+        Removes all entries, whose key starts with the given prefix. Returns the number of removed entries.
+        """
+        raise NotImplementedError
+
+    def purge_expired(self):
+        """
+        Removes all expired entries and returns the number of removed entries.
+        Backends, which expire their entries on their own, do not need to implement this.
+        """
+        return 0
+
+    def stats(self):
+        """
+        Returns a dict with the counters of this backend.
+        """
+        return {}
+
+    def after_fork(self):
+        """
+        Resets the state of this process in a forked child process, see connexion_plus.Prefork.
+        The leases of the parent are dropped, because its threads will never release them in the child.
+        """
+        self._leases_lock = threading.Lock()
+        self.__dict__["_leases"] = {}
+
+    @property
+    def leases(self):
+        # created lazily, so implementations do not need to call this constructor
+        return self.__dict__.setdefault("_leases", {})
+
+    def acquire(self, key, timeout):
+        """
+        Tries to get the lease to recompute the entry for the given key for *timeout* seconds.
+        Returns a Lease or None, if someone else has it.
+        """
+        with self._leases_lock:
+            if key in self.leases:
+                return None
+
+            lease = Lease()
+            self.leases[key] = lease
+            return lease
+
+    def release(self, key, lease):
+        """
+        Releases the given lease for the given key and wakes up all waiting requests.
+        """
+        with self._leases_lock:
+            if self.leases.get(key) is lease:
+                del self.leases[key]
+
+        lease.event.set()
+
+    def wait(self, key, timeout):
+        """
+        Waits at most *timeout* seconds, until the lease for the given key was released.
+        """
+        with self._leases_lock:
+            lease = self.leases.get(key)
+
+        if lease is not None:
+            lease.event.wait(timeout)
+
+
+class LocalCache(CacheBackend):
+    """
+    In-process cache with a bounded number of entries and a bounded size in bytes.
+
+    The least recently used entries will be evicted, if one of the limits is reached. Expired entries will be removed, when they are accessed.
+    Lookups, stores and evictions are O(1). The keys are indexed by tag, so #invalidate_tags only touches the affected entries.
+    The sorted index for #invalidate_prefix is built on its first call and the new keys are merged into it on the following calls,
+    so caches without prefix lookups (e.g. the near-cache) never pay for it.
+
+    *sizeof* is used to calculate the size of a value in bytes, defaults to the size attribute of the value or its len.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof if sizeof is not None else self._sizeof
+
+        # key -> (value, expires, size, tags), ordered from least to most recently used
+        self._data = OrderedDict()
+        # tag -> set of keys
+        self._tags = {}
+        # keys in sorted order for the prefix lookup or None, if it was never needed. It can contain removed keys.
+        self._keys = None
+        # keys, which were stored after the sorted index was built
+        self._new_keys = set()
+        self._lock = threading.RLock()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and item[1] > time.time()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is None:
+                self.misses += 1
+                return None
+
+            if item[1] <= time.time():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, timeout, tags=()):
+        size = self.sizeof(value)
+        tags = tuple(tags)
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+            if size > self.max_bytes:
+                logger.debug(
+                    "LocalCache: entry with {} bytes is bigger than the cache.".format(size))
+                return
+
+            self._data[key] = (value, time.time() + timeout, size, tags)
+            self._bytes += size
+            if self._keys is not None:
+                self._new_keys.add(key)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key not in self._data:
+                return False
+
+            self._remove(key)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+            self._keys = None
+            self._new_keys.clear()
+            self._bytes = 0
+
+    def invalidate_tags(self, tags):
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys.update(self._tags.get(tag, ()))
+
+            for key in keys:
+                self._remove(key)
+
+        return len(keys)
+
+    def invalidate_prefix(self, prefix):
+        with self._lock:
+            keys = self._sorted_keys()
+            start = bisect.bisect_left(keys, prefix)
+            end = start
+            while end < len(keys) and keys[end].startswith(prefix):
+                end += 1
+
+            removed = 0
+            for key in keys[start:end]:
+                if key in self._data:
+                    self._remove(key)
+                    removed += 1
+            del keys[start:end]
+
+        return removed
+
+    def purge_expired(self):
+        now = time.time()
+
+        with self._lock:
+            expired = [key for key, item in self._data.items()
+                       if item[1] <= now]
+
+            for key in expired:
+                self._remove(key)
+
+            self.expirations += len(expired)
+
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._data),
+                "bytes": self._bytes,
+            }
+
+    def after_fork(self):
+        super().after_fork()
+        # the entries are copied into the child, but the lock could be held by a thread of the parent
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _sizeof(value):
+        size = getattr(value, "size", None)
+        return size if size is not None else len(value)
+
+    def _sorted_keys(self):
+        """
+        Returns the sorted index of the keys and merges the new keys into it.
+        """
+        if self._keys is None:
+            self._keys = sorted(self._data)
+            self._new_keys.clear()
+
+        elif self._new_keys:
+            # removed keys are dropped and the keys, which were stored again, are merged only once
+            keys = []
+            for key in heapq.merge(self._keys, sorted(self._new_keys)):
+                if key in self._data and (not keys or keys[-1] != key):
+                    keys.append(key)
+
+            self._keys = keys
+            self._new_keys.clear()
+
+        return self._keys
+
+    def _remove(self, key):
+        _, _, size, tags = self._data.pop(key)
+        self._bytes -= size
+
+        for tag in tags:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+
+_redis_pools = {}
+_redis_pools_lock = threading.Lock()
+
+
+def get_redis_client(host=None, port=None, db=0):
+    """
+    Returns a redis client, which shares one connection pool per server with all other clients of this process.
+
+    *host* and *port* defaults to the environment variables REDIS_HOST and REDIS_PORT.
+    """
+    from redis import Redis, ConnectionPool
+
+    host = host or os.getenv("REDIS_HOST", "localhost")
+    port = int(port or os.getenv("REDIS_PORT", "6379"))
+    key = (host, port, db)
+
+    with _redis_pools_lock:
+        pool = _redis_pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(host=host, port=port, db=db,
+                                  health_check_interval=30)
+            _redis_pools[key] = pool
+
+    return Redis(connection_pool=pool)
+
+
+class RedisCache(CacheBackend):
+    """
+    Cache, which is shared between all processes through redis.
+
+    The entries are stored in the binary format of CacheEntry and expire with the native redis expiry.
+    Every lookup needs a single round trip, which fetches the value and its remaining time to live.
+
+    A small LocalCache is used as near-cache in front of redis, so hot entries do not need a round trip at all.
+    They will be held for *near_timeout* seconds at most. Set *near_entries* to 0 to disable it.
+    Invalidations are published via redis pub/sub, so the near-caches of all other processes drop the entries immediately.
+
+    Entries, tags and leases have their own namespace below *prefix* ("entry:", "tag:" and "lock:"), so keys and tags cannot collide.
+    Every tag is a sorted set of keys in redis, scored by their expiry, so #invalidate_tags only touches the entries of the tags.
+    All keys are indexed in a sorted set with the same score, so #invalidate_prefix finds them with ZRANGEBYLEX without scanning redis.
+    A second sorted set scores the keys by their expiry, so the expired keys are removed from the index by #purge_expired,
+    which is called after every *prune_interval* stores, too.
+    """
+
+    prune_interval = 1000
+
+    def __init__(self, client, prefix="FlaskOptimize_Caching", near_entries=256, near_timeout=1):
+        from redis.exceptions import RedisError
+
+        self._errors = RedisError
+        # the cache is internal traffic, so its calls will not be traced (see connexion_plus.Tracing)
+        self.client = mark_untraced(self._binary_client(client))
+        self.prefix = "{}:".format(prefix)
+        self.near_timeout = near_timeout
+        self.near_cache = LocalCache(max_entries=near_entries) if near_entries > 0 and near_timeout > 0 else None
+        self.channel = self.prefix + "invalidate"
+        self.index_key = self.prefix + "index:keys"
+        self.expiry_key = self.prefix + "index:expires"
+
+        self.hits = 0
+        self.misses = 0
+        self.near_hits = 0
+        self.errors = 0
+        self._stores = 0
+
+        self._subscriber = None
+        if self.near_cache is not None:
+            self.subscribe()
+
+    @staticmethod
+    def _binary_client(client):
+        """
+        The entries are binary, so the client must not decode the responses.
+        Returns a new client with the same settings, which does not decode.
+        """
+        pool = getattr(client, "connection_pool", None)
+        if pool is None or not pool.connection_kwargs.get("decode_responses"):
+            # a copy with the same pool, so the given client is not changed
+            return copy.copy(client)
+
+        from redis import Redis, ConnectionPool
+
+        kwargs = dict(pool.connection_kwargs)
+        kwargs["decode_responses"] = False
+        return Redis(connection_pool=ConnectionPool(connection_class=pool.connection_class, **kwargs))
+
+    def get(self, key):
+        if self.near_cache is not None:
+            entry = self.near_cache.get(key)
+            if entry is not None:
+                self.near_hits += 1
+                self.hits += 1
+                return entry
+
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.get(self._entry_key(key))
+            pipe.pttl(self._entry_key(key))
+            value, ttl = pipe.execute()
+        except self._errors as e:
+            logger.warning("RedisCache: lookup failed: {}".format(e))
+            self.errors += 1
+            self.misses += 1
+            return None
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        try:
+            entry = CacheEntry.loads(value)
+        except ValueError:
+            logger.warning("RedisCache: invalid entry for key {}.".format(key))
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        if self.near_cache is not None and ttl is not None and ttl > 0:
+            self.near_cache.set(key, entry, min(
+                self.near_timeout, ttl / 1000.0))
+
+        return entry
+
+    def set(self, key, value, timeout, tags=()):
+        now = time.time()
+
+        try:
+            # a transaction, so a concurrent #invalidate_prefix cannot see the entry without its index
+            pipe = self.client.pipeline()
+            pipe.set(self._entry_key(key), value.dumps(),
+                     px=max(1, int(timeout * 1000)))
+            pipe.zadd(self.index_key, {key: 0})
+            pipe.zadd(self.expiry_key, {key: now + timeout})
+            for tag in tags:
+                # drop the expired keys, so the set only grows with the living entries
+                pipe.zadd(self._tag_key(tag), {key: now + timeout})
+                pipe.zremrangebyscore(self._tag_key(tag), "-inf", now)
+            pipe.execute()
+        except self._errors as e:
+            logger.warning("RedisCache: store failed: {}".format(e))
+            self.errors += 1
+            return
+
+        if self.near_cache is not None:
+            self.near_cache.set(key, value, min(self.near_timeout, timeout))
+
+        self._stores += 1
+        if self._stores % self.prune_interval == 0:
+            self.purge_expired()
+
+    def delete(self, key):
+        if self.near_cache is not None:
+            self.near_cache.delete(key)
+
+        try:
+            deleted = self._delete_entries([key]) > 0
+        except self._errors as e:
+            logger.warning("RedisCache: delete failed: {}".format(e))
+            self.errors += 1
+            return False
+
+        self.publish(keys=[key])
+        return deleted
+
+    def clear(self):
+        if self.near_cache is not None:
+            self.near_cache.clear()
+
+        # the leases are kept, because their requests are still running
+        pipe = self.client.pipeline(transaction=False)
+        for namespace in ("entry:", "tag:"):
+            for key in self.client.scan_iter(match=self.prefix + namespace + "*", count=1000):
+                pipe.delete(key)
+        pipe.delete(self.index_key, self.expiry_key)
+        pipe.execute()
+
+        self.publish(prefix="")
+
+    def invalidate_tags(self, tags):
+        tag_keys = [self._tag_key(tag) for tag in tags]
+        if not tag_keys:
+            return 0
+
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for tag_key in tag_keys:
+                pipe.zrange(tag_key, 0, -1)
+            keys = {str(key, "utf-8") for found in pipe.execute() for key in found}
+
+            deleted = self._delete_entries(keys, tag_keys)
+        except self._errors as e:
+            logger.warning("RedisCache: invalidation failed: {}".format(e))
+            self.errors += 1
+            return 0
+
+        if keys:
+            if self.near_cache is not None:
+                for key in keys:
+                    self.near_cache.delete(key)
+            self.publish(keys=sorted(keys))
+
+        return deleted
+
+    def invalidate_prefix(self, prefix):
+        if self.near_cache is not None:
+            self.near_cache.invalidate_prefix(prefix)
+
+        # no valid utf-8 contains the byte 0xff, so it follows all keys with the prefix
+        start = b"[" + prefix.encode("utf-8")
+
+        try:
+            keys = [str(key, "utf-8") for key in self.client.zrangebylex(self.index_key, start, start + b"\xff")]
+            deleted = self._delete_entries(keys)
+        except self._errors as e:
+            logger.warning("RedisCache: invalidation failed: {}".format(e))
+            self.errors += 1
+            return 0
+
+        self.publish(prefix=prefix)
+        return deleted
+
+    def purge_expired(self, limit=1000):
+        """
+        Removes at most *limit* expired keys from the index. The entries are expired by redis itself.
+        Returns the number of removed keys.
+        """
+        from redis.exceptions import WatchError
+
+        try:
+            with self.client.pipeline() as pipe:
+                # the index is only changed, if no key was stored again in the meantime
+                pipe.watch(self.expiry_key)
+                expired = pipe.zrangebyscore(self.expiry_key, "-inf", time.time(), start=0, num=limit)
+                if not expired:
+                    pipe.unwatch()
+                    return 0
+
+                pipe.multi()
+                pipe.zrem(self.index_key, *expired)
+                pipe.zrem(self.expiry_key, *expired)
+                pipe.execute()
+        except WatchError:
+            return 0
+        except self._errors as e:
+            logger.warning("RedisCache: purge failed: {}".format(e))
+            self.errors += 1
+            return 0
+
+        return len(expired)
+
+    def publish(self, keys=None, prefix=None):
+        """
+        Tells the other processes to drop the given keys or all keys with the given prefix from their near-cache.
+        """
+        message = {}
+        if keys:
+            message["keys"] = keys
+        if prefix is not None:
+            message["prefix"] = prefix
+
+        try:
+            self.client.publish(self.channel, json.dumps(message))
+        except self._errors as e:
+            logger.warning("RedisCache: publish failed: {}".format(e))
+            self.errors += 1
+
+    def subscribe(self):
+        """
+        Starts a background thread, which applies the invalidations of other processes to the near-cache.
+        """
+        try:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: self._on_invalidate})
+            self._subscriber = pubsub.run_in_thread(
+                sleep_time=1, daemon=True, exception_handler=self._on_subscriber_error)
+        except self._errors as e:
+            logger.warning("RedisCache: subscribe failed: {}".format(e))
+            self.errors += 1
+
+    def close(self):
+        """
+        Stops the background thread of the near-cache.
+        """
+        if self._subscriber is not None:
+            self._subscriber.stop()
+            self._subscriber = None
+
+    def after_fork(self):
+        """
+        The connection pool reconnects on its own in the child, but the subscriber thread of the near-cache
+        does not exist there. So the near-cache is cleared and subscribes again.
+        """
+        super().after_fork()
+
+        if self.near_cache is not None:
+            # the pubsub connection belongs to the parent and must not be closed here
+            self._subscriber = None
+            self.near_cache.after_fork()
+            self.near_cache.clear()
+            self.subscribe()
+
+    def _on_invalidate(self, message):
+        try:
+            data = json.loads(message["data"])
+        except ValueError:
+            logger.warning("RedisCache: invalid message on {}.".format(self.channel))
+            return
+
+        for key in data.get("keys", ()):
+            self.near_cache.delete(key)
+
+        prefix = data.get("prefix")
+        if prefix is not None:
+            self.near_cache.invalidate_prefix(prefix)
+
+    def _on_subscriber_error(self, e, pubsub, thread):
+        logger.warning("RedisCache: subscriber failed: {}".format(e))
+        self.errors += 1
+
+        # drop everything, which could have missed an invalidation, and reconnect with the next poll
+        self.near_cache.clear()
+        time.sleep(1)
+
+    def _delete_entries(self, keys, tag_keys=()):
+        """
+        Deletes the entries of the given keys with their index and the given tags in one transaction.
+        Returns the number of deleted entries.
+        """
+        if not keys and not tag_keys:
+            return 0
+
+        pipe = self.client.pipeline()
+        if keys:
+            pipe.delete(*[self._entry_key(key) for key in keys])
+            pipe.zrem(self.index_key, *keys)
+            pipe.zrem(self.expiry_key, *keys)
+        if tag_keys:
+            pipe.delete(*tag_keys)
+        results = pipe.execute()
+        return results[0] if keys else 0
+
+    def _entry_key(self, key):
+        return self.prefix + "entry:" + key
+
+    def _tag_key(self, tag):
+        return self.prefix + "tag:" + tag
+
+    def _lock_key(self, key):
+        return self.prefix + "lock:" + key
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "near_hits": self.near_hits,
+            "errors": self.errors,
+        }
+
+    def acquire(self, key, timeout):
+        # only one thread per process asks redis for the lease
+        lease = super().acquire(key, timeout)
+        if lease is None:
+            return None
+
+        try:
+            if self.client.set(self._lock_key(key), lease.id, nx=True, px=max(1, int(timeout * 1000))):
+                return lease
+        except self._errors as e:
+            logger.warning("RedisCache: lease failed: {}".format(e))
+            self.errors += 1
+            return lease
+
+        super().release(key, lease)
+        return None
+
+    def release(self, key, lease):
+        from redis.exceptions import WatchError
+
+        lock_key = self._lock_key(key)
+
+        try:
+            with self.client.pipeline() as pipe:
+                # delete the lock only, if it was not taken over by someone else after its expiry
+                pipe.watch(lock_key)
+                if pipe.get(lock_key) == lease.id.encode("ascii"):
+                    pipe.multi()
+                    pipe.delete(lock_key)
+                    pipe.execute()
+                else:
+                    pipe.unwatch()
+        except WatchError:
+            pass
+        except self._errors as e:
+            logger.warning("RedisCache: release failed: {}".format(e))
+            self.errors += 1
+
+        super().release(key, lease)
+
+    def wait(self, key, timeout, interval=0.05):
+        deadline = time.time() + timeout
+        super().wait(key, timeout)
+
+        # another process has the lease
+        try:
+            while time.time() < deadline and self.client.exists(self._lock_key(key)):
+                time.sleep(interval)
+        except self._errors as e:
+            logger.warning("RedisCache: wait failed: {}".format(e))
+            self.errors += 1
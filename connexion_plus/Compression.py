@@ -0,0 +1,250 @@
+import zlib
+import threading
+from functools import lru_cache
+import logging
+
+logger = logging.getLogger('')
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+@lru_cache(maxsize=256)
+def parse_accept_encoding(header):
+    """
+    Parses the given Accept-Encoding header into a dict of encoding to its q-value.
+    """
+    encodings = {}
+
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+
+        encodings[token] = q
+
+    return encodings
+
+
+class Compressor(object):
+    """
+    Compresses response bodies with gzip, br (if brotli is installed) or zstd (if zstandard is installed).
+
+    *levels* is a dict of encoding to compression level, missing encodings use #default_levels.
+    *min_size* is the minimum body size in bytes, smaller bodies will not be compressed, because it does not pay off.
+    *mimetypes* is the allowlist of mimetypes, which will be compressed. Mimetypes with +json and +xml suffixes are always allowed.
+    *encodings* is the order of preference, if the client accepts multiple encodings with the same q-value.
+    """
+
+    default_levels = {"gzip": 6, "br": 4, "zstd": 3}
+
+    default_mimetypes = (
+        "text/html",
+        "text/css",
+        "text/plain",
+        "text/xml",
+        "text/csv",
+        "text/javascript",
+        "application/json",
+        "application/javascript",
+        "application/xml",
+        "application/x-yaml",
+        "application/yaml",
+        "image/svg+xml",
+    )
+
+    default_encodings = ("br", "zstd", "gzip")
+
+    def __init__(self, levels=None, min_size=500, mimetypes=None, encodings=None):
+        self.levels = dict(self.default_levels)
+        if levels is not None:
+            self.levels.update(levels)
+
+        self.min_size = min_size
+        self.mimetypes = frozenset(
+            mimetypes if mimetypes is not None else self.default_mimetypes)
+
+        available = self.available_encodings()
+        self.encodings = tuple(e for e in (encodings or self.default_encodings)
+                               if e in available)
+
+        self._local = threading.local()
+        self._negotiate = lru_cache(maxsize=256)(self._negotiate_uncached)
+
+    @staticmethod
+    def available_encodings():
+        """
+        Returns the encodings, which can be used with the installed modules.
+        """
+        available = ["gzip"]
+        if brotli is not None:
+            available.append("br")
+        if zstandard is not None:
+            available.append("zstd")
+        return available
+
+    def negotiate(self, accept_encoding):
+        """
+        Returns the best encoding for the given Accept-Encoding header or None, if the body should not be compressed.
+        """
+        if not accept_encoding:
+            return None
+
+        return self._negotiate(accept_encoding)
+
+    def _negotiate_uncached(self, accept_encoding):
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get("*", 0.0)
+
+        best, best_q = None, 0.0
+        for encoding in self.encodings:
+            q = accepted.get(encoding, wildcard)
+            if q > best_q:
+                best, best_q = encoding, q
+
+        # the client prefers the uncompressed body
+        if best is not None and accepted.get("identity", 0.0) > best_q:
+            return None
+
+        return best
+
+    def compressible(self, mimetype, size=None):
+        """
+        Returns True, if a body of the given mimetype and size (None for unknown size) should be compressed.
+        """
+        if size is not None and size < self.min_size:
+            return False
+
+        mimetype = (mimetype or "").split(";")[0].strip().lower()
+        return (
+            mimetype in self.mimetypes
+            or mimetype.endswith("+json")
+            or mimetype.endswith("+xml")
+        )
+
+    def compress(self, body, encoding):
+        """
+        Returns the given body compressed with the given encoding.
+        """
+        if encoding == "gzip":
+            # wbits 31 writes a gzip header without timestamp, so the output is deterministic
+            c = zlib.compressobj(self.levels["gzip"], zlib.DEFLATED, 31)
+            return c.compress(body) + c.flush()
+
+        if encoding == "br" and brotli is not None:
+            return brotli.compress(body, quality=self.levels["br"])
+
+        if encoding == "zstd" and zstandard is not None:
+            return self._zstd().compress(body)
+
+        raise ValueError("Unsupported content encoding: {}".format(encoding))
+
+    def compressobj(self, encoding):
+        """
+        Returns an incremental compressor for the given encoding.
+        """
+        if encoding == "gzip":
+            return _ZlibStream(zlib.compressobj(self.levels["gzip"], zlib.DEFLATED, 31))
+
+        if encoding == "br" and brotli is not None:
+            return _BrotliStream(brotli.Compressor(quality=self.levels["br"]))
+
+        if encoding == "zstd" and zstandard is not None:
+            return _ZstdStream(zstandard.ZstdCompressor(level=self.levels["zstd"]).compressobj())
+
+        raise ValueError("Unsupported content encoding: {}".format(encoding))
+
+    def stream(self, chunks, encoding, flush_size=64 * 1024):
+        """
+        Compresses the given iterable of byte chunks incrementally and yields the compressed chunks.
+
+        The compressor will be flushed after *flush_size* bytes of input at least, so the client gets the data
+        continuously and the buffered data is bounded. The given iterable will be closed at the end.
+        """
+        c = self.compressobj(encoding)
+        pending = 0
+
+        try:
+            for chunk in chunks:
+                data = c.compress(chunk)
+                pending += len(chunk)
+
+                if pending >= flush_size:
+                    data += c.flush()
+                    pending = 0
+
+                if data:
+                    yield data
+
+            yield c.finish()
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+    def _zstd(self):
+        # ZstdCompressor instances must not be shared between threads
+        c = getattr(self._local, "zstd", None)
+        if c is None:
+            c = zstandard.ZstdCompressor(level=self.levels["zstd"])
+            self._local.zstd = c
+        return c
+
+
+class _ZlibStream(object):
+    def __init__(self, c):
+        self._c = c
+
+    def compress(self, data):
+        return self._c.compress(data)
+
+    def flush(self):
+        return self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._c.flush(zlib.Z_FINISH)
+
+
+class _BrotliStream(object):
+    def __init__(self, c):
+        self._c = c
+
+    def compress(self, data):
+        return self._c.process(data)
+
+    def flush(self):
+        return self._c.flush()
+
+    def finish(self):
+        return self._c.finish()
+
+
+class _ZstdStream(object):
+    def __init__(self, c):
+        self._c = c
+
+    def compress(self, data):
+        return self._c.compress(data)
+
+    def flush(self):
+        return self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._c.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
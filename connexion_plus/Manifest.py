@@ -0,0 +1,95 @@
+"""
+Resolves all operations of an OpenAPI specification with the MultipleResourceResolver ahead of time and writes
+the manifest ("METHOD /path" -> "module:function"), which can be given to the resolver as resolution_table:
+
+    python -m connexion_plus.Manifest openapi.yaml --module api --output manifest.json
+
+The controllers have to be importable from the current directory. If an operation cannot be resolved,
+it is printed and the command exits with 1, so you can use it in your CI.
+"""
+import sys
+import json
+import logging
+import argparse
+from types import SimpleNamespace
+
+from connexion.exceptions import ResolverError
+
+from .MultipleResourceResolver import MultipleResourceResolver
+from .Util import load_oai
+
+logger = logging.getLogger('')
+
+methods = ("get", "put", "post", "delete", "options", "head", "patch", "trace")
+
+
+def spec_operations(spec):
+    """
+    Yields a lightweight operation for every operation in the given specification,
+    which has everything the resolvers need: method, path, operation_id and router_controller.
+    """
+    controller_key = "x-openapi-router-controller" if "openapi" in spec else "x-swagger-router-controller"
+
+    for path, item in (spec.get("paths") or {}).items():
+        for method, operation in item.items():
+            if method not in methods:
+                continue
+
+            yield SimpleNamespace(
+                method=method,
+                path=path,
+                operation_id=operation.get("operationId"),
+                router_controller=operation.get(controller_key),
+            )
+
+
+def build_manifest(specs, default_module_name, collection_endpoint_name="search"):
+    """
+    Resolves all operations of the given specifications (dicts) and returns the manifest and the list of the unresolved operations.
+    """
+    resolver = MultipleResourceResolver(default_module_name, collection_endpoint_name)
+    unresolved = []
+
+    for spec in specs:
+        for operation in spec_operations(spec):
+            try:
+                resolver.resolve(operation)
+            except ResolverError:
+                unresolved.append("{} {}".format(operation.method.upper(), operation.path))
+
+    return resolver.resolution_table, unresolved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m connexion_plus.Manifest",
+        description="Writes the resolution manifest of the MultipleResourceResolver for OpenAPI specifications.")
+    parser.add_argument("specs", nargs="+", help="files or urls of the specifications")
+    parser.add_argument("--module", default="api", help="default module name of the resolver (default: api)")
+    parser.add_argument("--collection-endpoint-name", default="search",
+                        help="function name of the collection endpoints (default: search)")
+    parser.add_argument("--output", help="path of the manifest (default: stdout)")
+    args = parser.parse_args(argv)
+
+    # the controllers are imported like the app does it
+    if "" not in sys.path:
+        sys.path.insert(0, "")
+
+    manifest, unresolved = build_manifest(load_oai(args.specs), args.module, args.collection_endpoint_name)
+
+    data = json.dumps(manifest, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(data)
+    else:
+        print(data)
+
+    for key in unresolved:
+        print("unresolved: {}".format(key), file=sys.stderr)
+
+    return 1 if unresolved else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(main())
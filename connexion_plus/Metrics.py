@@ -0,0 +1,219 @@
+import os
+import sys
+import atexit
+import weakref
+import logging
+import threading
+
+from .Util import operation_id
+
+logger = logging.getLogger('')
+
+_dead_on_exit = set()
+
+# registry -> namespace -> metrics of the optimizer, so all optimizers of a process share them
+_optimizer_metrics = weakref.WeakKeyDictionary()
+_optimizer_metrics_lock = threading.Lock()
+
+
+def configure_multiprocess(directory=None):
+    """
+    Enables the multiprocess mode of prometheus_client, so every worker process writes its metrics into files in *directory*
+    and a scrape of any worker returns the aggregated metrics of all workers.
+
+    prometheus_client chooses the storage of all metrics, when it is imported. So set the environment variable
+    PROMETHEUS_MULTIPROC_DIR before your server imports it (e.g. in the environment of gunicorn) or call this function before.
+    If prometheus_client was already imported without the variable, a RuntimeError is raised, because the metrics,
+    which were already created, would never be written to the directory.
+
+    *directory* defaults to the environment variable PROMETHEUS_MULTIPROC_DIR. It will be created, if it does not exist,
+    but it is not cleared, because the other workers already use it. Clear it before your server starts.
+    The live gauges of this process are removed, when it exits, see #mark_process_dead.
+    Returns the directory.
+    """
+    directory = directory or os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir")
+    if not directory:
+        raise ValueError("Metrics: multiprocess mode needs a directory or the environment variable PROMETHEUS_MULTIPROC_DIR.")
+
+    values = sys.modules.get("prometheus_client.values")
+    if values is not None and values.ValueClass is values.MutexValue:
+        raise RuntimeError(
+            "Metrics: prometheus_client was imported before PROMETHEUS_MULTIPROC_DIR was set, "
+            "so its metrics are kept in memory. Set the environment variable before the server starts.")
+
+    os.makedirs(directory, exist_ok=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+
+    if directory not in _dead_on_exit:
+        _dead_on_exit.add(directory)
+        # the pid is looked up on exit, so it is right for forked workers, too
+        atexit.register(mark_process_dead, None, directory)
+
+    return directory
+
+
+def mark_process_dead(pid=None, directory=None):
+    """
+    Removes the files of the live gauges of the given process (defaults to the current one) from the multiprocess directory.
+    Call it from the child_exit hook of gunicorn, so killed workers are removed, too.
+    """
+    directory = directory or os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if not directory:
+        return
+
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(pid or os.getpid(), directory)
+
+
+def group_by_operation(app):
+    """
+    Returns a group_by function for prometheus_flask_exporter, which labels the requests with the connexion operation id
+    instead of the path. So the number of time series is bounded by the number of operations, even for paths with parameters.
+    The label is named "operation".
+    """
+    operation_ids = {}
+
+    def operation(request):
+        endpoint = request.endpoint
+        try:
+            return operation_ids[endpoint]
+        except KeyError:
+            pass
+
+        found = operation_id(app.view_functions.get(endpoint)) or str(endpoint)
+        operation_ids[endpoint] = found
+        return found
+
+    return operation
+
+
+class OptimizerMetrics(object):
+    """
+    Prometheus metrics for FlaskOptimize.
+
+    The requests to cached routes are labeled with the connexion operation id and not with the url,
+    so the number of time series is bounded by the number of operations in your specification.
+    The counters of the cache backend (size, evictions, ...) are read from its stats, when prometheus scrapes them.
+
+    *registry* defaults to the default registry of prometheus_client. The metrics are registered once per registry and namespace
+    and shared by all optimizers, so multiple apps in one process (e.g. in tests or app factories) can use them.
+    The cache stats are the sums of all optimizers. They belong to a single process, so they are not exported in multiprocess mode.
+    """
+
+    # compression and minify of a single body take microseconds to a few milliseconds
+    buckets = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+    def __init__(self, optimize, registry=None, namespace="flask_optimize"):
+        from prometheus_client import REGISTRY
+
+        if registry is None:
+            registry = REGISTRY
+
+        self.registry = registry
+
+        with _optimizer_metrics_lock:
+            metrics = _optimizer_metrics.setdefault(registry, {}).get(namespace)
+            if metrics is None:
+                metrics = self._create(registry, namespace)
+                _optimizer_metrics[registry][namespace] = metrics
+
+        self.cache_requests = metrics["cache_requests"]
+        self.compression_input = metrics["compression_input"]
+        self.compression_output = metrics["compression_output"]
+        self.compression_time = metrics["compression_time"]
+        self.minify_saved = metrics["minify_saved"]
+        self.minify_time = metrics["minify_time"]
+
+        self.cache_collector = metrics["cache_collector"]
+        if self.cache_collector is not None:
+            self.cache_collector.add(optimize)
+
+    @classmethod
+    def _create(cls, registry, namespace):
+        from prometheus_client import Counter, Histogram
+
+        metrics = {
+            "cache_requests": Counter(
+                "cache_requests", "Requests to cached routes by result (hit, miss, stale, refresh).",
+                ["operation", "result"], namespace=namespace, registry=registry),
+            "compression_input": Counter(
+                "compression_input_bytes", "Bytes before compression.",
+                ["encoding"], namespace=namespace, registry=registry),
+            "compression_output": Counter(
+                "compression_output_bytes", "Bytes after compression.",
+                ["encoding"], namespace=namespace, registry=registry),
+            "compression_time": Histogram(
+                "compression_seconds", "Time to compress a body.",
+                ["encoding"], namespace=namespace, registry=registry, buckets=cls.buckets),
+            "minify_saved": Counter(
+                "minify_saved_bytes", "Bytes removed by minify.",
+                namespace=namespace, registry=registry),
+            "minify_time": Histogram(
+                "minify_seconds", "Time to minify a body, which was not memoized.",
+                namespace=namespace, registry=registry, buckets=cls.buckets),
+            "cache_collector": None,
+        }
+
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            # the scrape collects the files of the workers, custom collectors are not part of it
+            logger.warning("Metrics: the stats of the cache backend are not exported in multiprocess mode.")
+        else:
+            metrics["cache_collector"] = CacheCollector(namespace=namespace)
+            registry.register(metrics["cache_collector"])
+
+        return metrics
+
+    def observe_cache(self, operation, result):
+        self.cache_requests.labels(operation, result).inc()
+
+    def observe_compression(self, encoding, before, after, seconds):
+        self.compression_input.labels(encoding).inc(before)
+        self.compression_output.labels(encoding).inc(after)
+        self.compression_time.labels(encoding).observe(seconds)
+
+    def observe_minify(self, before, after, seconds=None):
+        self.minify_saved.inc(max(0, before - after))
+        if seconds is not None:
+            self.minify_time.observe(seconds)
+
+
+class CacheCollector(object):
+    """
+    Exports the summed stats of the cache backends of the given FlaskOptimize instances, when prometheus scrapes them.
+    So the cache itself does not need to know about prometheus. The optimizers are held weakly.
+    """
+
+    gauges = ("entries", "bytes")
+
+    def __init__(self, optimize=None, namespace="flask_optimize"):
+        self.optimizers = weakref.WeakSet()
+        self.namespace = namespace
+
+        if optimize is not None:
+            self.add(optimize)
+
+    def add(self, optimize):
+        self.optimizers.add(optimize)
+
+    def collect(self):
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+        totals = {}
+        for optimize in list(self.optimizers):
+            try:
+                stats = optimize.cache.stats()
+            except Exception as e:
+                logger.warning("Optimizer: cache stats failed: {}".format(e))
+                continue
+
+            for name, value in stats.items():
+                if isinstance(value, (int, float)):
+                    totals[name] = totals.get(name, 0) + value
+
+        for name, value in sorted(totals.items()):
+            full_name = "{}_cache_{}".format(self.namespace, name)
+            if name in self.gauges:
+                yield GaugeMetricFamily(full_name, "Cache {}.".format(name), value=value)
+            else:
+                yield CounterMetricFamily(full_name, "Cache {}.".format(name), value=value)
@@ -1,120 +1,328 @@
-import re, string, logging
-import sys
-from connexion.resolver import RestyResolver, Resolution
-from connexion.exceptions import ResolverError
-
-logger = logging.getLogger('connexion.resolver')
-
-class MultipleResourceResolver(RestyResolver):
-    def resolve(self, operation):
-        """
-        Default operation resolver
-        :type operation: connexion.operations.AbstractOperation
-        """
-
-        # set randomizer to not collide endpoint_names, so that parameters for resources are possible.
-        # Otherwise the following example collides:
-        #   /res1 [GET] and /res1/{id} [GET]
-        operation._randomize_endpoint = 2
-
-        operation_id = self.resolve_operation_id(operation)    
-
-        def try_resolve(*args):
-            size = len(args)
-
-            i = 0
-            errors = []
-            for op in args:
-                # check, if the user uses files for resources Title()
-                try:
-                    return Resolution(self.resolve_function_from_operation_id(op), op)
-                except ResolverError as e:
-                    logger.warning(e)
-                    errors.append(e)
-
-                # check, if the user uses files for resources lower()
-                try:
-                    return Resolution(self.resolve_function_from_operation_id(op.lower()), op)
-                except ResolverError as e:
-                    logger.warning(e)
-                    errors.append(e)
-
-            raise errors[-1]
-
-        # remove router controller first, so it does not merge in the imported file in the following replacement
-        # remove all dots
-        operation_id_file = operation_id.replace(f"{self.default_module_name}.", "")
-        c = operation_id_file.count(".")
-        operation_id_file = operation_id_file.replace(".", "", c - 1)
-        # add router controller again
-        operation_id_file = f"{self.default_module_name}.{operation_id_file}"
-
-        try:
-            # try to import functions in resource folders (e.g. /Res1/{Para1}/Res2 resolves in Res1.Res2)
-            # try to import functions in resource files (e.g. /Res1/{Para1}/Res2 resolves in Res1Res2)
-            return try_resolve(operation_id, operation_id_file)
-        except:
-            raise
-        
-            
-
-    def resolve_operation_id_using_rest_semantics(self, operation):
-        """
-        Resolves the operationId using REST semantics without collision for longer paths with multiple ressources
-        :type operation: connexion.operations.AbstractOperation
-        """
-        path_match = re.search(
-            r'^/?(?P<resource_name>([\w\-](?<!/))*)(?P<trailing_slash>/*)(?P<extended_path>.*)$', operation.path
-        )
-
-        count_resource = 0
-        count_parameters = 0
-
-        def get_controller_name():
-            nonlocal count_parameters, count_resource
-            x_router_controller = operation.router_controller
-
-            #chars = re.escape(string.punctuation)
-            #resource_name = re.sub(r'[' + chars + ']', '_', operation.path)
-
-            # empty name to append to
-
-            name = self.default_module_name
-            resource_name = ''
-            # split path at slash to separate every parameter
-            split = re.split("/", operation.path)
-            
-            resources = []
-            
-            for s in split:
-                # find the parameter, where a variable was defined to exlude it in resource_name
-                pattern = re.compile(r"\{[a-zA-Z-_]+\}")
-                if s:
-                    if pattern.search(s) is None:
-                        count_resource += 1 # count up the founded resource
-                        resources.append(s.title())
-                    else:
-                        count_parameters += 1
-
-            resource_name = ".".join(resources)
-            if x_router_controller:
-                name = x_router_controller
-
-            elif resource_name:
-                resource_controller_name = resource_name.replace('-', '_')
-                name += '.' + resource_controller_name
-
-            return name
-
-        def get_function_name():
-            nonlocal count_parameters, count_resource
-            method = operation.method
-
-            is_collection_endpoint = \
-                method.lower() == 'get' \
-                and count_resource > count_parameters
-
-            return self.collection_endpoint_name if is_collection_endpoint else method.lower()
-
-        return '{}.{}'.format(get_controller_name(), get_function_name())
-
+import re, json, logging
+import inspect
+import importlib
+import threading
+from connexion.resolver import RestyResolver, Resolution
+from connexion.exceptions import ResolverError
+from connexion.utils import deep_getattr
+
+logger = logging.getLogger('connexion.resolver')
+
+# finds the parameter in a path segment, e.g. {id}
+_parameter = re.compile(r"\{[a-zA-Z-_]+\}")
+
+
+class LazyFunction(object):
+    """
+    Stands in for the function at *location* ("module:function") and imports it with *load* on the first call,
+    so the controllers of operations, which are never called, are never imported. It is thread-safe.
+
+    Connexion sees the signature (*args, **kwargs) and passes all parameters, so they are filtered for the real function.
+    The public attributes and the options of FlaskOptimize are looked up on the real function and import it, too.
+    *fallback* is called, if the location cannot be loaded, and returns the function.
+    """
+
+    __slots__ = ("location", "_load", "_fallback", "_function", "_arguments", "_lock", "__dict__")
+
+    # private attributes, which are looked up on the real function
+    delegated = ("_optimize_options",)
+
+    def __init__(self, location, load, fallback=None):
+        module_name, _, attr_path = location.partition(":")
+
+        self.location = location
+        self._load = load
+        self._fallback = fallback
+        self._function = None
+        # names of the keyword arguments of the function or None, if it takes all
+        self._arguments = None
+        self._lock = threading.Lock()
+
+        # copied by functools.wraps, so the operation id (see connexion_plus.Util#operation_id) is known without importing
+        self.__module__ = module_name
+        self.__qualname__ = attr_path
+        self.__name__ = attr_path.rsplit(".", 1)[-1]
+        self.__doc__ = None
+        self.__annotations__ = {}
+
+    @property
+    def loaded(self):
+        return self._function is not None
+
+    def load(self):
+        """
+        Imports the function, if it was not imported yet, and returns it.
+        """
+        if self._function is not None:
+            return self._function
+
+        with self._lock:
+            if self._function is None:
+                try:
+                    function = self._load(self.location)
+                except (ImportError, AttributeError, ValueError) as e:
+                    if self._fallback is None:
+                        raise
+                    logger.warning("Cannot load {}, resolve it again: {}".format(self.location, e))
+                    function = self._fallback()
+
+                parameters = inspect.signature(function).parameters.values()
+                if not any(p.kind == p.VAR_KEYWORD for p in parameters):
+                    self._arguments = frozenset(
+                        p.name for p in parameters if p.kind not in (p.VAR_POSITIONAL, p.VAR_KEYWORD))
+                self._function = function
+
+        return self._function
+
+    def __call__(self, *args, **kwargs):
+        function = self.load()
+        if self._arguments is not None:
+            kwargs = {name: value for name, value in kwargs.items() if name in self._arguments}
+        return function(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # inspect, asyncio and functools probe private names, which must not import the function
+        if name.startswith("_") and name not in self.delegated:
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return "<LazyFunction {}>".format(self.location)
+
+
+class MultipleResourceResolver(RestyResolver):
+    """
+    Resolves paths with multiple resources (e.g. /Res1/{Para1}/Res2) to Res1.Res2 or Res1Res2 in the default module.
+
+    The imports are memoized for all operations of this resolver and failed imports are remembered,
+    so the operations of the same controller do not search the candidates again.
+
+    *resolution_table* maps "METHOD /path" of the operations to "module:function" and can be a dict or the path of a json file (the manifest).
+    The operations in the table import their module directly without trying the candidates, all others are resolved as usual.
+    Use connexion_plus.Manifest or #save_resolution_table to create it at build time.
+
+    If *lazy* is True, the operations in the table get a LazyFunction, which imports the controller on the first request.
+    *hot* are the operations ("METHOD /path"), which #warmup imports eagerly, e.g. after add_api or in the master of a preforking server.
+    """
+
+    def __init__(self, default_module_name, collection_endpoint_name="search", resolution_table=None, lazy=False, hot=()):
+        super().__init__(default_module_name, collection_endpoint_name=collection_endpoint_name)
+        self.function_resolver = self.get_function_from_name
+
+        if isinstance(resolution_table, str):
+            with open(resolution_table, "r") as f:
+                resolution_table = json.load(f)
+
+        self.resolution_table = dict(resolution_table or {})
+        self.lazy = lazy
+        self.hot = tuple(hot)
+        # "METHOD /path" -> LazyFunction
+        self.lazy_functions = {}
+
+        # name -> ("module:function", function) or the error, which was raised
+        self._functions = {}
+        # name -> module or the ImportError, which was raised
+        self._modules = {}
+
+    def resolve(self, operation):
+        """
+        Default operation resolver
+        :type operation: connexion.operations.AbstractOperation
+        """
+
+        # set randomizer to not collide endpoint_names, so that parameters for resources are possible.
+        # Otherwise the following example collides:
+        #   /res1 [GET] and /res1/{id} [GET]
+        operation._randomize_endpoint = 2
+
+        key = "{} {}".format(operation.method.upper(), operation.path)
+        location = self.resolution_table.get(key)
+        if location is not None:
+            if self.lazy:
+                function = LazyFunction(location, self.get_function_from_location,
+                                        lambda: self._resolve_candidates(operation, key).function)
+                self.lazy_functions[key] = function
+                return Resolution(function, location.replace(":", "."))
+
+            try:
+                return Resolution(self.get_function_from_location(location), location.replace(":", "."))
+            except (ImportError, AttributeError, ValueError) as e:
+                logger.warning("Stale entry {} for {}, resolve it again: {}".format(location, key, e))
+
+        return self._resolve_candidates(operation, key)
+
+    def _resolve_candidates(self, operation, key):
+        operation_id = self.resolve_operation_id(operation)
+
+        # remove router controller first, so it does not merge in the imported file in the following replacement
+        # remove all dots
+        operation_id_file = operation_id.replace(f"{self.default_module_name}.", "")
+        c = operation_id_file.count(".")
+        operation_id_file = operation_id_file.replace(".", "", c - 1)
+        # add router controller again
+        operation_id_file = f"{self.default_module_name}.{operation_id_file}"
+
+        # try to import functions in resource folders (e.g. /Res1/{Para1}/Res2 resolves in Res1.Res2)
+        # try to import functions in resource files (e.g. /Res1/{Para1}/Res2 resolves in Res1Res2)
+        # check, if the user uses files for resources Title() or lower()
+        candidates = []
+        for op in (operation_id, operation_id_file):
+            candidates.append((op, op))
+            candidates.append((op.lower(), op))
+
+        error = None
+        for name, op in candidates:
+            try:
+                function = self.resolve_function_from_operation_id(name)
+            except ResolverError as e:
+                logger.debug(e)
+                error = e
+                continue
+
+            self.resolution_table[key] = self._functions[name][0]
+            return Resolution(function, op)
+
+        logger.warning("Cannot resolve {}, tried {}.".format(key, ", ".join(name for name, _ in candidates)))
+        raise error
+
+    def warmup(self, keys=None):
+        """
+        Imports the lazy functions of the given operations ("METHOD /path"), defaults to *hot*.
+        Returns the number of imported functions. Failures are logged, they will fail again on the first request.
+        """
+        if keys is None:
+            keys = self.hot
+
+        loaded = 0
+        for key in keys:
+            function = self.lazy_functions.get(key)
+            if function is None or function.loaded:
+                continue
+
+            try:
+                function.load()
+                loaded += 1
+            except Exception as e:
+                logger.warning("Warmup of {} failed: {}".format(key, e))
+
+        return loaded
+
+    def save_resolution_table(self, path):
+        """
+        Writes the operations, which were resolved so far, as json to the given path, so it can be given as *resolution_table*.
+        """
+        with open(path, "w") as f:
+            json.dump(self.resolution_table, f, indent=2, sort_keys=True)
+
+    def get_function_from_name(self, function_name):
+        """
+        Returns the function for the given fully qualified name like connexion.utils#get_function_from_name,
+        but remembers the functions and the errors.
+        """
+        try:
+            found = self._functions[function_name]
+        except KeyError:
+            try:
+                found = self._find_function(function_name)
+            except (ImportError, AttributeError) as e:
+                found = e
+            self._functions[function_name] = found
+
+        if isinstance(found, Exception):
+            raise found.with_traceback(None)
+        return found[1]
+
+    def get_function_from_location(self, location):
+        """
+        Returns the function for the given "module:function", which imports only this module.
+        """
+        module_name, _, attr_path = location.partition(":")
+        if not module_name or not attr_path:
+            raise ValueError("Invalid location {}, expected module:function.".format(location))
+
+        module = self._import_module(module_name)
+        if isinstance(module, ImportError):
+            raise module.with_traceback(None)
+        return deep_getattr(module, attr_path)
+
+    def _find_function(self, function_name):
+        if function_name is None:
+            raise ValueError("Empty function name")
+
+        if "." in function_name:
+            module_name, attr_path = function_name.rsplit(".", 1)
+        else:
+            module_name, attr_path = "", function_name
+
+        last_import_error = None
+        while True:
+            module = self._import_module(module_name)
+            if not isinstance(module, ImportError):
+                break
+
+            last_import_error = module
+            if "." not in module_name:
+                raise module
+
+            module_name, attr_path1 = module_name.rsplit(".", 1)
+            attr_path = f"{attr_path1}.{attr_path}"
+
+        try:
+            return "{}:{}".format(module_name, attr_path), deep_getattr(module, attr_path)
+        except AttributeError:
+            if last_import_error:
+                raise last_import_error
+            raise
+
+    def _import_module(self, module_name):
+        """
+        Returns the module or the ImportError, so the candidates of other operations do not try to import it again.
+        """
+        try:
+            return self._modules[module_name]
+        except KeyError:
+            pass
+
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as e:
+            module = e
+
+        self._modules[module_name] = module
+        return module
+
+    def resolve_operation_id_using_rest_semantics(self, operation):
+        """
+        Resolves the operationId using REST semantics without collision for longer paths with multiple ressources
+        :type operation: connexion.operations.AbstractOperation
+        """
+        x_router_controller = operation.router_controller
+
+        resources = []
+        count_parameters = 0
+
+        # split path at slash to separate every parameter
+        for s in operation.path.split("/"):
+            # find the parameter, where a variable was defined to exlude it in resource_name
+            if s:
+                if _parameter.search(s) is None:
+                    resources.append(s.title())
+                else:
+                    count_parameters += 1
+
+        name = self.default_module_name
+        resource_name = ".".join(resources)
+        if x_router_controller:
+            name = x_router_controller
+
+        elif resource_name:
+            resource_controller_name = resource_name.replace('-', '_')
+            name += '.' + resource_controller_name
+
+        method = operation.method
+        is_collection_endpoint = \
+            method.lower() == 'get' \
+            and len(resources) > count_parameters
+
+        function_name = self.collection_endpoint_name if is_collection_endpoint else method.lower()
+        return '{}.{}'.format(name, function_name)
@@ -1,122 +1,192 @@
 # inspired by and partly stolen from https://github.com/sunary/flask-optimize/blob/b4421c166fd61b357a9666f34ffb1370bffff7e3/flask_optimize/optimize.py
 
 import sys
-import gzip
 import time
+import math
+import random
+import hashlib
 import os
-from htmlmin.main import minify
-from flask import Flask, request, Response, make_response, current_app, json, wrappers
-from functools import update_wrapper, wraps
+from flask import request, Response, make_response, current_app, json, has_request_context
+from .Cache import LocalCache, RedisCache, CacheEntry, get_redis_client, content_digest
+from .Compression import Compressor
+from .Util import operation_id
 import logging
 
 logger = logging.getLogger('')
 
-IS_PYTHON_3 = True
-if sys.version_info[0] < 3:
-    from StringIO import StringIO
-    IS_PYTHON_3 = False
-else:
-    from io import BytesIO
+IS_PYTHON_3 = sys.version_info[0] >= 3
 
 
 class FlaskOptimize(object):
 
-    _cache = None
-    _timestamp = None
-
-    def __init__(self, app, config=None, rc=None):
+    default_config = {
+        "compress": True,
+        "minify": True,
+        "minify_max_size": 512 * 1024,
+        "minify_cache_entries": 256,
+        "compress_levels": {},
+        "compress_min_size": 500,
+        "compress_mimetypes": None,
+        "compress_encodings": None,
+        "compress_flush_size": 64 * 1024,
+        "compress_passthrough": False,
+        "etag": False,
+        "cache_backend": "auto",
+        "cache_vary": [],
+        "cache_lease_timeout": 30,
+        "cache_wait_timeout": 10,
+        "cache_max_entries": 1024,
+        "cache_max_bytes": 64 * 1024 * 1024,
+        "cache_near_entries": 256,
+        "cache_near_timeout": 1,
+    }
+
+    def __init__(self, app, config=None, rc=None, cache=None):
         """
         Global config for flask optimize. 
 
         Cache have to enabled manually per function with decorator #set_cache_timeout
         Args:
-            config: global configure values
+            config: global configure values, missing values will be taken from #default_config
+            rc: a redis client for the shared cache
+            cache: an instance of connexion_plus.Cache.CacheBackend, defaults to the backend given by the config "cache_backend"
+
+        "cache_backend" can be "local", "redis" or "auto", which uses redis, if *rc* or the environment variable REDIS_HOST is given.
+        "minify_max_size" is the maximum body size in bytes, which will be minified.
+        "minify_cache_entries" is the number of minified bodies, which will be memoized by their digest.
+        "compress_levels" is a dict of encoding (gzip, br, zstd) to compression level.
+        "compress_min_size" is the minimum body size in bytes, which will be compressed.
+        "compress_mimetypes" is the allowlist of mimetypes, which will be compressed. Defaults to text based types.
+        "compress_encodings" is the order of preference for the encodings, if the client accepts multiple ones.
+        "compress_flush_size" is the number of bytes, after which a streamed response will be flushed to the client at least.
+        "compress_passthrough" enables the compression of direct passthrough responses (e.g. send_file).
+        "etag" enables ETags and answers If-None-Match with 304 Not Modified.
+        "cache_vary" is a list of request headers, which will be part of the cache key (e.g. Accept-Language).
+        The content encoding is not part of the key, because every cache entry holds its compressed variants.
+        "cache_lease_timeout" is the maximum time in seconds for a single request to recompute a missing entry, while all other requests for it wait.
+        "cache_wait_timeout" is the maximum time in seconds, which a request waits for the recompute of another one, before it computes the response itself.
         """
         logger.info("Initialize FlaskOptimize...")
 
-        try:
-            from redis_pubsub_dict import RedisDict
-
-            # runs in RDS ecosystem, use redis as backend
-            if rc is None:
-                logger.debug("No redis client was given. Create one.")
-
-                startup_nodes = [
-                    {
-                        "host": os.getenv("REDIS_HOST", "localhost"),
-                        "port": os.getenv("REDIS_PORT", "6379"),
-                    }
-                ]
-
-                try:
-                    logger.debug("first try cluster")
-                    from redis.cluster import Redis
-
-                    rc = Redis(
-                        **(startup_nodes[0]),
-                        health_check_interval=30,
-                        decode_responses=True,
-                    )
-                    rc.get_nodes()  # provoke an error message
-                except Exception as e:
-                    logger.error(e)
-                    logger.debug("Cluster has an error, try standalone redis")
-                    from redis import Redis
-
-                    rc = Redis(
-                        **(startup_nodes[0]),
-                        db=0,
-                        health_check_interval=30,
-                        decode_responses=True,
-                    )
-                    rc.info()  # provoke an error message
-
-            self._redis_key = "FlaskOptimize_Caching_{}".format(self.name)
-            self._cache = RedisDict(rc, self._redis_key)
-            self._timestamp = RedisDict(rc, self._redis_key)
-
-        except:
-            logger.debug(
-                "No redis client was given or found. Use local dicts.")
-            self._cache = {}
-            self._timestamp = {}
-
-        if config is None:
-            config = {
-                "compress": True,
-                "minify": True
-            }
-        logger.info("Optimizer config: {}".format(config))
-
-        self.config = config
+        self.config = dict(self.default_config)
+        if config is not None:
+            self.config.update(config)
+        logger.info("Optimizer config: {}".format(self.config))
+
+        if cache is None:
+            cache = self.create_cache(app, rc)
+
+        self.cache = cache
+        self.compressor = Compressor(
+            levels=self.config["compress_levels"],
+            min_size=self.config["compress_min_size"],
+            mimetypes=self.config["compress_mimetypes"],
+            encodings=self.config["compress_encodings"],
+        )
+        self._minified = LocalCache(
+            max_entries=self.config["minify_cache_entries"],
+            max_bytes=self.config["minify_max_size"] * 4,
+        )
+        self._endpoint_options = {}
+        self._operation_ids = {}
+        self.metrics = None
         self.init_app(app)
 
+    def create_cache(self, app, rc=None):
+        """
+        Creates the cache backend for the given config. Falls back to the in-process cache, if redis cannot be reached.
+        """
+        backend = self.config["cache_backend"]
+        if backend == "auto":
+            backend = "redis" if rc is not None or os.getenv(
+                "REDIS_HOST") else "local"
+
+        if backend == "redis":
+            try:
+                if rc is None:
+                    logger.debug("No redis client was given. Create one.")
+                    rc = get_redis_client()
+
+                rc.ping()  # provoke an error message
+                logger.debug("Use redis as cache backend.")
+                return RedisCache(
+                    rc,
+                    prefix="FlaskOptimize_Caching_{}".format(app.name),
+                    near_entries=self.config["cache_near_entries"],
+                    near_timeout=self.config["cache_near_timeout"],
+                )
+            except Exception as e:
+                logger.error(e)
+                logger.debug("Redis has an error, use in-process cache.")
+
+        logger.debug("Use in-process cache.")
+        return LocalCache(
+            max_entries=self.config["cache_max_entries"],
+            max_bytes=self.config["cache_max_bytes"],
+        )
+
     def init_app(self, app):
+        """
+        Registers the hooks of the optimizer on the given app.
+
+        A cache hit is returned from before_request, so flask skips the before_request functions, which are registered after it.
+        Initialize other extensions (e.g. metrics or tracing) before the optimizer, so they see the cache hits too.
+        """
         def before_request():
-            # set something useful
-            pass
+            return self.serve_from_cache()
 
         def after_request(response):
             return self.optimize_response(response)
 
+        def teardown_request(error):
+            # the view could fail before after_request, so the lease has to be released here too
+            self.release_lease()
+
         app.before_request(before_request)
         app.after_request(after_request)
+        app.teardown_request(teardown_request)
+
+    def init_metrics(self, registry=None):
+        """
+        Registers the metrics of the optimizer (cache hits, compression and minify) on the given prometheus registry.
+        Use the registry of your PrometheusMetrics, e.g. `optimize.init_metrics(metrics.registry)`.
+        """
+        from .Metrics import OptimizerMetrics
+
+        self.metrics = OptimizerMetrics(self, registry)
+        return self.metrics
+
+    @staticmethod
+    def _set_option(f, name, value):
+        """
+        Registers an optimizer option on the view function itself, so it is known before the request is dispatched.
+        Decorators, which uses functools.wraps (like connexion does), copy the options to their wrappers.
+        """
+        f.__dict__.setdefault("_optimize_options", {})[name] = value
+        return f
 
     @staticmethod
-    def set_cache_timeout(timeout=86400):
+    def set_cache_timeout(timeout=86400, stale=0, early_refresh=0, tags=None):
         """
         Decorator to set the cache for the method.
         This is the only optimization, which have to be enabled manually.
         Defaults to 24 hours.
+
+        Only one request recomputes a missing entry, all other requests for the same key wait for it.
+
+        *stale* is the time in seconds after the timeout, in which the expired entry will still be served,
+        while a single request recomputes it (stale-while-revalidate).
+        *early_refresh* enables the probabilistic early refresh, so a single request recomputes the entry before it expires.
+        The value weights the time, which was needed to compute the response. 1 is a good start, 0 deactivates it.
+        *tags* is a list of names for the cached responses, so they can be invalidated together with #invalidate_tags.
+        A tag can contain placeholders for the path parameters, e.g. "user:{user_id}".
         """
 
         def decorator(f):
-            @wraps(f)
-            def func(*args, **kwargs):
-                request.opt_cache_timeout = timeout
-                return f(*args, **kwargs)
-
-            return func
+            FlaskOptimize._set_option(f, "cache_tags", tuple(tags or ()))
+            FlaskOptimize._set_option(f, "cache_stale", stale)
+            FlaskOptimize._set_option(f, "cache_early_refresh", early_refresh)
+            return FlaskOptimize._set_option(f, "cache_timeout", timeout)
 
         return decorator
 
@@ -127,12 +197,7 @@ class FlaskOptimize(object):
         """
 
         def decorator(f):
-            @wraps(f)
-            def func(*args, **kwargs):
-                request.opt_do_not_minify = True
-                return f(*args, **kwargs)
-
-            return func
+            return FlaskOptimize._set_option(f, "do_not_minify", True)
 
         return decorator
 
@@ -143,52 +208,366 @@ class FlaskOptimize(object):
         """
 
         def decorator(f):
-            @wraps(f)
-            def func(*args, **kwargs):
-                request.opt_do_not_compress = True
-                return f(*args, **kwargs)
-
-            return func
+            return FlaskOptimize._set_option(f, "do_not_compress", True)
 
         return decorator
 
     def clear_timestamps(self):
-        """Not currently used."""
-        tmp_dic = {}
-
-        # FIXME: parallize me
-        for k, v in self._timestamp.items():
-            if v < time.time():
-                tmp_dic[k] = v
-
-        # del self._timestamp # trigger gc for previous dict
-        self._timestamp = tmp_dic
-        return
+        """Removes all expired entries from the cache."""
+        return self.cache.purge_expired()
 
     @staticmethod
     def set_key(key_cache):
         """
         Decorator to set the key for caching.
+
+        *key_cache* can be a string or a callable, which gets the request and returns the key.
         """
 
         def decorator(f):
-            @wraps(f)
-            def func(*args, **kwargs):
-                request.key_cache = key_cache
-                return f(*args, **kwargs)
-
-            return func
+            return FlaskOptimize._set_option(f, "key_cache", key_cache)
 
         return decorator
 
+    def endpoint_options(self, endpoint=None):
+        """
+        Returns the options, which were registered with the decorators for the given endpoint.
+        Defaults to the endpoint of the current request.
+
+        Views with the attribute _optimize_secured (see connexion_plus.Application#SecuredFlaskApi) will not be cached,
+        because a cache hit is served before the view checks the credentials.
+        """
+        if endpoint is None:
+            endpoint = request.endpoint
+
+        try:
+            return self._endpoint_options[endpoint]
+        except KeyError:
+            pass
+
+        options = {}
+        view = current_app.view_functions.get(endpoint)
+        secured = getattr(view, "_optimize_secured", False)
+
+        # follow the decorator chain, because not all wrappers copy the options
+        while view is not None:
+            found = getattr(view, "_optimize_options", None)
+            if found is not None:
+                options = found
+                break
+            view = getattr(view, "__wrapped__", None)
+
+        if secured and options.get("cache_timeout"):
+            # a cache hit would skip the security checks of connexion
+            logger.warning("Optimizer: {} has security requirements, so it will not be cached.".format(endpoint))
+            options = dict(options, cache_timeout=0)
+
+        self._endpoint_options[endpoint] = options
+        return options
+
+    def operation_id(self, endpoint=None):
+        """
+        Returns the connexion operation id for the given endpoint, defaults to the endpoint of the current request.
+        Falls back to the endpoint, if there is no view function for it.
+        """
+        if endpoint is None:
+            endpoint = request.endpoint
+
+        try:
+            return self._operation_ids[endpoint]
+        except KeyError:
+            pass
+
+        found = operation_id(current_app.view_functions.get(endpoint)) or str(endpoint)
+        self._operation_ids[endpoint] = found
+        return found
+
+    def observe_cache(self, result):
+        if self.metrics is not None:
+            self.metrics.observe_cache(self.operation_id(), result)
+
+    def serve_from_cache(self):
+        """
+        Computes the cache key before the request is dispatched and returns the cached response, if there is a valid one.
+        So the view function will not be called on a cache hit.
+        """
+        options = self.endpoint_options()
+
+        if options.get("do_not_minify"):
+            request.opt_do_not_minify = True
+
+        if options.get("do_not_compress"):
+            request.opt_do_not_compress = True
+
+        period_cache = options.get("cache_timeout", 0)
+        if not isinstance(period_cache, int) or period_cache <= 0:
+            return None
+
+        key_cache = options.get("key_cache")
+        if callable(key_cache):
+            key_cache = key_cache(request)
+
+        if key_cache is None:
+            key_cache = request.method + request.url
+
+        request.opt_cache_timeout = period_cache
+        request.opt_cache_stale = options.get("cache_stale", 0)
+        request.opt_cache_tags = self.format_tags(options.get("cache_tags", ()))
+        request.opt_cache_start = time.time()
+        request.key_cache = self.vary_key(key_cache)
+
+        entry = self.cache.get(request.key_cache)
+
+        if entry is None:
+            lease = self.cache.acquire(
+                request.key_cache, self.config["cache_lease_timeout"])
+            if lease is not None:
+                request.opt_cache_lease = lease
+                self.observe_cache("miss")
+                return None
+
+            # another request recomputes the entry, so wait for it
+            logger.debug("Optimizer: wait for the entry.")
+            self.cache.wait(request.key_cache, self.config["cache_wait_timeout"])
+
+            entry = self.cache.get(request.key_cache)
+            if entry is None:
+                logger.debug("Optimizer: entry still missing, compute it.")
+                self.observe_cache("miss")
+                return None
+
+            self.observe_cache("hit")
+
+        elif self.needs_refresh(entry, options.get("cache_early_refresh", 0)):
+            lease = self.cache.acquire(
+                request.key_cache, self.config["cache_lease_timeout"])
+            if lease is not None:
+                logger.debug("Optimizer: refresh entry.")
+                request.opt_cache_lease = lease
+                self.observe_cache("refresh")
+                return None
+
+            # another request refreshs the entry, so serve the current one
+            self.observe_cache("stale" if time.time() >= entry.expires else "hit")
+
+        else:
+            self.observe_cache("hit")
+
+        return self.serve_entry(entry)
+
+    @staticmethod
+    def format_tags(tags):
+        """
+        Fills the placeholders of the given tags with the path parameters of the current request.
+        """
+        formatted = []
+        for tag in tags:
+            try:
+                formatted.append(tag.format(**(request.view_args or {})))
+            except (KeyError, IndexError):
+                logger.warning("Optimizer: tag {} needs an unknown path parameter.".format(tag))
+                formatted.append(tag)
+        return formatted
+
+    @staticmethod
+    def needs_refresh(entry, early_refresh=0):
+        """
+        Returns True, if the given entry is stale or should be refreshed early.
+
+        The early refresh is probabilistic: the nearer the expiry and the longer the compute time of the entry,
+        the higher the chance (see "Optimal Probabilistic Cache Stampede Prevention", Vattani et al.).
+        """
+        now = time.time()
+        if now >= entry.expires:
+            return True
+
+        if early_refresh > 0 and entry.delta > 0:
+            return now - entry.delta * early_refresh * math.log(1.0 - random.random()) >= entry.expires
+
+        return False
+
+    def release_lease(self):
+        """
+        Releases the lease of the current request, if there is one.
+        """
+        lease = getattr(request, "opt_cache_lease", None)
+        if lease is not None:
+            request.opt_cache_lease = None
+            self.cache.release(request.key_cache, lease)
+
+    def serve_entry(self, entry):
+        """
+        Returns a fresh response for the current request from the given cache entry.
+        """
+        logger.debug("Optimizer: Response from cache.")
+        request.opt_cache_hit = True
+
+        encoding = self.negotiate_encoding()
+        if encoding is not None and not self.compressor.compressible(entry.mimetype, len(entry.body)):
+            encoding = None
+
+        vary = self.vary_headers()
+
+        # the etag is checked first, so the variant is only compressed, if a body will be sent
+        etag = None
+        if self.config["etag"] and entry.status == 200 and entry.header("ETag") is None:
+            etag = self.etag(entry.digest, encoding)
+            if self.not_modified(etag):
+                logger.debug("Optimizer: Not modified.")
+                return self.not_modified_response(etag, vary, entry.headers)
+
+        if encoding is not None and encoding not in entry.variants:
+            entry = self.add_variant(request.key_cache, entry, encoding)
+
+        resp = entry.to_response(encoding, vary)
+        if etag is not None:
+            resp.set_etag(etag)
+        return resp
+
+    @staticmethod
+    def etag(digest, encoding=None):
+        """
+        Returns the strong ETag for the body with the given digest. Every content encoding gets its own ETag.
+        """
+        return digest if encoding is None else "{}-{}".format(digest, encoding)
+
+    @staticmethod
+    def not_modified(etag):
+        """
+        Returns True, if the current request has an If-None-Match header, which matches the given ETag.
+        """
+        if request.method not in ("GET", "HEAD"):
+            return False
+
+        return request.if_none_match.contains_weak(etag)
+
+    @staticmethod
+    def not_modified_response(etag, vary=None, headers=()):
+        """
+        Returns a 304 Not Modified response for the given ETag, which keeps the caching headers of the given headers.
+        *vary* will be merged into their Vary header.
+        """
+        resp = Response(status=304)
+        resp.headers.pop("Content-Type", None)
+
+        for name, value in headers:
+            if name.lower() in ("cache-control", "expires", "content-location", "last-modified", "vary"):
+                resp.headers[name] = value
+
+        for header in vary or ():
+            resp.vary.add(header)
+
+        resp.set_etag(etag)
+        return resp
+
+    def vary_key(self, key_cache):
+        """
+        Appends the values of the request headers in config "cache_vary" to the given key.
+        The values will be hashed, so sensitive headers (e.g. Authorization) do not show up in the key.
+        """
+        if not self.config["cache_vary"]:
+            return key_cache
+
+        values = "\n".join(request.headers.get(header, "")
+                           for header in self.config["cache_vary"])
+        return "{}|{}".format(key_cache, hashlib.blake2b(values.encode("utf-8"), digest_size=16).hexdigest())
+
+    def vary_headers(self):
+        """
+        Returns the request headers, which select the response for the current request.
+        """
+        vary = list(self.config["cache_vary"])
+        if self.config["compress"] and not hasattr(request, "opt_do_not_compress"):
+            vary.append("Accept-Encoding")
+        return vary
+
+    def negotiate_encoding(self):
+        """
+        Returns the content encoding for the current request.
+        None stands for the uncompressed body.
+        """
+        if not self.config["compress"] or hasattr(request, "opt_do_not_compress"):
+            return None
+
+        return self.compressor.negotiate(request.headers.get('Accept-Encoding', ''))
+
+    def add_variant(self, key_cache, entry, encoding):
+        """
+        Compresses the body of the given entry for the given encoding and stores the extended entry for its remaining time.
+        So the body will only be compressed once per encoding.
+        """
+        entry = entry.copy()
+        entry.variants[encoding] = self.compress_body(entry.body, encoding)
+
+        remaining = entry.expires + getattr(request, "opt_cache_stale", 0) - time.time()
+        if remaining > 0:
+            self.cache.set(key_cache, entry, remaining,
+                           getattr(request, "opt_cache_tags", ()))
+
+        return entry
+
+
+    @staticmethod
+    def cacheable(resp):
+        """
+        Returns True, if the given response can be stored in the cache.
+        Streamed responses, unsuccessful responses, responses, which set cookies, and already encoded responses will not be cached,
+        because the entry holds the uncompressed body.
+        """
+        return (
+            200 <= resp.status_code < 300
+            and not resp.is_streamed
+            and not resp.direct_passthrough
+            and "Set-Cookie" not in resp.headers
+            and "Content-Encoding" not in resp.headers
+        )
+
     def set_key_inline(self, key_cache):
         request.key_cache = key_cache
 
-    def clear_key(self, key_cache):
-        resp = self._cache[request.key_cache]
-        del self._cache[request.key_cache]
-        del self._timestamp[request.key_cache]
-        return resp
+    def clear_key(self, key_cache=None):
+        """
+        Removes the entry for the given key, defaults to the key of the current request.
+        With "cache_vary", the given key is extended like #vary_key does it, so the entries for all values of the vary headers are removed.
+        Returns the removed response (for the vary headers of the current request) or None, if there was no entry.
+        """
+        if key_cache is None:
+            key_cache = request.key_cache
+
+        elif self.config["cache_vary"]:
+            entry = self.cache.get(self.vary_key(key_cache)) if has_request_context() else None
+            self.cache.delete(key_cache)
+            self.cache.invalidate_prefix(key_cache + "|")
+            return entry.to_response() if entry is not None else None
+
+        entry = self.cache.get(key_cache)
+        self.cache.delete(key_cache)
+        return entry.to_response() if entry is not None else None
+
+    def invalidate_tags(self, *tags):
+        """
+        Removes all cached responses, which were stored with one of the given tags (see #set_cache_timeout), in all processes.
+        Returns the number of removed entries.
+        """
+        removed = self.cache.invalidate_tags(tags)
+        logger.debug("Optimizer: {} entries invalidated for tags {}.".format(removed, tags))
+        return removed
+
+    def invalidate_prefix(self, prefix):
+        """
+        Removes all cached responses, whose key starts with the given prefix, in all processes.
+        The default key is the method and the url of the request, e.g. "GEThttp://localhost/users/".
+        Returns the number of removed entries.
+        """
+        removed = self.cache.invalidate_prefix(prefix)
+        logger.debug("Optimizer: {} entries invalidated for prefix {}.".format(removed, prefix))
+        return removed
+
+    def after_fork(self):
+        """
+        Resets the cache for a forked child process, see connexion_plus.Prefork.
+        """
+        self.cache.after_fork()
 
     def set_cache_inline(self, content):
         """Helps you, if you want to manipulate the cache dict, but do not want to serve from it.
@@ -196,7 +575,12 @@ class FlaskOptimize(object):
         Args:
             content (String): The cached content.
         """
-        self._cache[request.key_cache] = content
+        timeout = getattr(request, "opt_cache_timeout", 86400)
+        if not isinstance(content, CacheEntry):
+            content = CacheEntry.from_response(make_response(content), timeout)
+
+        self.cache.set(request.key_cache, content, timeout,
+                       getattr(request, "opt_cache_tags", ()))
 
     def optimize_response(self, response):
         """
@@ -204,26 +588,12 @@ class FlaskOptimize(object):
         """
         resp = response
 
-        # self.clear_timestamps()
-        period_cache = request.opt_cache_timeout if hasattr(
-            request, "opt_cache_timeout") and isinstance(request.opt_cache_timeout, int) else 0
-
-        # init cached data
-        now = time.time()
-
-        if not hasattr(request, "key_cache"):
-            request.key_cache = None
-            
-        if request.key_cache is None:
-            request.key_cache = request.method + request.url
-
-        # if cache entry found, return it.
-        if period_cache > 0 and self._timestamp.get(request.key_cache) and self._timestamp.get(request.key_cache) > now:
-            logger.debug("Optimizer: Response from cache. Valid for {}s.".format(
-                int(self._timestamp.get(request.key_cache) - now)))
-            return self._cache[request.key_cache]
+        # response was served by before_request, so it is already optimized
+        if getattr(request, "opt_cache_hit", False):
+            return resp
 
-        #resp = func(*args, **kwargs)
+        # period_cache is only set by before_request, if the endpoint was decorated with #set_cache_timeout
+        period_cache = getattr(request, "opt_cache_timeout", 0)
 
         # FIXME: remove this, because we use flask-cors
         # crossdomain
@@ -233,22 +603,156 @@ class FlaskOptimize(object):
 
         # minify html, if its not suppressed
         if (self.config["minify"] and not hasattr(request, "opt_do_not_minify")) and resp.mimetype.endswith("html"):
-            logger.debug("Optimizer: minify HTML response.")
-            resp = self.validate(self.minifier, resp)
-
-        # compress, if its not suppressed
-        if (self.config["compress"] and not hasattr(request, "opt_do_not_compress")):
-            accept_encoding = request.headers.get('Accept-Encoding', '')
-            if "gzip" in accept_encoding:
-                logger.debug("Optimizer: compress response.")
-                resp = self.validate(self.compress, resp)
+            resp = self.minify_response(resp)
 
         # period_cache is bigger then 0, if request.opt_cache_timeout was set.
-        if period_cache > 0:
+        # the entry holds the uncompressed body, compressed variants will be added.
+        entry = None
+        if period_cache > 0 and self.cacheable(resp):
+            entry = CacheEntry.from_response(
+                resp, period_cache, delta=time.time() - request.opt_cache_start)
+
+        # the digest has to be calculated from the uncompressed body
+        digest = None
+        if self.config["etag"] and resp.status_code == 200 and "ETag" not in resp.headers \
+                and not resp.is_streamed and not resp.direct_passthrough:
+            digest = entry.digest if entry is not None else content_digest(
+                resp.get_data())
+
+        # compress, if its not suppressed
+        encoding = self.negotiate_encoding()
+        streamed = resp.is_streamed or resp.direct_passthrough
+        size = resp.content_length if streamed else resp.calculate_content_length()
+
+        if encoding is not None and ("Content-Encoding" in resp.headers
+                                     or not self.compressor.compressible(resp.mimetype, size)):
+            encoding = None
+
+        if encoding is not None and resp.direct_passthrough and not self.config["compress_passthrough"]:
+            logger.debug("Optimizer: skip compression of passthrough response.")
+            encoding = None
+
+        vary = self.vary_headers()
+        for header in vary:
+            resp.vary.add(header)
+
+        # the etag is known before the compression, so a matching request does not compress a body, which will not be sent
+        if digest is not None:
+            etag = self.etag(digest, encoding or resp.headers.get("Content-Encoding"))
+            if self.not_modified(etag):
+                logger.debug("Optimizer: Not modified.")
+                resp = self.not_modified_response(etag, vary, resp.headers.items())
+                # the variants will be added by the following hits
+                encoding = None
+            else:
+                resp.set_etag(etag)
+
+        if encoding is not None and streamed:
+            logger.debug("Optimizer: compress streamed response with {}.".format(encoding))
+            self.compress_stream(resp, encoding)
+
+        elif encoding is not None:
+            logger.debug("Optimizer: compress response with {}.".format(encoding))
+            before_len = size
+            body = self.compress_body(
+                entry.body if entry is not None else resp.get_data(), encoding)
+            resp.set_data(body)
+            resp.headers['Content-Encoding'] = encoding
+            logger.debug("Reduce size by {} bytes".format(
+                (before_len or 0) - len(body)))
+
+            if entry is not None:
+                entry.variants[encoding] = body
+
+        if entry is not None:
             logger.debug("Optimizer: response cached.")
-            self._cache[request.key_cache] = resp
-            self._timestamp[request.key_cache] = now + period_cache
+            self.cache.set(request.key_cache, entry,
+                           period_cache + request.opt_cache_stale,
+                           request.opt_cache_tags)
+
+        # wake up all requests, which wait for this entry
+        self.release_lease()
+
+        return resp
+
+    def compress_body(self, body, encoding):
+        """
+        Returns the given body compressed with the given encoding and records it in the metrics.
+        """
+        if self.metrics is None:
+            return self.compressor.compress(body, encoding)
+
+        start = time.perf_counter()
+        compressed = self.compressor.compress(body, encoding)
+        self.metrics.observe_compression(
+            encoding, len(body), len(compressed), time.perf_counter() - start)
+        return compressed
+
+    def minify_response(self, resp):
+        """
+        Minifies the html body of the given response.
+        The result is memoized by the digest of the body, so the same content will be minified only once.
+        Streamed, encoded and too big bodies will be skipped.
+        """
+        if resp.is_streamed or resp.direct_passthrough or "Content-Encoding" in resp.headers:
+            return resp
+
+        size = resp.calculate_content_length()
+        if size is None or size > self.config["minify_max_size"]:
+            logger.debug("Optimizer: skip minify for {} bytes.".format(size))
+            return resp
+
+        body = resp.get_data()
+        digest = content_digest(body)
+
+        seconds = None
+        minified = self._minified.get(digest)
+        if minified is None:
+            start = time.perf_counter()
+            charset = resp.mimetype_params.get("charset", "utf-8")
+            minified = self.minify_html(body, charset)
+            self._minified.set(digest, minified, 86400)
+            seconds = time.perf_counter() - start
+
+        if self.metrics is not None:
+            self.metrics.observe_minify(len(body), len(minified), seconds)
+
+        logger.debug("Optimizer: minify HTML response by {} bytes.".format(
+            len(body) - len(minified)))
+        resp.set_data(minified)
+        return resp
+
+    @staticmethod
+    def minify_html(body, charset="utf-8"):
+        """
+        Minifies the given html body (bytes) and returns the minified bytes.
+        """
+        from htmlmin.main import minify
+
+        text = minify(body.decode(charset, "replace"),
+                      remove_comments=True,
+                      reduce_empty_attributes=True,
+                      remove_optional_attribute_quotes=False)
+        return text.encode(charset)
+
+    def compress_stream(self, resp, encoding):
+        """
+        Replaces the body of the given streamed response with an iterable, which compresses the chunks incrementally.
+        So the body will never be buffered completely.
+        """
+        original = resp.response
+        chunks = resp.iter_encoded()
+
+        resp.direct_passthrough = False
+        resp.response = self.compressor.stream(
+            chunks, encoding, self.config["compress_flush_size"])
+
+        # the compressed stream does not close the original iterable, e.g. an opened file
+        if hasattr(original, "close"):
+            resp.call_on_close(original.close)
 
+        resp.headers['Content-Encoding'] = encoding
+        resp.headers.pop('Content-Length', None)
         return resp
 
     @staticmethod
@@ -267,16 +771,17 @@ class FlaskOptimize(object):
 
     @staticmethod
     def minifier(content):
-        if not IS_PYTHON_3 and isinstance(content, str):
-            content = unicode(content, 'utf-8')
+        """
+        Minify str, bytes or the body of a response.
+        """
+        if isinstance(content, Response):
+            content.set_data(FlaskOptimize.minify_html(content.get_data()))
+            return content
 
-        resp = minify(content,
-                      remove_comments=True,
-                      reduce_empty_attributes=True,
-                      remove_optional_attribute_quotes=False)
+        if isinstance(content, bytes):
+            return FlaskOptimize.minify_html(content)
 
-        logger.debug("Response minifier: {}".format(resp.get_data()))
-        return resp
+        return FlaskOptimize.minify_html(content.encode('utf-8')).decode('utf-8')
 
     @staticmethod
     def compress(content):
@@ -288,28 +793,15 @@ class FlaskOptimize(object):
         if isinstance(content, Response):
             resp = content
             content = resp.get_data()
-            #logger.debug("Response compress: {}".format(resp))
-
-        before_len = len(content)
 
-        if not IS_PYTHON_3 and isinstance(content, unicode):
+        if isinstance(content, str):
             content = content.encode('utf8')
 
-        if IS_PYTHON_3:
-            gzip_buffer = BytesIO()
-            gzip_file = gzip.GzipFile(fileobj=gzip_buffer, mode='wb')
-            #gzip_file.write(bytes(content, 'utf-8'))
-            gzip_file.write(content)
-        else:
-            gzip_buffer = StringIO()
-            gzip_file = gzip.GzipFile(fileobj=gzip_buffer, mode='wb')
-            gzip_file.write(content)
-
-        gzip_file.close()
+        before_len = len(content)
 
         resp.headers['Content-Encoding'] = 'gzip'
         resp.headers['Vary'] = 'Accept-Encoding'
-        resp.set_data(gzip_buffer.getvalue())
+        resp.set_data(Compressor().compress(content, "gzip"))
 
         logger.debug("Reduce size by {} bytes".format(
             before_len - len(resp.get_data())))
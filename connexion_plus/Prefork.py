@@ -0,0 +1,143 @@
+import os
+import weakref
+import threading
+import logging
+
+logger = logging.getLogger('')
+
+_callbacks = []
+_installed = False
+
+
+def register_after_fork(func):
+    """
+    Calls the given function in the child process after every os.fork.
+
+    Bound methods are held weakly, so registering an object does not keep it alive.
+    Preforking servers, which do not fork with os.fork, have to call the functions from their own post fork hook.
+    """
+    global _installed
+
+    if hasattr(func, "__self__"):
+        ref = weakref.WeakMethod(func)
+    else:
+        def ref():
+            return func
+
+    _callbacks.append(ref)
+
+    if not _installed and hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=run_after_fork)
+        _installed = True
+
+
+def run_after_fork():
+    """
+    Calls all registered functions. An error is logged and does not stop the others.
+    """
+    alive = []
+    for ref in _callbacks:
+        func = ref()
+        if func is None:
+            continue
+
+        alive.append(ref)
+        try:
+            func()
+        except Exception:
+            logger.exception("Prefork: after fork function {} failed.".format(func))
+
+    _callbacks[:] = alive
+
+
+class LeaderElection(object):
+    """
+    Elects a single process of all processes, which use the same *path*, with an exclusive lock on this file.
+
+    *on_elected* is called once in the elected process. The other processes try again every *retry_interval* seconds,
+    so one of them takes over, if the leader exits. The lock is released by the operating system, when the leader exits.
+    """
+
+    def __init__(self, path, on_elected, retry_interval=30):
+        self.path = path
+        self.on_elected = on_elected
+        self.retry_interval = retry_interval
+        self.is_leader = False
+
+        self._file = None
+        self._timer = None
+
+    def start(self):
+        """
+        Tries to become the leader and retries in the background, if another process is the leader.
+        Returns True, if this process is the leader.
+        """
+        if not self.try_acquire():
+            self._schedule()
+        return self.is_leader
+
+    def try_acquire(self):
+        if self.is_leader:
+            return True
+
+        try:
+            import fcntl
+        except ImportError:
+            # no file locks and no fork on this platform, so there is only one process
+            return self._elected()
+
+        f = open(self.path, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+
+        self._file = f
+        return self._elected()
+
+    def _elected(self):
+        self.is_leader = True
+        logger.info("Prefork: process {} was elected for {}.".format(os.getpid(), self.path))
+        self.on_elected()
+        return True
+
+    def _schedule(self):
+        self._timer = threading.Timer(self.retry_interval, self._retry)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _retry(self):
+        try:
+            if self.try_acquire():
+                return
+        except Exception:
+            logger.exception("Prefork: election for {} failed.".format(self.path))
+        self._schedule()
+
+    def stop(self):
+        """
+        Stops to retry and releases the lock, if this process is the leader.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.is_leader = False
+
+    def after_fork(self):
+        """
+        The child shares the lock with its parent through the inherited file, so it is never the leader.
+        Closes the inherited file and starts its own election.
+        """
+        if self._file is not None:
+            # the lock stays with the parent, until it closes its file, too
+            self._file.close()
+            self._file = None
+
+        self._timer = None
+        self.is_leader = False
+        self.start()
@@ -0,0 +1,325 @@
+import os
+import time
+import queue
+import atexit
+import socket
+import threading
+import weakref
+from concurrent.futures import Future
+import logging
+
+from jaeger_client import thrift
+from jaeger_client.reporter import BaseReporter, ReporterMetrics
+from jaeger_client.metrics import Metrics, LegacyMetricsFactory
+from jaeger_client.thrift_gen.agent import Agent
+from thrift.protocol import TCompactProtocol
+from thrift.transport import TTransport
+from thrift.Thrift import TMessageType
+
+logger = logging.getLogger('')
+
+# the open reporters, which send their queued spans at exit
+_reporters = weakref.WeakSet()
+
+
+@atexit.register
+def _close_reporters():
+    for reporter in list(_reporters):
+        reporter.close()
+
+
+class UDPSender(object):
+    """
+    Sends batches of spans as compact thrift to the jaeger agent via UDP.
+
+    The address of the agent is resolved once and again after an error, so an unresolvable agent does not cost
+    a DNS lookup per batch. Errors are logged every *log_interval* seconds at most.
+    """
+
+    # the jaeger agent drops bigger packets
+    max_packet_size = 65000
+
+    def __init__(self, host="localhost", port=6831, log_interval=60):
+        self.host = host
+        self.port = int(port)
+        self.log_interval = log_interval
+
+        self._sock = None
+        self._address = None
+        self._seqid = 0
+        self._last_error = 0
+
+    def serialize(self, batch):
+        """
+        Returns the given batch as emitBatch message of the agent.
+        """
+        self._seqid += 1
+
+        buf = TTransport.TMemoryBuffer()
+        prot = TCompactProtocol.TCompactProtocol(buf)
+        prot.writeMessageBegin("emitBatch", TMessageType.ONEWAY, self._seqid)
+        args = Agent.emitBatch_args()
+        args.batch = batch
+        args.write(prot)
+        prot.writeMessageEnd()
+        return buf.getvalue()
+
+    def send(self, data):
+        """
+        Sends the given packet. Returns False, if it failed.
+        """
+        try:
+            if self._address is None:
+                family, type_, proto, _, address = socket.getaddrinfo(
+                    self.host, self.port, type=socket.SOCK_DGRAM)[0]
+                self._sock = socket.socket(family, type_, proto)
+                self._address = address
+
+            self._sock.sendto(data, self._address)
+            return True
+        except (OSError, IndexError) as e:
+            self.close()
+
+            now = time.time()
+            if now - self._last_error >= self.log_interval:
+                self._last_error = now
+                logger.warning("Tracing: cannot send spans to {}:{}: {}".format(self.host, self.port, e))
+            return False
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = None
+        self._address = None
+
+
+class BatchReporter(BaseReporter):
+    """
+    Reports the finished spans from a background thread, so the requests never wait for the jaeger agent.
+
+    The spans are queued in a queue with *queue_size* entries. If it is full, further spans will be dropped and counted.
+    The thread sends a batch, if it has *batch_size* spans or the oldest span waits for *flush_interval* seconds.
+    All queued spans will be sent, when the process exits.
+
+    If *span_logger* is given, every reported span will be logged with it at debug level.
+    """
+
+    _stop = object()
+
+    def __init__(self, sender, queue_size=1000, batch_size=50, flush_interval=1.0,
+                 metrics_factory=None, span_logger=None):
+        self.sender = sender
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.span_logger = span_logger
+        self.metrics = ReporterMetrics(metrics_factory or LegacyMetricsFactory(Metrics()))
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.reported = 0
+        self.failed = 0
+        self.dropped = 0
+
+        self._process = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+        _reporters.add(self)
+
+    def set_process(self, service_name, tags, max_length):
+        self._process = thrift.make_process(
+            service_name=service_name, tags=tags, max_length=max_length)
+
+    def report_span(self, span):
+        if self.span_logger is not None:
+            self.span_logger.debug("Reporting span %s", span)
+
+        if self._closed:
+            self._drop(1)
+            return
+
+        # started lazily, so it runs in the process, which reports (e.g. a forked worker)
+        if self._pid != os.getpid():
+            self._start()
+
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self._drop(1)
+
+    def after_fork(self):
+        """
+        Resets the queue and the thread in a forked child process. The queued spans are dropped, because the parent sends them.
+        The thread will be started again with the next span.
+        """
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.sender.close()
+
+    def _drop(self, count):
+        self.dropped += count
+        self.metrics.reporter_dropped(count)
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="connexion-plus-reporter", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        spans = []
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.time())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is self._stop:
+                self.submit(spans)
+                return
+
+            if isinstance(item, threading.Event):
+                self.submit(spans)
+                spans, deadline = [], None
+                item.set()
+                continue
+
+            if item is not None:
+                spans.append(item)
+                if deadline is None:
+                    deadline = time.time() + self.flush_interval
+
+            if spans and (len(spans) >= self.batch_size or time.time() >= deadline):
+                self.submit(spans)
+                spans, deadline = [], None
+
+            self.metrics.reporter_queue_length(self.queue.qsize())
+
+    def submit(self, spans):
+        """
+        Sends the given spans. Batches, which are too big for a single packet, will be split.
+        """
+        if not spans or self._process is None:
+            return
+
+        try:
+            data = self.sender.serialize(thrift.make_jaeger_batch(spans=spans, process=self._process))
+        except Exception as e:
+            logger.warning("Tracing: cannot serialize spans: {}".format(e))
+            self._failed(len(spans))
+            return
+
+        if len(data) > self.sender.max_packet_size:
+            if len(spans) == 1:
+                logger.warning("Tracing: span {} is too big to send.".format(spans[0].operation_name))
+                self._failed(1)
+                return
+
+            half = len(spans) // 2
+            self.submit(spans[:half])
+            self.submit(spans[half:])
+            return
+
+        if self.sender.send(data):
+            self.reported += len(spans)
+            self.metrics.reporter_success(len(spans))
+        else:
+            self._failed(len(spans))
+
+    def _failed(self, count):
+        self.failed += count
+        self.metrics.reporter_failure(count)
+
+    def flush(self, timeout=5):
+        """
+        Sends all queued spans and waits at most *timeout* seconds for it. Returns True, if all spans were sent.
+        """
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            return self.queue.empty()
+
+        event = threading.Event()
+        try:
+            self.queue.put(event, timeout=timeout)
+        except queue.Full:
+            return False
+
+        return event.wait(timeout)
+
+    def close(self, timeout=5):
+        """
+        Sends all queued spans and stops the thread. Spans, which are reported afterwards, will be dropped.
+        Returns a done future for the jaeger tracer.
+        """
+        future = Future()
+
+        if not self._closed:
+            self._closed = True
+
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                try:
+                    self.queue.put(self._stop, timeout=timeout)
+                    self._thread.join(timeout)
+                except queue.Full:
+                    logger.warning("Tracing: reporter did not flush in time.")
+
+            self.sender.close()
+            _reporters.discard(self)
+
+        future.set_result(True)
+        return future
+
+    def stats(self):
+        return {
+            "reported": self.reported,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "queued": self.queue.qsize(),
+        }
+
+
+def initialize_tracer(config):
+    """
+    Creates the tracer for the given jaeger config with a BatchReporter and sets it as global tracer.
+
+    The reporter uses the jaeger config keys "reporter_queue_size", "reporter_batch_size" and "reporter_flush_interval",
+    if they are given. Remote sampling needs the channel of jaeger, so it falls back to the tracer of jaeger in this case,
+    which reports the spans with its own reporter.
+    """
+    import opentracing
+
+    sampler = config.sampler
+    if sampler is None:
+        logger.info("Tracing: remote sampling uses the reporter of jaeger instead of the BatchReporter.")
+
+        # not Config#initialize_tracer, because it returns None after the first tracer of the process
+        tracer = config.new_tracer()
+        opentracing.set_global_tracer(tracer)
+        return tracer
+
+    options = {}
+    for key, name in (("reporter_queue_size", "queue_size"),
+                      ("reporter_batch_size", "batch_size"),
+                      ("reporter_flush_interval", "flush_interval")):
+        if key in config.config:
+            options[name] = config.config[key]
+
+    reporter = BatchReporter(
+        UDPSender(config.local_agent_reporting_host, config.local_agent_reporting_port),
+        metrics_factory=getattr(config, "_metrics_factory", None),
+        span_logger=logging.getLogger("jaeger_tracing") if config.logging else None,
+        **options
+    )
+
+    tracer = config.create_tracer(reporter=reporter, sampler=sampler)
+    opentracing.set_global_tracer(tracer)
+    return tracer
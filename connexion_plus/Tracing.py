@@ -0,0 +1,336 @@
+import os
+import re
+import functools
+import importlib
+import threading
+import logging
+
+from flask import request, current_app, has_app_context
+from flask_opentracing import FlaskTracing
+from opentracing.ext import tags as ext_tags
+from jaeger_client.sampler import Sampler, ConstSampler, ProbabilisticSampler, RateLimitingSampler
+
+from .Util import operation_id, is_untraced
+
+logger = logging.getLogger('')
+
+# traces per second and process, so the costs of tracing scale with this budget and not with the traffic
+default_sampler_config = {"type": "ratelimiting", "param": 10}
+
+
+def make_sampler(sampler_type, param):
+    """
+    Returns a jaeger sampler for the given type (const, probabilistic or ratelimiting) and its param.
+    """
+    if sampler_type == "const":
+        if isinstance(param, str):
+            param = param.lower() in ("1", "true")
+        return ConstSampler(decision=bool(param))
+
+    if sampler_type == "probabilistic":
+        return ProbabilisticSampler(rate=float(param))
+
+    if sampler_type in ("ratelimiting", "rate_limiting"):
+        return RateLimitingSampler(max_traces_per_second=float(param))
+
+    raise ValueError("Unknown sampler type: {}".format(sampler_type))
+
+
+def sampler_config_from_env(config):
+    """
+    Returns a copy of the given sampler config, where the type and param are overwritten
+    by the environment variables TRACER_SAMPLER_TYPE and TRACER_SAMPLER_PARAM.
+    """
+    config = dict(config)
+
+    sampler_type = os.getenv("TRACER_SAMPLER_TYPE")
+    if sampler_type:
+        config["type"] = sampler_type
+
+    param = os.getenv("TRACER_SAMPLER_PARAM")
+    if param:
+        config["param"] = param
+
+    return config
+
+
+def create_sampler(config=None):
+    """
+    Creates the sampler for the given config, defaults to #default_sampler_config.
+
+    The config is a dict with the keys "type" and "param" for the default sampler and optional "operations",
+    a dict of connexion operation id (e.g. "api.pets.search") to a sampler config or a probability for this operation.
+    Sampler instances will be returned unchanged.
+    """
+    if config is None:
+        config = default_sampler_config
+
+    if isinstance(config, Sampler):
+        return config
+
+    config = sampler_config_from_env(config)
+    default = make_sampler(config.get("type", "const"), config.get("param", 1))
+
+    operations = config.get("operations")
+    if not operations:
+        return default
+
+    samplers = {}
+    for name, op_config in operations.items():
+        if not isinstance(op_config, dict):
+            op_config = {"type": "probabilistic", "param": op_config}
+        samplers[name] = make_sampler(op_config.get("type", "probabilistic"), op_config.get("param", 1))
+
+    return OperationSampler(default, samplers)
+
+
+def configure_sampler(tracer_config):
+    """
+    Returns a copy of the given jaeger config, where the sampler config is replaced by a sampler of #create_sampler.
+
+    Remote sampling is left to jaeger: like in jaeger, a missing or empty sampler type means remote sampling,
+    unless there are samplers for single operations. The type "remote" is accepted too.
+    """
+    tracer_config = dict(tracer_config)
+    sampler_config = tracer_config.get("sampler", {})
+
+    if isinstance(sampler_config, dict):
+        sampler_type = sampler_config_from_env(sampler_config).get("type")
+        if sampler_type == "remote" or (not sampler_type and not sampler_config.get("operations")):
+            # jaeger creates its RemoteControlledSampler, if there is no type
+            tracer_config["sampler"] = {}
+            logger.info("Tracing: use remote sampling.")
+            return tracer_config
+
+    tracer_config["sampler"] = create_sampler(sampler_config)
+    logger.info("Tracing: use sampler {}.".format(tracer_config["sampler"]))
+    return tracer_config
+
+
+def endpoint_operation_id(endpoint):
+    """
+    Returns the connexion operation id for the given flask endpoint or None, if it is not an endpoint of the current app.
+    """
+    if not endpoint or not has_app_context():
+        return None
+
+    return operation_id(current_app.view_functions.get(endpoint))
+
+
+class OperationSampler(Sampler):
+    """
+    Samples every operation with its own sampler and all other operations with the *default* sampler.
+
+    The keys of *samplers* are the span operation names or the connexion operation ids.
+    Flask spans are named after the endpoint, so they will be resolved to the operation id with *resolve* once.
+    """
+
+    max_operations = 1024
+
+    def __init__(self, default, samplers, resolve=endpoint_operation_id):
+        super().__init__()
+        self.default = default
+        self.samplers = dict(samplers)
+        self.resolve = resolve
+        self._resolved = {}
+        self._lock = threading.Lock()
+
+    def sampler_for(self, operation):
+        try:
+            return self._resolved[operation]
+        except KeyError:
+            pass
+
+        sampler = self.samplers.get(operation)
+        if sampler is None:
+            sampler = self.samplers.get(self.resolve(operation), self.default)
+
+        # the span names of clients can be arbitrary, so the memo is bounded
+        with self._lock:
+            if len(self._resolved) < self.max_operations:
+                self._resolved[operation] = sampler
+
+        return sampler
+
+    def is_sampled(self, trace_id, operation=""):
+        return self.sampler_for(operation).is_sampled(trace_id, operation)
+
+    def close(self):
+        self.default.close()
+        for sampler in self.samplers.values():
+            sampler.close()
+
+    def __str__(self):
+        return "OperationSampler(default={}, operations={})".format(
+            self.default, {name: str(sampler) for name, sampler in self.samplers.items()})
+
+
+def sample_on_error(app, tracing):
+    """
+    Samples the span of every request with a server error, even if the sampler dropped it.
+
+    Flask calls the after_request functions in reverse order, so this has to be registered after FlaskTracing,
+    which finishes the span.
+    """
+
+    def after_request(response):
+        if response.status_code >= 500:
+            span = tracing.get_span(request)
+            if span is not None:
+                span.set_tag(ext_tags.SAMPLING_PRIORITY, 1)
+                span.set_tag(ext_tags.ERROR, True)
+        return response
+
+    app.after_request(after_request)
+
+
+class ExclusionMatcher(object):
+    """
+    Decides, which requests will not be traced at all, e.g. probes and scrapes.
+
+    *paths* is a list of path prefixes, *endpoints* a list of flask endpoint names and *methods* a list of http methods.
+    The prefixes are compiled into a single regular expression, so a request is matched with one lookup per kind.
+    """
+
+    default_paths = ("/metrics",)
+    default_endpoints = ("static",)
+    default_methods = ("OPTIONS",)
+
+    def __init__(self, paths=None, endpoints=None, methods=None):
+        self.paths = tuple(paths if paths is not None else self.default_paths)
+        self.endpoints = frozenset(endpoints if endpoints is not None else self.default_endpoints)
+        self.methods = frozenset(m.upper() for m in (methods if methods is not None else self.default_methods))
+
+        self._match_path = None
+        if self.paths:
+            # longest prefixes first, so the alternation does not stop at a shorter one
+            prefixes = sorted(self.paths, key=len, reverse=True)
+            self._match_path = re.compile("|".join(re.escape(p) for p in prefixes)).match
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Creates the matcher from the keys "exclude_paths", "exclude_endpoints" and "exclude_methods" of the given dict.
+        """
+        if not isinstance(config, dict):
+            config = {}
+
+        return cls(
+            paths=config.get("exclude_paths"),
+            endpoints=config.get("exclude_endpoints"),
+            methods=config.get("exclude_methods"),
+        )
+
+    def __call__(self, req):
+        """
+        Returns True, if the given request should not be traced.
+        """
+        return (
+            req.method in self.methods
+            or req.endpoint in self.endpoints
+            or (self._match_path is not None and self._match_path(req.path) is not None)
+        )
+
+
+class ExcludingFlaskTracing(FlaskTracing):
+    """
+    FlaskTracing, which does not create spans for the requests matched by *exclude* (see ExclusionMatcher).
+    The exclusion only applies to this instance, so other apps in the same process are not affected.
+    """
+
+    def __init__(self, tracer=None, trace_all_requests=None, app=None,
+                 traced_attributes=[], start_span_cb=None, exclude=None):
+        self.exclude = exclude if exclude is not None else ExclusionMatcher()
+        super().__init__(tracer, trace_all_requests, app, traced_attributes, start_span_cb)
+
+    def _before_request_fn(self, attributes):
+        # without a scope, _after_request_fn does nothing for this request
+        if self.exclude(request):
+            return
+
+        super()._before_request_fn(attributes)
+
+
+# integration name -> install function of opentracing_instrumentation
+client_hooks = {
+    "boto3": "opentracing_instrumentation.client_hooks.boto3.install_patches",
+    "celery": "opentracing_instrumentation.client_hooks.celery.install_patches",
+    "mysqldb": "opentracing_instrumentation.client_hooks.mysqldb.install_patches",
+    "psycopg2": "opentracing_instrumentation.client_hooks.psycopg2.install_patches",
+    "redis": "opentracing_instrumentation.client_hooks.strict_redis.install_patches",
+    "sqlalchemy": "opentracing_instrumentation.client_hooks.sqlalchemy.install_patches",
+    "tornado_http": "opentracing_instrumentation.client_hooks.tornado_http.install_patches",
+    "urllib": "opentracing_instrumentation.client_hooks.urllib.install_patches",
+    "urllib2": "opentracing_instrumentation.client_hooks.urllib2.install_patches",
+    "requests": "opentracing_instrumentation.client_hooks.requests.install_patches",
+}
+
+# the http clients propagate the traces to other microservices
+default_client_hooks = ("requests", "urllib", "urllib2")
+
+# integration name -> (module, class, method), which can skip the tracing for internal calls (see Util#untraced)
+untraceable_methods = {
+    "redis": [("redis", "StrictRedis", "execute_command")],
+    "requests": [("requests.adapters", "HTTPAdapter", "send")],
+}
+
+
+def skip_untraced(original, patched):
+    """
+    Returns a method, which calls the *original* method for internal calls (see Util#is_untraced) and the *patched* one otherwise.
+    """
+
+    @functools.wraps(patched)
+    def method(self, *args, **kwargs):
+        if is_untraced(self):
+            return original(self, *args, **kwargs)
+        return patched(self, *args, **kwargs)
+
+    return method
+
+
+def install_client_hooks(patches=None):
+    """
+    Patches the given client integrations (see #client_hooks), so their calls create child spans.
+    *patches* defaults to #default_client_hooks, "all" patches all integrations.
+
+    Returns the names of the installed integrations. Integrations, whose library is not installed, will be skipped.
+    """
+    if patches is None:
+        patches = default_client_hooks
+    elif patches == "all":
+        patches = tuple(client_hooks)
+
+    installed = []
+    for name in patches:
+        path = client_hooks.get(name)
+        if path is None:
+            logger.warning("Tracing: unknown client integration {}.".format(name))
+            continue
+
+        module_name, function = path.rsplit(".", 1)
+        try:
+            install = getattr(importlib.import_module(module_name), function)
+        except ImportError as e:
+            logger.warning("Tracing: cannot patch {}: {}".format(name, e))
+            continue
+
+        targets = []
+        for target_module, target_class, target_method in untraceable_methods.get(name, ()):
+            try:
+                owner = getattr(importlib.import_module(target_module), target_class)
+            except (ImportError, AttributeError):
+                continue
+            targets.append((owner, target_method, getattr(owner, target_method)))
+
+        install()
+
+        for owner, method, original in targets:
+            patched = getattr(owner, method)
+            if patched is not original:
+                setattr(owner, method, skip_untraced(original, patched))
+
+        installed.append(name)
+
+    logger.info("Tracing: patched client integrations {}.".format(installed))
+    return installed
@@ -1,15 +1,139 @@
 import logging
+import threading
+
 
 class TracingHandler(logging.StreamHandler):
-    def __init__(self, use_tracer):
+    """
+    Logs the records into the active span of the given tracer.
+
+    Records without an active span or with an unsampled span will be dropped, before they are formatted.
+    A span gets *max_logs* logs at most, all further records will be dropped.
+
+    If the handler is registered for a flask app with #init_app, the records of a request span will be buffered
+    and formatted at once, before the span finishes. So a request, which will not be sampled, never formats its records.
+    """
+
+    def __init__(self, use_tracer, max_logs=100, max_buffered_spans=1024):
         logging.StreamHandler.__init__(self)
         self.tracer = use_tracer
+        self.max_logs = max_logs
+        self.max_buffered_spans = max_buffered_spans
+        self.dropped = 0
+
+        # id(span) -> (span, list of records)
+        self._buffers = {}
+        self._buffers_lock = threading.Lock()
+        self._current_span = self._resolve_current_span()
+
+    def _resolve_current_span(self):
+        """
+        Returns the function, which returns the active span. It is resolved once, because emit is called for every record.
+        """
+        import opentracing
+
+        if isinstance(self.tracer, opentracing.Tracer):
+            tracer = self.tracer
+            return lambda: tracer.active_span
+
+        try:
+            from opentracing_instrumentation import request_context
+
+            return request_context.get_current_span
+        except ImportError:
+            return lambda: opentracing.global_tracer().active_span
+
+    def init_app(self, app, tracing):
+        """
+        Buffers the records of the request spans of the given FlaskTracing and logs them, before the span finishes.
+
+        Flask calls the after_request and teardown_request functions in reverse order,
+        so this has to be registered after FlaskTracing.
+        """
+        from flask import request
+
+        def before_request():
+            span = tracing.get_span(request)
+            if span is not None:
+                self.buffer(span)
+
+        def after_request(response):
+            self.flush_span(tracing.get_span(request))
+            return response
+
+        def teardown_request(error):
+            # the span was not finished by after_request, if the request failed
+            if error is not None:
+                self.flush_span(tracing.get_span(request))
+
+        app.before_request(before_request)
+        app.after_request(after_request)
+        app.teardown_request(teardown_request)
+
+    def buffer(self, span):
+        """
+        Starts to buffer the records for the given span until #flush_span.
+        """
+        with self._buffers_lock:
+            if len(self._buffers) >= self.max_buffered_spans:
+                return
+            self._buffers[id(span)] = (span, [])
+
+    def flush_span(self, span):
+        """
+        Logs the buffered records into the given span, if it is sampled.
+        """
+        if span is None:
+            return
+
+        with self._buffers_lock:
+            buffered = self._buffers.pop(id(span), None)
+
+        if buffered is None or not self._sampled(span):
+            return
+
+        for record in buffered[1]:
+            self._log(span, record)
+
+    def after_fork(self):
+        """
+        Drops the buffers of the requests of the parent process in a forked child process.
+        """
+        self._buffers = {}
+        self._buffers_lock = threading.Lock()
 
     def emit(self, record):
-        from opentracing_instrumentation import request_context
-        span = request_context.get_current_span()
-        
-        if span is not None:
+        span = self._current_span()
+        if span is None:
+            return
+
+        buffered = self._buffers.get(id(span))
+        if buffered is not None and buffered[0] is span:
+            # the sampling decision can change until the span finishes, e.g. on server errors
+            records = buffered[1]
+            if len(records) < self.max_logs:
+                records.append(record)
+            else:
+                self.dropped += 1
+            return
+
+        if self._sampled(span):
+            self._log(span, record)
+
+    def _log(self, span, record):
+        logs = getattr(span, "logs", None)
+        if logs is not None and len(logs) >= self.max_logs:
+            self.dropped += 1
+            return
+
+        try:
             msg = self.format(record)
-            span.log_kv({logging.getLevelName(record.levelno): msg})
+        except Exception:
+            self.handleError(record)
+            return
+
+        span.log_kv({record.levelname: msg}, timestamp=record.created)
 
+    @staticmethod
+    def _sampled(span):
+        is_sampled = getattr(span, "is_sampled", None)
+        return is_sampled is None or is_sampled()
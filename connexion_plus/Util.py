@@ -1,26 +1,51 @@
 
 from urllib.parse import urlparse
+from contextlib import contextmanager
+import contextvars
+import threading
+import hashlib
+import logging
+import json
+import pickle
 import os
-import requests
 import yaml
 
+logger = logging.getLogger('')
 
-def load_oai(files):
+
+# the C implementation of libyaml is much faster, if it is installed
+_yaml_loader = getattr(yaml, "CFullLoader", yaml.FullLoader)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def load_oai(files, cache_dir=None, timeout=30, max_workers=8, compiled=False):
     """
     Loads the given files. Either files is from type String or List of Strings.
 
     For convenience, you can use multiple files separated by ";" in a string:
     e.g. "file1;../file2;http://rawfile.com/petstore.yaml"
+
+    Multiple files are loaded concurrently with *max_workers* threads, the order is kept.
+    See #internal_load_oai for *cache_dir* and *timeout*. If *compiled* is True, the files are loaded with #load_compiled_oai.
     """
+    load = load_compiled_oai if compiled else internal_load_oai
+
     if isinstance(files, str):
         # split, if string are multiple files separated by ;
         split = parse_env(files)
         files = split if len(split) > 1 else [files]
 
     if isinstance(files, list):
-        oai = [internal_load_oai(f) for f in files]
-        return oai
-    
+        if len(files) < 2:
+            return [load(f, cache_dir, timeout) for f in files]
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(files))) as executor:
+            return list(executor.map(lambda f: load(f, cache_dir, timeout), files))
+
     raise ValueError("Files need to be from type string or list of strings.")
 
 def parse_env(env: str):
@@ -29,26 +54,182 @@ def parse_env(env: str):
     """
     return env.split(";")
 
-def internal_load_oai(file: str):
+def internal_load_oai(file: str, cache_dir=None, timeout=30):
+    """
+    For internal use only.
+
+    Urls are downloaded with a timeout of *timeout* seconds. If *cache_dir* (defaults to the environment variable OAI_CACHE_DIR) is given,
+    the downloads are stored there and revalidated with ETag and If-Modified-Since, so an unchanged file is not downloaded again.
+    If the server cannot be reached, the cached file is used.
+    """
+    return yaml.load(read_oai(file, cache_dir, timeout), Loader=_yaml_loader)
+
+
+def read_oai(file, cache_dir=None, timeout=30):
     """
     For internal use only.
+
+    Returns the content of the given file or url, see #internal_load_oai.
     """
-    openapi_file = None
     # the file is an url and should be loaded
     if is_url(file):
-        # download file
-        openapi_file = requests.get(file)
-        # read in yaml
-        openapi_file = openapi_file.content
+        return download_oai(file, cache_dir or os.getenv("OAI_CACHE_DIR"), timeout)
 
     # else if the file is a file, read it
-    elif is_file(file):
-        with open(file, 'r') as f:
-            openapi_file = f.read()
+    if is_file(file):
+        with open(file, 'rb') as f:
+            return f.read()
+
+    raise ValueError(f"Not a valid oai url or filepath: {file}.")
+
+
+# increase it, if the compiled format changes
+COMPILED_VERSION = 2
+
+
+def load_compiled_oai(file, cache_dir=None, timeout=30):
+    """
+    Loads the given file or url like #internal_load_oai and prepares it with #compile_oai.
+
+    The result is stored as pickle next to the file ("<file>.compiled") or for urls in *cache_dir* (defaults to the environment variable OAI_CACHE_DIR).
+    All workers and restarts reuse it, as long as the sha256 of the content is the same, so they do not parse the yaml again.
+    If the compiled file cannot be written, the spec is compiled in memory only.
+
+    Pickles can execute code, so only use it with files in locations, which you trust like your source code.
+    """
+    content = read_oai(file, cache_dir, timeout)
+    header = "{}:{}:{}\n".format(
+        COMPILED_VERSION, pickle.HIGHEST_PROTOCOL, hashlib.sha256(content).hexdigest()).encode("ascii")
+
+    if is_url(file):
+        cache_dir = cache_dir or os.getenv("OAI_CACHE_DIR")
+        path = os.path.join(cache_dir, hashlib.sha256(file.encode("utf-8")).hexdigest() + ".compiled") if cache_dir else None
     else:
-        raise ValueError(f"Not a valid oai url or filepath: {file}.")
+        path = file + ".compiled"
+
+    if path is not None and os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                # the header is compared first, so an outdated spec is never unpickled
+                if f.readline() == header:
+                    return pickle.load(f)
+        except Exception as e:
+            logger.warning("Cannot load the compiled {}, compile it again: {}".format(path, e))
+
+    spec = compile_oai(yaml.load(content, Loader=_yaml_loader))
+
+    if path is not None:
+        try:
+            _write_atomic(path, header + pickle.dumps(spec, pickle.HIGHEST_PROTOCOL))
+        except OSError as e:
+            logger.warning("Cannot store the compiled {}: {}".format(path, e))
+
+    return spec
+
+
+def compile_oai(spec):
+    """
+    For internal use only.
+
+    Returns the given spec with string keys like connexion expects them. The $refs are kept, because connexion resolves them
+    itself and the resolved $refs of recursive schemas are cycles, which connexion cannot copy.
+    """
+    # YAML supports integer keys (e.g. status codes), but JSON does not
+    if isinstance(spec, dict):
+        return {str(k): compile_oai(v) for k, v in spec.items()}
+    if isinstance(spec, list):
+        return [compile_oai(v) for v in spec]
+    return spec
+
+
+def get_session():
+    """
+    For internal use only.
+
+    Returns the requests session of this process, so the connections are reused for all downloads.
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            # requests is imported here, because it is only needed for urls
+            import requests
+            from .Prefork import register_after_fork
 
-    return yaml.full_load(openapi_file)
+            _session = requests.Session()
+            # the specs are internal traffic, see connexion_plus.Tracing
+            for adapter in _session.adapters.values():
+                mark_untraced(adapter)
+
+            # the connections must not be shared with a forked process
+            register_after_fork(_reset_session)
+
+        return _session
+
+
+def _reset_session():
+    global _session, _session_lock
+    _session = None
+    _session_lock = threading.Lock()
+
+
+def download_oai(url, cache_dir=None, timeout=30):
+    """
+    For internal use only.
+
+    Returns the content of the given url. See #internal_load_oai for the cache.
+    """
+    import requests
+
+    body_path = meta_path = None
+    meta = {}
+    headers = {}
+
+    if cache_dir:
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        body_path = os.path.join(cache_dir, name + ".yaml")
+        meta_path = os.path.join(cache_dir, name + ".json")
+
+        if os.path.exists(body_path) and os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        response = get_session().get(url, headers=headers, timeout=timeout)
+        if response.status_code != 304:
+            response.raise_for_status()
+    except requests.RequestException as e:
+        if not meta:
+            raise
+        logger.warning("Cannot download {}, use the cached file: {}".format(url, e))
+        response = None
+
+    if response is not None and response.status_code != 304:
+        if body_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            _write_atomic(body_path, response.content)
+            _write_atomic(meta_path, json.dumps({
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }).encode("utf-8"))
+        return response.content
+
+    with open(body_path, "rb") as f:
+        return f.read()
+
+
+def _write_atomic(path, data):
+    # other workers could read the file at the same time
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
 
 
 def is_url(url):
@@ -67,3 +248,58 @@ def is_file(path):
     For internal use only.
     """
     return (os.path.exists(path) and not os.path.isdir(path))
+
+
+def operation_id(view):
+    """
+    Returns the operation id for the given view function, which is the module and name of the function,
+    which was resolved by connexion. The decorators of connexion are followed via __wrapped__.
+
+    Returns None, if no view function was given.
+    """
+    if view is None:
+        return None
+
+    while hasattr(view, "__wrapped__"):
+        view = view.__wrapped__
+
+    name = getattr(view, "__qualname__", None) or getattr(view, "__name__", None)
+    module = getattr(view, "__module__", None)
+
+    if name is None:
+        return None
+
+    return "{}.{}".format(module, name) if module else name
+
+
+_untraced = contextvars.ContextVar("connexion_plus_untraced", default=False)
+UNTRACED_ATTRIBUTE = "connexion_plus_untraced"
+
+
+@contextmanager
+def untraced():
+    """
+    The client calls within this context will not be traced, e.g. calls for internal purposes.
+    Only works for the clients patched by connexion_plus.Tracing#install_client_hooks.
+    """
+    token = _untraced.set(True)
+    try:
+        yield
+    finally:
+        _untraced.reset(token)
+
+
+def mark_untraced(client):
+    """
+    The calls of the given client (e.g. a redis client or requests adapter) will never be traced.
+    Returns the client.
+    """
+    setattr(client, UNTRACED_ATTRIBUTE, True)
+    return client
+
+
+def is_untraced(client=None):
+    """
+    Returns True, if the current call should not be traced, because of #untraced or #mark_untraced.
+    """
+    return _untraced.get() or getattr(client, UNTRACED_ATTRIBUTE, False)
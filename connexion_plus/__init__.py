@@ -1,6 +1,39 @@
 name = "connexion-plus"
 
-from .Application import App
-from .MultipleResourceResolver import MultipleResourceResolver
-from .Optimizer import FlaskOptimize
-from .Util import *
\ No newline at end of file
+import sys
+import types
+import importlib
+
+# the features will be imported on first access, so unused features cost nothing at import time
+_lazy = {
+    "App": ".Application",
+    "MultipleResourceResolver": ".MultipleResourceResolver",
+    "FlaskOptimize": ".Optimizer",
+}
+
+
+def __getattr__(attr):
+    module = _lazy.get(attr)
+    if module is None:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, attr))
+
+    value = getattr(importlib.import_module(module, __name__), attr)
+    globals()[attr] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy))
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, attr, value):
+        # the import of a submodule sets it on the package, which must not hide the class with the same name
+        if attr in _lazy and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(attr, value)
+
+
+sys.modules[__name__].__class__ = _Package
+
+from .Util import *
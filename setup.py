@@ -16,7 +16,7 @@ setup(
     author_email='peter.heiss@uni-muenster.de',
     url='https://github.com/Heiss/connexion-plus',
     keywords=['connexion', 'microservice', 'tracing', 'prometheus', 'jaeger'],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=[
         'connexion',
         'jaeger-client',
@@ -27,16 +27,18 @@ setup(
         'htmlmin',
         'flask-cors',
         'Flask-APScheduler',
-        'redis-pubsub-dict-wo-cluster',
         'redis',
     ],
+    extras_require={
+        'brotli': ['brotli'],
+        'zstd': ['zstandard'],
+    },
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
         'Topic :: Software Development :: Build Tools',
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
     ],
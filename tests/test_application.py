@@ -0,0 +1,123 @@
+import sys
+import subprocess
+import unittest
+
+from connexion_plus import FlaskOptimize
+
+
+class Test_LazyImport(unittest.TestCase):
+    def run_python(self, code):
+        return subprocess.run([sys.executable, "-c", code], check=True,
+                              stdout=subprocess.PIPE, universal_newlines=True).stdout.split()
+
+    def test_import_is_lazy(self):
+        loaded = self.run_python(
+            "import sys, connexion_plus; "
+            "print(*[m for m in ('connexion', 'requests', 'connexion_plus.Optimizer') if m in sys.modules])")
+        self.assertEqual(loaded, [])
+
+    def test_attributes(self):
+        names = self.run_python(
+            "import connexion_plus; "
+            "print(connexion_plus.FlaskOptimize.__name__, connexion_plus.App.__name__)")
+        self.assertEqual(names, ["FlaskOptimize", "App"])
+
+    def test_submodule_keeps_class(self):
+        # the submodule has the same name as the class
+        names = self.run_python(
+            "import connexion_plus.MultipleResourceResolver, connexion_plus; "
+            "print(connexion_plus.MultipleResourceResolver.__name__, type(connexion_plus.MultipleResourceResolver).__name__)")
+        self.assertEqual(names, ["MultipleResourceResolver", "type"])
+
+    def test_unknown_attribute(self):
+        import connexion_plus
+
+        self.assertRaises(AttributeError, getattr, connexion_plus, "Unknown")
+
+
+class Test_StartupProfile(unittest.TestCase):
+    def test_profile(self):
+        from connexion_plus import App
+
+        app = App("profiled", use_optimizer=True, use_cors=True, use_profile=True)
+        names = [step[0] for step in app.startup_profile]
+        self.assertEqual(names, ["connexion", "cors", "optimizer"])
+
+        for _, seconds, modules in app.startup_profile:
+            self.assertGreaterEqual(seconds, 0)
+            self.assertGreaterEqual(modules, 0)
+
+    def test_disabled(self):
+        from connexion_plus import App
+
+        self.assertIsNone(App("unprofiled", use_profile=False).startup_profile)
+
+
+class Test_Optimizer(unittest.TestCase):
+    def test_cache_hits_are_measured(self):
+        from connexion_plus import App, FlaskOptimize
+
+        app = App("optimized", use_metric=True, use_optimizer={"compress": True})
+        calls = []
+
+        @FlaskOptimize.set_cache_timeout(60)
+        def cached():
+            calls.append(1)
+            return "cached"
+
+        app.app.add_url_rule("/cached", "cached", cached)
+        client = app.app.test_client()
+
+        for _ in range(3):
+            self.assertEqual(client.get("/cached").data, b"cached")
+        self.assertEqual(len(calls), 1)
+
+        # the hits are served after the hooks of the metrics ran
+        registry = app.metrics.registry
+        labels = {"method": "GET", "path": "/cached", "status": "200"}
+        self.assertEqual(registry.get_sample_value("flask_http_request_duration_seconds_count", labels), 3)
+        self.assertEqual(registry.get_sample_value("flask_http_request_total", {"method": "GET", "status": "200"}), 3)
+
+        # a second app in the same process reuses the metrics of the optimizer
+        other = App("optimized", use_metric=True, use_optimizer={"compress": True})
+        self.assertIs(other.optimize.metrics.cache_requests, app.optimize.metrics.cache_requests)
+
+
+calls = []
+
+
+@FlaskOptimize.set_cache_timeout(60)
+def secured():
+    calls.append(1)
+    return "secret {}".format(len(calls))
+
+
+def apikey_info(apikey, required_scopes=None):
+    return {"sub": "user"} if apikey == "key" else None
+
+
+secured_spec = {
+    "openapi": "3.0.0",
+    "info": {"title": "secured", "version": "1.0"},
+    "components": {"securitySchemes": {"key": {
+        "type": "apiKey", "in": "header", "name": "X-Key", "x-apikeyInfoFunc": "{}.apikey_info".format(__name__)}}},
+    "paths": {"/secured": {"get": {
+        "operationId": "{}.secured".format(__name__),
+        "security": [{"key": []}],
+        "responses": {"200": {"description": "ok", "content": {"text/plain": {"schema": {"type": "string"}}}}},
+    }}},
+}
+
+
+class Test_SecuredOperation(unittest.TestCase):
+    def test_not_cached(self):
+        from connexion_plus import App
+
+        app = App("secured", use_optimizer={"compress": False})
+        app.add_api(secured_spec)
+        client = app.app.test_client()
+
+        self.assertEqual(client.get("/secured", headers={"X-Key": "key"}).data, b"secret 1")
+        # the cached response would skip the check of the credentials
+        self.assertEqual(client.get("/secured").status_code, 401)
+        self.assertEqual(client.get("/secured", headers={"X-Key": "key"}).data, b"secret 2")
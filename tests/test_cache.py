@@ -0,0 +1,345 @@
+import unittest
+import time
+
+from connexion_plus.Cache import LocalCache, RedisCache, CacheEntry
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+class Test_LocalCache(unittest.TestCase):
+    def test_get_set(self):
+        cache = LocalCache()
+        self.assertIsNone(cache.get("a"))
+
+        cache.set("a", b"value", 10)
+        self.assertEqual(cache.get("a"), b"value")
+        self.assertTrue(cache.delete("a"))
+        self.assertFalse(cache.delete("a"))
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_leases(self):
+        cache = LocalCache()
+        lease = cache.acquire("a", 10)
+        self.assertIsNotNone(lease)
+        self.assertIsNone(cache.acquire("a", 10))
+        self.assertIsNotNone(cache.acquire("b", 10))
+
+        cache.release("a", lease)
+        self.assertTrue(lease.event.is_set())
+        self.assertIsNotNone(cache.acquire("a", 10))
+
+    def test_max_entries(self):
+        cache = LocalCache(max_entries=2)
+        cache.set("a", b"1", 10)
+        cache.set("b", b"2", 10)
+
+        # a is now the most recently used entry
+        cache.get("a")
+        cache.set("c", b"3", 10)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"1")
+        self.assertEqual(cache.get("c"), b"3")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_max_bytes(self):
+        cache = LocalCache(max_bytes=10)
+        cache.set("a", b"12345", 10)
+        cache.set("b", b"12345", 10)
+        self.assertEqual(cache.stats()["bytes"], 10)
+
+        cache.set("c", b"1", 10)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["bytes"], 6)
+
+        # too big for the whole cache
+        cache.set("d", b"12345678901", 10)
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(len(cache), 2)
+
+    def test_expiry(self):
+        cache = LocalCache()
+        cache.set("a", b"1", 0.05)
+        cache.set("b", b"2", 0.05)
+        cache.set("c", b"3", 10)
+        time.sleep(0.1)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.purge_expired(), 1)
+        self.assertEqual(cache.stats()["expirations"], 2)
+        self.assertEqual(len(cache), 1)
+
+    def test_invalidate_tags(self):
+        cache = LocalCache()
+        cache.set("a", b"1", 10, tags=("user:1", "users"))
+        cache.set("b", b"2", 10, tags=("user:2", "users"))
+        cache.set("c", b"3", 10)
+
+        self.assertEqual(cache.invalidate_tags(["user:1"]), 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), b"2")
+
+        self.assertEqual(cache.invalidate_tags(["users", "unknown"]), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), b"3")
+        self.assertEqual(cache._tags, {})
+
+    def test_invalidate_prefix(self):
+        cache = LocalCache(max_entries=3)
+        cache.set("GET/users/1", b"1", 10)
+        cache.set("GET/users/2", b"2", 10)
+        cache.set("GET/usersettings", b"3", 10)
+        cache.set("GET/users/3", b"4", 10)  # evicts GET/users/1
+
+        self.assertEqual(cache.invalidate_prefix("GET/users/"), 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get("GET/usersettings"), b"3")
+        self.assertEqual(cache._keys, ["GET/usersettings"])
+
+
+    def test_prefix_index(self):
+        cache = LocalCache()
+        cache.set("b", b"1", 10)
+
+        # the index is only built for prefix lookups
+        self.assertIsNone(cache._keys)
+        self.assertEqual(cache.invalidate_prefix("a"), 0)
+        self.assertEqual(cache._keys, ["b"])
+
+        # new and removed keys are merged on the next lookup
+        cache.set("a1", b"1", 10)
+        cache.set("a2", b"2", 10)
+        cache.delete("a2")
+        cache.set("a2", b"2", 10)
+        cache.delete("b")
+
+        self.assertEqual(cache.invalidate_prefix("a"), 2)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache._keys, [])
+
+class Test_CacheEntry(unittest.TestCase):
+    def test_roundtrip(self):
+        entry = CacheEntry(200, (("Content-Type", "application/json"), ("X-Next", "2")),
+                           b'{"a": 1}', {"gzip": b"\x1f\x8b..."}, 1234.5)
+        loaded = CacheEntry.loads(entry.dumps())
+
+        self.assertEqual(loaded.status, 200)
+        self.assertEqual(loaded.headers, entry.headers)
+        self.assertEqual(loaded.body, entry.body)
+        self.assertEqual(loaded.variants, entry.variants)
+        self.assertEqual(loaded.expires, 1234.5)
+        self.assertEqual(loaded.size, entry.size)
+        self.assertEqual(loaded.digest, entry.digest)
+
+    def test_invalid(self):
+        data = CacheEntry(200, (), b"body").dumps()
+
+        with self.assertRaises(ValueError):
+            CacheEntry.loads(b"nothing")
+
+        with self.assertRaises(ValueError):
+            CacheEntry.loads(data[:-1])
+
+    def test_to_response(self):
+        entry = CacheEntry(201, (("Content-Type", "text/plain"),),
+                           b"body", {"gzip": b"zipped"})
+
+        resp = entry.to_response()
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.mimetype, "text/plain")
+        self.assertEqual(resp.get_data(), b"body")
+
+        resp = entry.to_response("gzip")
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.get_data(), b"zipped")
+
+        # every call creates a new response
+        self.assertIsNot(entry.to_response(), entry.to_response())
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+class Test_RedisCache(unittest.TestCase):
+    def setUp(self):
+        self.client = fakeredis.FakeRedis()
+        self.entry = CacheEntry(200, (("Content-Type", "text/plain"),),
+                                b"body", {"gzip": b"zipped"})
+
+    def test_shared(self):
+        first = RedisCache(self.client, near_entries=0)
+        second = RedisCache(self.client, near_entries=0)
+
+        self.assertIsNone(second.get("a"))
+        first.set("a", self.entry, 10)
+
+        entry = second.get("a")
+        self.assertEqual(entry.body, b"body")
+        self.assertEqual(entry.variants, {"gzip": b"zipped"})
+        self.assertTrue(0 < self.client.pttl("FlaskOptimize_Caching:entry:a") <= 10000)
+
+        self.assertTrue(first.delete("a"))
+        self.assertIsNone(second.get("a"))
+
+    def test_native_expiry(self):
+        cache = RedisCache(self.client, near_entries=0)
+        cache.set("a", self.entry, 0.05)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+
+    def test_near_cache(self):
+        cache = RedisCache(self.client, near_timeout=10)
+        cache.set("a", self.entry, 10)
+
+        self.client.flushall()
+        self.assertEqual(cache.get("a").body, b"body")
+        self.assertEqual(cache.stats()["near_hits"], 1)
+
+        cache.near_cache.clear()
+        self.assertIsNone(cache.get("a"))
+
+    def test_untraced_client(self):
+        from connexion_plus.Util import is_untraced
+
+        cache = RedisCache(self.client, near_entries=0)
+        self.assertTrue(is_untraced(cache.client))
+        self.assertFalse(is_untraced(self.client))
+
+    def test_decoding_client(self):
+        cache = RedisCache(fakeredis.FakeRedis(decode_responses=True))
+        self.assertFalse(
+            cache.client.connection_pool.connection_kwargs.get("decode_responses"))
+
+    def test_invalid_entry(self):
+        cache = RedisCache(self.client, near_entries=0)
+        self.client.set("FlaskOptimize_Caching:entry:a", b"garbage")
+        self.assertIsNone(cache.get("a"))
+
+    def test_clear(self):
+        cache = RedisCache(self.client)
+        cache.set("a", self.entry, 10)
+        cache.set("b", self.entry, 10)
+        self.client.set("other", b"1")
+        lease = cache.acquire("c", 10)
+
+        cache.clear()
+        self.assertTrue(self.client.exists("FlaskOptimize_Caching:lock:c"))
+        cache.release("c", lease)
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(self.client.get("other"), b"1")
+
+    def test_invalidate_tags(self):
+        cache = RedisCache(self.client, near_entries=0)
+        cache.set("a", self.entry, 10, tags=("user:1", "users"))
+        cache.set("b", self.entry, 10, tags=("users",))
+        cache.set("c", self.entry, 10)
+
+        self.assertEqual(cache.invalidate_tags(["user:1"]), 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("b"))
+
+        self.assertEqual(cache.invalidate_tags(["users"]), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertEqual(cache.invalidate_tags(["users"]), 0)
+
+    def test_expired_keys_leave_the_tag(self):
+        cache = RedisCache(self.client, near_entries=0)
+        cache.set("a", self.entry, 0.05, tags=("users",))
+        time.sleep(0.1)
+        cache.set("b", self.entry, 10, tags=("users",))
+
+        self.assertEqual(self.client.zrange(
+            "FlaskOptimize_Caching:tag:users", 0, -1), [b"b"])
+
+    def test_invalidate_prefix(self):
+        cache = RedisCache(self.client, near_entries=0)
+        cache.set("GET/users/1", self.entry, 10)
+        cache.set("GET/users/2", self.entry, 10)
+        cache.set("GET/usersettings", self.entry, 10)
+        cache.set("GET/[x]", self.entry, 10)
+
+        self.assertEqual(cache.invalidate_prefix("GET/users/"), 2)
+        self.assertIsNone(cache.get("GET/users/1"))
+        self.assertIsNotNone(cache.get("GET/usersettings"))
+
+        # glob characters are matched literally
+        self.assertEqual(cache.invalidate_prefix("GET/[x"), 1)
+        self.assertEqual(self.client.zrange(cache.index_key, 0, -1), [b"GET/usersettings"])
+
+    def test_namespaces(self):
+        cache = RedisCache(self.client, near_entries=0)
+        cache.set("pets", self.entry, 10, tags=("pets",))
+        cache.set("tag:pets", self.entry, 10)
+        lease = cache.acquire("lock:a", 10)
+
+        # neither tags nor leases are entries
+        self.assertEqual(cache.invalidate_prefix("t"), 1)
+        self.assertEqual(cache.invalidate_prefix(""), 1)
+        self.assertTrue(self.client.exists("FlaskOptimize_Caching:lock:lock:a"))
+        cache.release("lock:a", lease)
+
+        cache.set("pets", self.entry, 10, tags=("pets",))
+        self.assertEqual(cache.invalidate_tags(["pets"]), 1)
+        self.assertEqual(self.client.zrange(cache.index_key, 0, -1), [])
+
+    def test_purge_expired(self):
+        cache = RedisCache(self.client, near_entries=0)
+        cache.set("a", self.entry, 0.05)
+        cache.set("b", self.entry, 10)
+        time.sleep(0.1)
+
+        self.assertEqual(cache.purge_expired(), 1)
+        self.assertEqual(self.client.zrange(cache.index_key, 0, -1), [b"b"])
+        self.assertEqual(self.client.zrange(cache.expiry_key, 0, -1), [b"b"])
+
+    def test_propagation(self):
+        first = RedisCache(self.client, near_timeout=60)
+        second = RedisCache(self.client, near_timeout=60)
+        self.addCleanup(first.close)
+        self.addCleanup(second.close)
+
+        first.set("a", self.entry, 60, tags=("users",))
+        first.set("b", self.entry, 60)
+        self.assertIsNotNone(second.get("a"))
+        self.assertIsNotNone(second.get("b"))
+
+        first.invalidate_tags(["users"])
+        first.invalidate_prefix("b")
+
+        # the near-cache of the other process is invalidated through pub/sub
+        deadline = time.time() + 5
+        while len(second.near_cache) > 0 and time.time() < deadline:
+            time.sleep(0.05)
+
+        self.assertEqual(len(second.near_cache), 0)
+        self.assertIsNone(second.get("a"))
+        self.assertIsNone(second.get("b"))
+
+    def test_leases(self):
+        first = RedisCache(self.client)
+        second = RedisCache(self.client)
+
+        lease = first.acquire("a", 10)
+        self.assertIsNotNone(lease)
+        self.assertIsNone(first.acquire("a", 10))
+        self.assertIsNone(second.acquire("a", 10))
+
+        first.release("a", lease)
+        lease = second.acquire("a", 10)
+        self.assertIsNotNone(lease)
+
+        # waits until the lease of the other process expires
+        start = time.time()
+        first.wait("a", 0.2)
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+        second.release("a", lease)
+        start = time.time()
+        first.wait("a", 5)
+        self.assertLess(time.time() - start, 1)
@@ -0,0 +1,88 @@
+import unittest
+import gzip
+
+from connexion_plus import Compression
+from connexion_plus.Compression import Compressor, parse_accept_encoding
+
+
+class Test_Compressor(unittest.TestCase):
+    def setUp(self):
+        self.compressor = Compressor(encodings=["gzip"])
+
+    def test_parse_accept_encoding(self):
+        self.assertEqual(parse_accept_encoding("gzip, br;q=0.5, *;q=0"),
+                         {"gzip": 1.0, "br": 0.5, "*": 0.0})
+
+    def test_negotiate(self):
+        self.assertEqual(self.compressor.negotiate("gzip, deflate"), "gzip")
+        self.assertEqual(self.compressor.negotiate("*"), "gzip")
+        self.assertIsNone(self.compressor.negotiate(""))
+        self.assertIsNone(self.compressor.negotiate("deflate"))
+        self.assertIsNone(self.compressor.negotiate("gzip;q=0"))
+        self.assertIsNone(self.compressor.negotiate("gzip;q=0.5, identity"))
+
+    def test_preference(self):
+        compressor = Compressor(encodings=["zstd", "br", "gzip"])
+
+        self.assertEqual(compressor.negotiate("gzip, zstd, br"),
+                         compressor.encodings[0])
+        self.assertEqual(compressor.negotiate("gzip, zstd;q=0.5, br;q=0.5"), "gzip")
+
+    @unittest.skipIf(Compression.brotli is None, "brotli is not installed")
+    def test_brotli(self):
+        body = b"connexion-plus " * 100
+        compressor = Compressor()
+
+        self.assertEqual(compressor.negotiate("gzip, br"), "br")
+        self.assertEqual(Compression.brotli.decompress(
+            compressor.compress(body, "br")), body)
+
+    @unittest.skipIf(Compression.zstandard is None, "zstandard is not installed")
+    def test_zstd(self):
+        body = b"connexion-plus " * 100
+        compressor = Compressor()
+
+        self.assertEqual(compressor.negotiate("gzip, zstd"), "zstd")
+        self.assertEqual(Compression.zstandard.ZstdDecompressor().decompress(
+            compressor.compress(body, "zstd")), body)
+
+    def test_compressible(self):
+        self.assertTrue(self.compressor.compressible("application/json", 1000))
+        self.assertTrue(self.compressor.compressible(
+            "application/problem+json; charset=utf-8", 1000))
+        self.assertTrue(self.compressor.compressible("text/html", None))
+        self.assertFalse(self.compressor.compressible("image/png", 1000))
+        self.assertFalse(self.compressor.compressible("application/json", 10))
+
+    def test_compress(self):
+        body = b"connexion-plus " * 100
+        compressed = self.compressor.compress(body, "gzip")
+
+        self.assertEqual(gzip.decompress(compressed), body)
+        # no timestamp in the gzip header
+        self.assertEqual(compressed, self.compressor.compress(body, "gzip"))
+
+        with self.assertRaises(ValueError):
+            self.compressor.compress(body, "unknown")
+
+    def test_stream(self):
+        chunks = [b"connexion-plus %d " % i for i in range(1000)]
+        compressed = list(self.compressor.stream(
+            iter(chunks), "gzip", flush_size=1024))
+
+        # flushed continuously instead of one chunk at the end
+        self.assertGreater(len(compressed), 2)
+        self.assertEqual(gzip.decompress(b"".join(compressed)), b"".join(chunks))
+
+    def test_stream_closes_iterable(self):
+        closed = []
+
+        class Chunks(object):
+            def __iter__(self):
+                return iter([b"a", b"b"])
+
+            def close(self):
+                closed.append(True)
+
+        list(self.compressor.stream(Chunks(), "gzip"))
+        self.assertEqual(closed, [True])
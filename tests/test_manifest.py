@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import importlib
+import unittest
+from unittest import mock
+
+import yaml
+
+from connexion_plus import Manifest
+from connexion_plus.MultipleResourceResolver import MultipleResourceResolver
+
+
+spec = {
+    "openapi": "3.0.0",
+    "info": {"title": "manifest", "version": "1.0"},
+    "paths": {
+        "/pets": {
+            "get": {"responses": {"200": {"description": "ok"}}},
+            "parameters": [],
+        },
+        "/pets/{pet_id}/toys": {
+            "post": {"responses": {"201": {"description": "created"}}},
+        },
+        "/status": {
+            "get": {"operationId": "health", "x-openapi-router-controller": "manifest_api.status",
+                    "responses": {"200": {"description": "ok"}}},
+        },
+        "/missing": {
+            "delete": {"responses": {"204": {"description": "deleted"}}},
+        },
+    },
+}
+
+
+class Test_Manifest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        package = os.path.join(self.directory, "manifest_api")
+        os.makedirs(package)
+        for name, content in [
+            ("__init__.py", ""),
+            ("Pets.py", "def search():\n    return 'pets'\n"),
+            ("petstoys.py", "def post():\n    return 'toy'\n"),
+            ("status.py", "def health():\n    return 'ok'\n"),
+        ]:
+            with open(os.path.join(package, name), "w") as f:
+                f.write(content)
+
+        sys.path.insert(0, self.directory)
+        self.addCleanup(sys.path.remove, self.directory)
+        self.addCleanup(self.unload)
+        importlib.invalidate_caches()
+
+    def unload(self):
+        for name in list(sys.modules):
+            if name.startswith("manifest_api"):
+                del sys.modules[name]
+
+    def test_spec_operations(self):
+        operations = {(o.method, o.path): o for o in Manifest.spec_operations(spec)}
+        self.assertEqual(len(operations), 4)
+        self.assertEqual(operations["get", "/status"].router_controller, "manifest_api.status")
+        self.assertIsNone(operations["get", "/pets"].operation_id)
+
+    def test_build(self):
+        manifest, unresolved = Manifest.build_manifest([spec], "manifest_api")
+
+        self.assertEqual(manifest, {
+            "GET /pets": "manifest_api.Pets:search",
+            "POST /pets/{pet_id}/toys": "manifest_api.petstoys:post",
+            "GET /status": "manifest_api.status:health",
+        })
+        self.assertEqual(unresolved, ["DELETE /missing"])
+
+    def test_main(self):
+        spec_path = os.path.join(self.directory, "openapi.yaml")
+        with open(spec_path, "w") as f:
+            yaml.dump(spec, f)
+        output = os.path.join(self.directory, "manifest.json")
+
+        with mock.patch("sys.stderr") as stderr:
+            code = Manifest.main([spec_path, "--module", "manifest_api", "--output", output])
+
+        # the unresolved operation fails the build
+        self.assertEqual(code, 1)
+        self.assertIn("DELETE /missing", "".join(str(call) for call in stderr.mock_calls))
+
+        with open(output) as f:
+            self.assertEqual(json.load(f)["GET /status"], "manifest_api.status:health")
+
+        # the manifest is used at runtime
+        resolver = MultipleResourceResolver("manifest_api", resolution_table=output)
+        operation = next(o for o in Manifest.spec_operations(spec) if o.path == "/pets/{pet_id}/toys")
+        self.assertEqual(resolver.resolve(operation).function(), "toy")
@@ -0,0 +1,134 @@
+import os
+import sys
+import tempfile
+import subprocess
+import shutil
+import unittest
+from unittest import mock
+
+from flask import Flask
+from prometheus_client import CollectorRegistry
+from prometheus_flask_exporter import PrometheusMetrics
+
+from connexion_plus import Metrics
+
+
+def search():
+    return "search"
+
+
+class Test_GroupByOperation(unittest.TestCase):
+    def test_operation_label(self):
+        app = Flask(__name__)
+        app.add_url_rule("/search/<int:page>", "search", lambda page: search())
+        app.add_url_rule("/other", "other", search)
+
+        registry = CollectorRegistry()
+        PrometheusMetrics(app, registry=registry, group_by=Metrics.group_by_operation(app))
+
+        client = app.test_client()
+        client.get("/search/1")
+        client.get("/search/2")
+        client.get("/other")
+
+        labels = {"method": "GET", "status": "200"}
+        self.assertEqual(registry.get_sample_value("flask_http_request_duration_seconds_count", dict(
+            labels, operation="{}.Test_GroupByOperation.test_operation_label.<locals>.<lambda>".format(__name__))), 2)
+        self.assertEqual(registry.get_sample_value("flask_http_request_duration_seconds_count", dict(
+            labels, operation="{}.search".format(__name__))), 1)
+
+
+class Test_OptimizerMetrics(unittest.TestCase):
+    def test_shared_registry(self):
+        from connexion_plus import FlaskOptimize
+
+        registry = CollectorRegistry()
+        optimizers = [FlaskOptimize(Flask(__name__)) for _ in range(2)]
+        for optimize in optimizers:
+            optimize.init_metrics(registry)
+            optimize.cache.set("a", b"body", 60)
+
+        # the metrics are registered once and the cache stats are summed
+        self.assertIs(optimizers[0].metrics.cache_requests, optimizers[1].metrics.cache_requests)
+        self.assertEqual(registry.get_sample_value("flask_optimize_cache_entries"), 2)
+
+    def test_multiprocess(self):
+        from connexion_plus import FlaskOptimize
+
+        registry = CollectorRegistry()
+        with mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": tempfile.gettempdir()}):
+            with self.assertLogs("", "WARNING"):
+                FlaskOptimize(Flask(__name__)).init_metrics(registry)
+
+        self.assertIsNone(registry.get_sample_value("flask_optimize_cache_entries"))
+
+
+worker_script = """
+import os
+from connexion_plus import App
+
+def search():
+    return "search"
+
+app = App("multi", use_metric={
+    "multiprocess": True,
+    "group_by": "operation",
+    "buckets": (0.1, 1.0),
+    "default_labels": {"service": "multi"},
+})
+app.app.add_url_rule("/search", "search", search)
+client = app.app.test_client()
+client.get("/search")
+
+pid = os.fork()
+if pid == 0:
+    try:
+        client.get("/search")
+    finally:
+        os._exit(0)
+os.waitpid(pid, 0)
+
+print(client.get("/metrics").get_data(as_text=True))
+"""
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "needs os.fork")
+class Test_Multiprocess(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        # the multiprocess mode is global, so the environment is reset after the test
+        env = mock.patch.dict(os.environ)
+        env.start()
+        self.addCleanup(env.stop)
+
+    def test_aggregate_workers(self):
+        # the directory has to be set, before prometheus_client is imported
+        metrics = subprocess.run(
+            [sys.executable, "-c", worker_script], check=True, stdout=subprocess.PIPE, universal_newlines=True,
+            env=dict(os.environ, PROMETHEUS_MULTIPROC_DIR=self.directory)).stdout
+
+        self.assertIn(
+            'flask_http_request_duration_seconds_bucket{le="0.1",method="GET",operation="__main__.search",'
+            'service="multi",status="200"} 2.0', metrics)
+        self.assertNotIn('le="0.5"', metrics)
+
+    def test_imported_too_early(self):
+        # prometheus_client was imported by this test module without the variable
+        with self.assertRaises(RuntimeError):
+            Metrics.configure_multiprocess(self.directory)
+
+    def test_mark_process_dead(self):
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = self.directory
+
+        live = os.path.join(self.directory, "gauge_livesum_123.db")
+        open(live, "w").close()
+
+        Metrics.mark_process_dead(123)
+        self.assertFalse(os.path.exists(live))
+
+    def test_without_directory(self):
+        os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+        os.environ.pop("prometheus_multiproc_dir", None)
+        self.assertRaises(ValueError, Metrics.configure_multiprocess)
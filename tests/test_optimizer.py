@@ -0,0 +1,491 @@
+import unittest
+import gzip
+from functools import wraps
+from unittest import mock
+
+from flask import Flask, Response
+from connexion_plus import FlaskOptimize
+from connexion_plus.Cache import LocalCache, RedisCache
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+def connexion_like(f):
+    # connexion wraps the view functions with functools.wraps
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        return f(*args, **kwargs)
+
+    return wrapper
+
+
+class Test_Optimizer(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.optimize = FlaskOptimize(
+            self.app, {"compress": False, "minify": False, "compress_min_size": 0})
+        self.calls = 0
+
+        @FlaskOptimize.set_cache_timeout(60)
+        def cached():
+            self.calls += 1
+            return "cached {}".format(self.calls)
+
+        @FlaskOptimize.set_cache_timeout(60)
+        @FlaskOptimize.set_key(lambda req: req.path)
+        def keyed():
+            self.calls += 1
+            return "keyed {}".format(self.calls)
+
+        def uncached():
+            self.calls += 1
+            return "uncached {}".format(self.calls)
+
+        self.app.add_url_rule("/cached", "cached", connexion_like(cached))
+        self.app.add_url_rule("/keyed", "keyed", connexion_like(keyed))
+        self.app.add_url_rule("/uncached", "uncached", uncached)
+        self.client = self.app.test_client()
+
+    def test_cache_hit_skips_view(self):
+        self.assertEqual(self.client.get("/cached").data, b"cached 1")
+        self.assertEqual(self.client.get("/cached").data, b"cached 1")
+        self.assertEqual(self.calls, 1)
+
+        # different url, different key
+        self.assertEqual(self.client.get("/cached?a=1").data, b"cached 2")
+
+    def test_set_key(self):
+        self.assertEqual(self.client.get("/keyed?a=1").data, b"keyed 1")
+        self.assertEqual(self.client.get("/keyed?a=2").data, b"keyed 1")
+        self.assertEqual(self.calls, 1)
+
+    def test_uncached(self):
+        self.assertEqual(self.client.get("/uncached").data, b"uncached 1")
+        self.assertEqual(self.client.get("/uncached").data, b"uncached 2")
+
+    def test_endpoint_options(self):
+        with self.app.test_request_context("/keyed"):
+            options = self.optimize.endpoint_options("keyed")
+            self.assertEqual(options["cache_timeout"], 60)
+            self.assertTrue(callable(options["key_cache"]))
+            self.assertEqual(self.optimize.endpoint_options("uncached"), {})
+
+    def test_compressed_variant(self):
+        self.optimize.config["compress"] = True
+
+        resp = self.client.get("/cached", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        first = resp.data
+
+        # hit with the stored variant
+        resp = self.client.get("/cached", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.data, first)
+
+        # the uncompressed body is stored as well
+        resp = self.client.get("/cached")
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.data, b"cached 1")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertEqual(self.calls, 1)
+
+    def test_lazy_variant(self):
+        self.optimize.config["compress"] = True
+
+        # the first client does not accept gzip
+        resp = self.client.get("/cached")
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+        resp = self.client.get("/cached", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(resp.data), b"cached 1")
+        self.assertEqual(self.calls, 1)
+
+        # the variant was stored, so it will not be compressed again
+        entry = self.optimize.cache.get("GEThttp://localhost/cached")
+        self.assertIn("gzip", entry.variants)
+
+    def test_cache_vary(self):
+        self.optimize.config["cache_vary"] = ["Accept-Language"]
+
+        self.assertEqual(self.client.get(
+            "/cached", headers={"Accept-Language": "de"}).data, b"cached 1")
+        self.assertEqual(self.client.get(
+            "/cached", headers={"Accept-Language": "en"}).data, b"cached 2")
+
+        resp = self.client.get("/cached", headers={"Accept-Language": "de"})
+        self.assertEqual(resp.data, b"cached 1")
+        self.assertIn("Accept-Language", resp.headers["Vary"])
+
+    def test_encoded_response(self):
+        self.optimize.config["compress"] = True
+
+        @FlaskOptimize.set_cache_timeout(60)
+        def encoded():
+            self.calls += 1
+            return Response(gzip.compress(b'{"a": 1}'), mimetype="application/json",
+                            headers={"Content-Encoding": "gzip"})
+
+        self.app.add_url_rule("/encoded", "encoded", encoded)
+
+        for headers in ({"Accept-Encoding": "gzip"}, {}):
+            resp = self.client.get("/encoded", headers=headers)
+            self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+            self.assertEqual(gzip.decompress(resp.data), b'{"a": 1}')
+
+        # the entry would hold the encoded body as plain body, so it is not cached
+        self.assertEqual(self.calls, 2)
+
+    def test_view_vary(self):
+        self.optimize.config["compress"] = True
+
+        @FlaskOptimize.set_cache_timeout(60)
+        def personal():
+            self.calls += 1
+            return Response("personal", headers={"Vary": "Cookie"})
+
+        self.app.add_url_rule("/personal", "personal", personal)
+
+        for _ in range(2):
+            resp = self.client.get("/personal")
+            self.assertEqual(set(resp.vary), {"Cookie", "Accept-Encoding"})
+        self.assertEqual(self.calls, 1)
+
+    def test_local_backend(self):
+        self.assertIsInstance(self.optimize.cache, LocalCache)
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_redis_backend(self):
+        client = fakeredis.FakeRedis()
+        app = Flask(__name__)
+        first = FlaskOptimize(app, {"compress": False, "minify": False}, rc=client)
+        second = FlaskOptimize(Flask(__name__), rc=client)
+
+        self.assertIsInstance(first.cache, RedisCache)
+
+        @FlaskOptimize.set_cache_timeout(60)
+        def shared():
+            self.calls += 1
+            return "shared {}".format(self.calls)
+
+        app.add_url_rule("/shared", "shared", shared)
+        client_app = app.test_client()
+        self.assertEqual(client_app.get("/shared").data, b"shared 1")
+
+        # the entry is served from redis without the near-cache
+        first.cache.near_cache.clear()
+        self.assertEqual(client_app.get("/shared").data, b"shared 1")
+
+        # another worker of the same app shares the entry
+        entry = second.cache.get("GEThttp://localhost/shared")
+        self.assertEqual(entry.body, b"shared 1")
+
+    def test_compress_threshold(self):
+        self.optimize.config["compress"] = True
+        self.optimize.compressor.min_size = 100
+
+        resp = self.client.get("/uncached", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+        # the small cached body is not compressed on a hit as well
+        self.client.get("/cached")
+        resp = self.client.get("/cached", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_streamed_response(self):
+        self.optimize.config["compress"] = True
+        self.optimize.config["compress_flush_size"] = 10
+
+        def stream():
+            def generate():
+                for i in range(100):
+                    yield "line {}\n".format(i)
+
+            return Response(generate(), mimetype="text/plain")
+
+        self.app.add_url_rule("/stream", "stream", stream)
+
+        resp = self.client.get("/stream", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", resp.headers)
+        self.assertEqual(gzip.decompress(resp.data),
+                         "".join("line {}\n".format(i) for i in range(100)).encode())
+
+    def test_passthrough_response(self):
+        self.optimize.config["compress"] = True
+
+        def download():
+            resp = Response(iter([b"a" * 1000]), mimetype="text/plain")
+            resp.direct_passthrough = True
+            return resp
+
+        self.app.add_url_rule("/download", "download", download)
+
+        resp = self.client.get("/download", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.data, b"a" * 1000)
+
+        self.optimize.config["compress_passthrough"] = True
+        resp = self.client.get("/download", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(resp.data), b"a" * 1000)
+
+    def test_etag(self):
+        self.optimize.config["etag"] = True
+
+        resp = self.client.get("/uncached")
+        etag = resp.headers["ETag"]
+        self.assertEqual(resp.status_code, 200)
+
+        # the body changes with every call, so the etag does not match anymore
+        resp = self.client.get("/uncached", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_etag_from_cache(self):
+        self.optimize.config["etag"] = True
+        self.optimize.config["compress"] = True
+
+        resp = self.client.get("/cached")
+        etag = resp.headers["ETag"]
+
+        resp = self.client.get("/cached", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(resp.headers["ETag"], etag)
+
+        # the compressed variant has its own etag
+        resp = self.client.get(
+            "/cached", headers={"If-None-Match": etag, "Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+        resp = self.client.get(
+            "/cached", headers={"If-None-Match": resp.headers["ETag"], "Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(self.calls, 1)
+
+    def test_etag_on_miss(self):
+        self.optimize.config["etag"] = True
+
+        @FlaskOptimize.set_cache_timeout(60)
+        def constant():
+            return "constant"
+
+        self.app.add_url_rule("/constant", "constant", constant)
+        etag = self.client.get("/constant").headers["ETag"]
+
+        self.optimize.cache.clear()
+        resp = self.client.get("/constant", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_etag_before_compression(self):
+        self.optimize.config["etag"] = True
+        self.optimize.config["compress"] = True
+        body = "a" * 1000
+
+        def large():
+            return body
+
+        self.app.add_url_rule("/large", "large", large)
+        etag = self.client.get("/large", headers={"Accept-Encoding": "gzip"}).headers["ETag"]
+
+        with mock.patch.object(self.optimize, "compress_body", wraps=self.optimize.compress_body) as compress_body:
+            resp = self.client.get("/large", headers={"If-None-Match": etag, "Accept-Encoding": "gzip"})
+
+        self.assertEqual(resp.status_code, 304)
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        compress_body.assert_not_called()
+
+    def test_etag_before_variant(self):
+        self.optimize.config["etag"] = True
+        self.optimize.config["compress"] = True
+
+        etag, _ = self.client.get("/cached").get_etag()
+        gzip_etag = '"{}-gzip"'.format(etag)
+
+        with mock.patch.object(self.optimize, "compress_body", wraps=self.optimize.compress_body) as compress_body:
+            resp = self.client.get("/cached", headers={"If-None-Match": gzip_etag, "Accept-Encoding": "gzip"})
+
+        self.assertEqual(resp.status_code, 304)
+        compress_body.assert_not_called()
+        self.assertEqual(self.optimize.cache.get("GEThttp://localhost/cached").variants, {})
+
+    def test_minify(self):
+        self.optimize.config["minify"] = True
+        html = "<html>\n  <body>\n    <!-- comment -->\n    <p>Hällo</p>\n  </body>\n</html>"
+
+        def page():
+            self.calls += 1
+            return html
+
+        @FlaskOptimize.do_not_minify()
+        def raw():
+            return html
+
+        self.app.add_url_rule("/page", "page", page)
+        self.app.add_url_rule("/raw", "raw", raw)
+
+        resp = self.client.get("/page")
+        self.assertNotIn(b"comment", resp.data)
+        self.assertIn("Hällo".encode("utf-8"), resp.data)
+        self.assertLess(len(resp.data), len(html.encode("utf-8")))
+
+        # the minified body was memoized by its digest
+        self.assertEqual(self.client.get("/page").data, resp.data)
+        self.assertEqual(self.optimize._minified.stats()["hits"], 1)
+
+        self.assertEqual(self.client.get("/raw").data, html.encode("utf-8"))
+
+    def test_minify_max_size(self):
+        self.optimize.config["minify"] = True
+        self.optimize.config["minify_max_size"] = 5
+
+        resp = self.client.get("/uncached")
+        self.assertEqual(resp.data, b"uncached 1")
+        self.assertEqual(self.optimize._minified.stats()["misses"], 0)
+
+    def test_single_flight(self):
+        import threading
+        import time
+
+        @FlaskOptimize.set_cache_timeout(60)
+        def slow():
+            time.sleep(0.2)
+            self.calls += 1
+            return "slow {}".format(self.calls)
+
+        self.app.add_url_rule("/slow", "slow", slow)
+        results = []
+
+        def fetch():
+            results.append(self.app.test_client().get("/slow").data)
+
+        threads = [threading.Thread(target=fetch) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [b"slow 1"] * 5)
+
+    def test_stale_while_revalidate(self):
+        import time
+
+        @FlaskOptimize.set_cache_timeout(1, stale=60)
+        def stale():
+            self.calls += 1
+            return "stale {}".format(self.calls)
+
+        self.app.add_url_rule("/stale", "stale", stale)
+        self.assertEqual(self.client.get("/stale").data, b"stale 1")
+        time.sleep(1.1)
+
+        # another request recomputes the entry, so the stale one is served
+        key = "GEThttp://localhost/stale"
+        lease = self.optimize.cache.acquire(key, 30)
+        self.assertEqual(self.client.get("/stale").data, b"stale 1")
+        self.optimize.cache.release(key, lease)
+
+        self.assertEqual(self.client.get("/stale").data, b"stale 2")
+        self.assertEqual(self.client.get("/stale").data, b"stale 2")
+
+    def test_needs_refresh(self):
+        import time
+        from connexion_plus.Cache import CacheEntry
+
+        entry = CacheEntry(200, (), b"", expires=time.time() + 1000, delta=0.001)
+        self.assertFalse(FlaskOptimize.needs_refresh(entry, 1))
+
+        entry = CacheEntry(200, (), b"", expires=time.time() + 0.001, delta=10)
+        self.assertFalse(FlaskOptimize.needs_refresh(entry, 0))
+        self.assertTrue(FlaskOptimize.needs_refresh(entry, 1))
+
+        entry = CacheEntry(200, (), b"", expires=time.time() - 1)
+        self.assertTrue(FlaskOptimize.needs_refresh(entry))
+
+    def test_lease_released_on_error(self):
+        @FlaskOptimize.set_cache_timeout(60)
+        def broken():
+            raise ValueError("broken")
+
+        self.app.add_url_rule("/broken", "broken", broken)
+        self.app.testing = False
+
+        self.assertEqual(self.client.get("/broken").status_code, 500)
+        self.assertEqual(self.optimize.cache.leases, {})
+
+    def test_invalidate_tags(self):
+        @FlaskOptimize.set_cache_timeout(60, tags=["user:{user_id}", "users"])
+        def user(user_id):
+            self.calls += 1
+            return "user {} {}".format(user_id, self.calls)
+
+        self.app.add_url_rule("/users/<user_id>", "user", connexion_like(user))
+
+        self.assertEqual(self.client.get("/users/1").data, b"user 1 1")
+        self.assertEqual(self.client.get("/users/2").data, b"user 2 2")
+
+        self.assertEqual(self.optimize.invalidate_tags("user:1"), 1)
+        self.assertEqual(self.client.get("/users/1").data, b"user 1 3")
+        self.assertEqual(self.client.get("/users/2").data, b"user 2 2")
+
+        self.assertEqual(self.optimize.invalidate_tags("users"), 2)
+        self.assertEqual(self.client.get("/users/2").data, b"user 2 4")
+
+    def test_invalidate_prefix(self):
+        self.client.get("/cached")
+        self.client.get("/cached?a=1")
+        self.client.get("/keyed")
+
+        self.assertEqual(self.optimize.invalidate_prefix("GEThttp://localhost/cached"), 2)
+        self.assertEqual(self.client.get("/cached").data, b"cached 4")
+
+    def test_clear_key(self):
+        self.client.get("/cached")
+
+        with self.app.test_request_context("/"):
+            resp = self.optimize.clear_key("GEThttp://localhost/cached")
+            self.assertEqual(resp.get_data(), b"cached 1")
+            self.assertIsNone(self.optimize.clear_key("GEThttp://localhost/cached"))
+
+        self.assertEqual(self.client.get("/cached").data, b"cached 2")
+
+    def test_clear_key_with_vary(self):
+        self.optimize.config["cache_vary"] = ["Accept-Language"]
+
+        self.client.get("/cached", headers={"Accept-Language": "de"})
+        self.client.get("/cached", headers={"Accept-Language": "en"})
+
+        with self.app.test_request_context("/", headers={"Accept-Language": "en"}):
+            resp = self.optimize.clear_key("GEThttp://localhost/cached")
+            self.assertEqual(resp.get_data(), b"cached 2")
+
+        # the entries for all languages are removed
+        self.assertEqual(len(self.optimize.cache), 0)
+        self.assertEqual(self.client.get("/cached", headers={"Accept-Language": "de"}).data, b"cached 3")
+
+    def test_metrics(self):
+        from prometheus_client import CollectorRegistry
+
+        registry = CollectorRegistry()
+        self.optimize.init_metrics(registry)
+        self.optimize.config["compress"] = True
+        operation = "{}.{}".format(__name__, "Test_Optimizer.setUp.<locals>.cached")
+
+        self.client.get("/cached", headers={"Accept-Encoding": "gzip"})
+        self.client.get("/cached", headers={"Accept-Encoding": "gzip"})
+
+        def sample(name, **labels):
+            return registry.get_sample_value(name, labels)
+
+        self.assertEqual(sample("flask_optimize_cache_requests_total", operation=operation, result="miss"), 1)
+        self.assertEqual(sample("flask_optimize_cache_requests_total", operation=operation, result="hit"), 1)
+        self.assertEqual(sample("flask_optimize_compression_input_bytes_total", encoding="gzip"), len(b"cached 1"))
+        self.assertEqual(sample("flask_optimize_compression_seconds_count", encoding="gzip"), 1)
+        self.assertEqual(sample("flask_optimize_cache_entries"), 1)
+        self.assertEqual(sample("flask_optimize_cache_hits_total"), 1)
@@ -0,0 +1,173 @@
+import os
+import gc
+import json
+import socket
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from jaeger_client import Tracer
+from jaeger_client.sampler import ConstSampler
+
+from connexion_plus import Prefork
+from connexion_plus.Cache import LocalCache
+from connexion_plus.Reporter import BatchReporter, UDPSender
+
+
+def in_child(func):
+    """
+    Runs the given function in a forked child and returns its result, which must be serializable as json.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read)
+            os.write(write, json.dumps(func()).encode("utf-8"))
+        finally:
+            os._exit(0)
+
+    os.close(write)
+    with os.fdopen(read) as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    return json.loads(data)
+
+
+class Counter(object):
+    def __init__(self):
+        self.calls = 0
+
+    def after_fork(self):
+        self.calls += 1
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "needs os.fork")
+class Test_AfterFork(unittest.TestCase):
+    def test_register(self):
+        counter = Counter()
+        Prefork.register_after_fork(counter.after_fork)
+
+        self.assertEqual(in_child(lambda: counter.calls), 1)
+        self.assertEqual(counter.calls, 0)
+
+    def test_weak(self):
+        alive, dead = Counter(), Counter()
+
+        # a local registry, so the functions of other tests do not run in this process
+        with mock.patch.object(Prefork, "_callbacks", []):
+            Prefork.register_after_fork(alive.after_fork)
+            Prefork.register_after_fork(dead.after_fork)
+
+            del dead
+            gc.collect()
+            Prefork.run_after_fork()
+
+            self.assertEqual(alive.calls, 1)
+            self.assertEqual(len(Prefork._callbacks), 1)
+
+    def test_local_cache(self):
+        cache = LocalCache()
+        cache.set("key", b"value", 60)
+        lease = cache.acquire("key", 10)
+        self.assertIsNotNone(lease)
+
+        def child():
+            cache.after_fork()
+            # the lease of the parent is gone, the entries are kept
+            return [cache.acquire("key", 10) is not None, cache.get("key").decode("utf-8")]
+
+        self.assertEqual(in_child(child), [True, "value"])
+
+    def test_reporter(self):
+        agent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        agent.bind(("127.0.0.1", 0))
+        agent.settimeout(5)
+        self.addCleanup(agent.close)
+
+        reporter = BatchReporter(UDPSender(*agent.getsockname()), batch_size=1)
+        tracer = Tracer("test", reporter, ConstSampler(True))
+        self.addCleanup(reporter.close)
+
+        tracer.start_span("parent").finish()
+        agent.recvfrom(65535)
+
+        def child():
+            reporter.after_fork()
+            tracer.start_span("child").finish()
+            return reporter.flush()
+
+        self.assertTrue(in_child(child))
+        self.assertTrue(agent.recvfrom(65535)[0])
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "needs os.fork")
+class Test_LeaderElection(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        self.elected = []
+
+    def create_election(self, name):
+        election = Prefork.LeaderElection(self.path, lambda: self.elected.append(name), retry_interval=0.05)
+        self.addCleanup(election.stop)
+        return election
+
+    def test_single_leader(self):
+        first = self.create_election("first")
+        second = self.create_election("second")
+
+        self.assertTrue(first.start())
+        self.assertFalse(second.start())
+        self.assertEqual(self.elected, ["first"])
+
+        # the other one takes over, when the leader stops
+        first.stop()
+        for _ in range(100):
+            if second.is_leader:
+                break
+            time.sleep(0.05)
+
+        self.assertTrue(second.is_leader)
+        self.assertEqual(self.elected, ["first", "second"])
+
+    def test_child_is_not_leader(self):
+        election = self.create_election("parent")
+        self.assertTrue(election.start())
+
+        def child():
+            election.after_fork()
+            return election.is_leader
+
+        self.assertFalse(in_child(child))
+        self.assertTrue(election.is_leader)
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "needs os.fork")
+class Test_Scheduler(unittest.TestCase):
+    def test_one_scheduler(self):
+        from connexion_plus import App
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+
+        apps = [App("worker{}".format(i), use_scheduler={"lock_file": path}) for i in range(2)]
+        for app in apps:
+            self.addCleanup(app.scheduler_election.stop)
+            self.addCleanup(lambda app=app: app.scheduler.running and app.scheduler.shutdown(False))
+
+        self.assertEqual([app.scheduler.running for app in apps], [True, False])
+
+    def test_without_lock_file(self):
+        from connexion_plus import App
+
+        with mock.patch.dict("sys.modules", {"gunicorn": mock.Mock()}):
+            with self.assertLogs("", "WARNING") as logs:
+                app = App("worker", use_scheduler=True)
+        self.addCleanup(app.scheduler.shutdown, False)
+
+        self.assertTrue(app.scheduler.running)
+        self.assertIn("every worker", "\n".join(logs.output))
@@ -0,0 +1,167 @@
+import gc
+import socket
+import threading
+import unittest
+import weakref
+
+from jaeger_client import Tracer, Config
+from jaeger_client.sampler import ConstSampler, RemoteControlledSampler
+from jaeger_client.thrift_gen.agent import Agent
+from thrift.protocol import TCompactProtocol
+from thrift.transport import TTransport
+
+from connexion_plus import Reporter
+from connexion_plus.Reporter import BatchReporter, UDPSender, initialize_tracer
+
+
+class BlockingSender(UDPSender):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        self.packets = []
+
+    def send(self, data):
+        self.release.wait(5)
+        self.packets.append(data)
+        return True
+
+
+class Test_BatchReporter(unittest.TestCase):
+    def setUp(self):
+        # local stand-in for the jaeger agent
+        self.agent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.agent.bind(("127.0.0.1", 0))
+        self.agent.settimeout(5)
+        self.addCleanup(self.agent.close)
+
+    def receive_batch(self):
+        data, _ = self.agent.recvfrom(65535)
+        prot = TCompactProtocol.TCompactProtocol(TTransport.TMemoryBuffer(data))
+        name, _, _ = prot.readMessageBegin()
+        self.assertEqual(name, "emitBatch")
+        args = Agent.emitBatch_args()
+        args.read(prot)
+        return args.batch
+
+    def create_tracer(self, **kwargs):
+        reporter = BatchReporter(UDPSender(*self.agent.getsockname()), **kwargs)
+        tracer = Tracer("test", reporter, ConstSampler(True))
+        self.addCleanup(reporter.close)
+        return tracer, reporter
+
+    def test_batch_size(self):
+        tracer, reporter = self.create_tracer(batch_size=3, flush_interval=60)
+
+        for i in range(3):
+            tracer.start_span("op{}".format(i)).finish()
+
+        batch = self.receive_batch()
+        self.assertEqual(batch.process.serviceName, "test")
+        self.assertEqual([s.operationName for s in batch.spans], ["op0", "op1", "op2"])
+
+    def test_flush_interval(self):
+        tracer, reporter = self.create_tracer(batch_size=100, flush_interval=0.05)
+        tracer.start_span("op").finish()
+
+        self.assertEqual(len(self.receive_batch().spans), 1)
+        # the packet can arrive, before the thread counted it
+        self.assertTrue(reporter.flush())
+        self.assertEqual(reporter.stats()["reported"], 1)
+
+    def test_close_flushes(self):
+        tracer, reporter = self.create_tracer(batch_size=100, flush_interval=60)
+        tracer.start_span("op").finish()
+        tracer.start_span("op").finish()
+
+        self.assertTrue(tracer.close().result())
+        self.assertEqual(len(self.receive_batch().spans), 2)
+
+        # spans after the shutdown will be dropped
+        tracer.start_span("late").finish()
+        self.assertEqual(reporter.stats()["dropped"], 1)
+
+    def test_drop_when_full(self):
+        sender = BlockingSender()
+        reporter = BatchReporter(sender, queue_size=2, batch_size=1, flush_interval=60)
+        tracer = Tracer("test", reporter, ConstSampler(True))
+
+        # the first span blocks the thread in send, two fill the queue
+        for _ in range(6):
+            tracer.start_span("op").finish()
+
+        self.assertGreaterEqual(reporter.stats()["dropped"], 3)
+
+        sender.release.set()
+        self.assertTrue(reporter.flush())
+        self.assertEqual(len(sender.packets) + reporter.stats()["dropped"], 6)
+        reporter.close()
+
+    def test_split_big_batches(self):
+        reporter = BatchReporter(UDPSender(*self.agent.getsockname()), batch_size=4, flush_interval=60)
+        tracer = Tracer("test", reporter, ConstSampler(True), max_tag_value_length=50000)
+        self.addCleanup(reporter.close)
+
+        for _ in range(4):
+            span = tracer.start_span("big")
+            span.set_tag("payload", "x" * 40000)
+            span.finish()
+
+        received = [len(self.receive_batch().spans) for _ in range(4)]
+        self.assertEqual(received, [1, 1, 1, 1])
+
+    def test_unresolvable_agent(self):
+        reporter = BatchReporter(UDPSender("unresolvable.invalid", 6831), batch_size=1)
+        tracer = Tracer("test", reporter, ConstSampler(True))
+
+        with self.assertLogs("", "WARNING"):
+            tracer.start_span("op").finish()
+            reporter.flush()
+
+        self.assertEqual(reporter.stats()["failed"], 1)
+        reporter.close()
+
+    def test_close_at_exit(self):
+        tracer, reporter = self.create_tracer(batch_size=100, flush_interval=60)
+        tracer.start_span("op").finish()
+
+        Reporter._close_reporters()
+        self.assertEqual([s.operationName for s in self.receive_batch().spans], ["op"])
+        self.assertNotIn(reporter, Reporter._reporters)
+
+    def test_not_kept_alive(self):
+        reporter = BatchReporter(UDPSender(*self.agent.getsockname()))
+        ref = weakref.ref(reporter)
+
+        del reporter
+        gc.collect()
+        self.assertIsNone(ref())
+
+    def test_initialize_tracer(self):
+        host, port = self.agent.getsockname()
+        config = Config({
+            "sampler": ConstSampler(True),
+            "local_agent": {"reporting_host": host, "reporting_port": port},
+            "reporter_batch_size": 1,
+        }, service_name="initialized")
+
+        tracer = initialize_tracer(config)
+        self.addCleanup(tracer.close)
+        self.assertIsInstance(tracer.reporter, BatchReporter)
+
+        tracer.start_span("op").finish()
+        self.assertEqual(self.receive_batch().process.serviceName, "initialized")
+
+    def test_remote_sampling(self):
+        host, port = self.agent.getsockname()
+        config = Config({
+            "sampler": {},
+            "local_agent": {"reporting_host": host, "reporting_port": port, "sampling_port": port},
+        }, service_name="remote")
+
+        # the remote sampler needs the channel of jaeger, so jaeger creates the tracer
+        for _ in range(2):
+            with self.assertLogs("", "INFO") as logs:
+                tracer = initialize_tracer(config)
+            self.assertIn("reporter of jaeger", "\n".join(logs.output))
+            self.addCleanup(tracer.close)
+            self.assertIsInstance(tracer.sampler, RemoteControlledSampler)
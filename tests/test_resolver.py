@@ -0,0 +1,176 @@
+import os
+import sys
+import shutil
+import inspect
+import tempfile
+import threading
+import importlib
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from connexion.exceptions import ResolverError
+
+from connexion_plus import Util
+from connexion_plus.MultipleResourceResolver import MultipleResourceResolver
+
+
+def operation(method, path):
+    return SimpleNamespace(method=method, path=path, operation_id=None, router_controller=None)
+
+
+class Test_MultipleResourceResolver(unittest.TestCase):
+    def setUp(self):
+        # a controller package with a resource folder (users/items.py) and a resource file (projectsfiles.py)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        package = os.path.join(self.directory, "resolver_api")
+        os.makedirs(os.path.join(package, "Users"))
+        for name, content in [
+            ("__init__.py", ""),
+            ("Users/__init__.py", "def search():\n    return 'users'\n\ndef get():\n    return 'user'\n"),
+            ("Users/Items.py", "def search():\n    return 'items'\n"),
+            ("projectsfiles.py", "def search():\n    return 'files'\n\ndef post():\n    return 'created'\n"),
+        ]:
+            with open(os.path.join(package, name), "w") as f:
+                f.write(content)
+
+        sys.path.insert(0, self.directory)
+        self.addCleanup(sys.path.remove, self.directory)
+        self.addCleanup(self.unload)
+        importlib.invalidate_caches()
+
+        self.resolver = MultipleResourceResolver("resolver_api")
+
+    def unload(self):
+        for name in list(sys.modules):
+            if name.startswith("resolver_api"):
+                del sys.modules[name]
+
+    def resolve(self, method, path, resolver=None):
+        return (resolver or self.resolver).resolve(operation(method, path)).function()
+
+    def test_resolve(self):
+        self.assertEqual(self.resolve("get", "/users"), "users")
+        self.assertEqual(self.resolve("get", "/users/{user_id}"), "user")
+        self.assertEqual(self.resolve("get", "/users/{user_id}/items"), "items")
+        self.assertEqual(self.resolve("get", "/projects/{project_id}/files"), "files")
+
+    def test_operation_id(self):
+        resolve = self.resolver.resolve_operation_id_using_rest_semantics
+        self.assertEqual(resolve(operation("get", "/users")), "resolver_api.Users.search")
+        self.assertEqual(resolve(operation("get", "/users/{user_id}")), "resolver_api.Users.get")
+        self.assertEqual(resolve(operation("put", "/users/{user_id}/items")), "resolver_api.Users.Items.put")
+
+    def test_failed_imports_are_remembered(self):
+        with mock.patch("importlib.import_module", wraps=importlib.import_module) as import_module:
+            self.resolve("get", "/projects/{project_id}/files")
+            tried = import_module.call_count
+
+            # the same candidates fail for the other method of the controller
+            self.resolve("post", "/projects/{project_id}/files")
+
+        self.assertGreater(tried, 1)
+        self.assertEqual(import_module.call_count, tried)
+
+    def test_unresolvable(self):
+        with self.assertLogs("connexion.resolver", "WARNING") as logs:
+            self.assertRaises(ResolverError, self.resolver.resolve, operation("get", "/unknown"))
+
+        self.assertEqual(len(logs.records), 1)
+
+    def test_resolution_table(self):
+        self.resolve("get", "/users/{user_id}/items")
+        self.resolve("post", "/projects/{project_id}/files")
+        self.assertEqual(self.resolver.resolution_table, {
+            "GET /users/{user_id}/items": "resolver_api.Users.Items:search",
+            "POST /projects/{project_id}/files": "resolver_api.projectsfiles:post",
+        })
+
+        path = os.path.join(self.directory, "resolution.json")
+        self.resolver.save_resolution_table(path)
+        resolver = MultipleResourceResolver("resolver_api", resolution_table=path)
+
+        with mock.patch("importlib.import_module", wraps=importlib.import_module) as import_module:
+            self.assertEqual(self.resolve("post", "/projects/{project_id}/files", resolver), "created")
+
+        # no candidates are tried
+        import_module.assert_called_once_with("resolver_api.projectsfiles")
+
+
+class Test_LazyResolution(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        package = os.path.join(self.directory, "lazy_api")
+        os.makedirs(package)
+        for name, content in [
+            ("__init__.py", ""),
+            ("Pets.py", "imported = 0\nimported += 1\n\ndef search(limit=10):\n    return limit\n\n"
+                        "def post(**kwargs):\n    return sorted(kwargs)\n"),
+            ("Toys.py", "def search():\n    return 'toys'\n"),
+        ]:
+            with open(os.path.join(package, name), "w") as f:
+                f.write(content)
+
+        sys.path.insert(0, self.directory)
+        self.addCleanup(sys.path.remove, self.directory)
+        self.addCleanup(self.unload)
+        importlib.invalidate_caches()
+
+        self.resolver = MultipleResourceResolver("lazy_api", lazy=True, hot=["GET /toys"], resolution_table={
+            "GET /pets": "lazy_api.Pets:search",
+            "POST /pets": "lazy_api.Pets:post",
+            "GET /toys": "lazy_api.Toys:search",
+            "GET /stale": "lazy_api.Stale:search",
+        })
+
+    def unload(self):
+        for name in list(sys.modules):
+            if name.startswith("lazy_api"):
+                del sys.modules[name]
+
+    def test_import_on_first_call(self):
+        function = self.resolver.resolve(operation("get", "/pets")).function
+        self.assertNotIn("lazy_api.Pets", sys.modules)
+
+        # connexion passes all parameters, because of the signature
+        self.assertEqual(str(inspect.signature(function)), "(*args, **kwargs)")
+        self.assertEqual(Util.operation_id(function), "lazy_api.Pets.search")
+
+        self.assertEqual(function(limit=3, other="x"), 3)
+        self.assertIn("lazy_api.Pets", sys.modules)
+
+        post = self.resolver.resolve(operation("post", "/pets")).function
+        self.assertEqual(post(body={}, other="x"), ["body", "other"])
+
+    def test_thread_safe(self):
+        function = self.resolver.resolve(operation("get", "/pets")).function
+
+        threads = [threading.Thread(target=function) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sys.modules["lazy_api.Pets"].imported, 1)
+
+    def test_warmup(self):
+        for path in ("/pets", "/toys"):
+            self.resolver.resolve(operation("get", path))
+
+        self.assertEqual(self.resolver.warmup(), 1)
+        self.assertIn("lazy_api.Toys", sys.modules)
+        self.assertNotIn("lazy_api.Pets", sys.modules)
+
+    def test_stale_entry(self):
+        # the module of the entry was renamed, so the candidates are tried on the first call
+        with open(os.path.join(self.directory, "lazy_api", "stale.py"), "w") as f:
+            f.write("def search():\n    return 'stale'\n")
+        importlib.invalidate_caches()
+
+        function = self.resolver.resolve(operation("get", "/stale")).function
+        with self.assertLogs("connexion.resolver", "WARNING"):
+            self.assertEqual(function(), "stale")
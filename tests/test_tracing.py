@@ -0,0 +1,268 @@
+import os
+import logging
+import unittest
+from unittest import mock
+
+from flask import Flask, request
+from flask_opentracing import FlaskTracing
+from jaeger_client import Tracer
+from jaeger_client.reporter import InMemoryReporter
+from jaeger_client.sampler import ConstSampler, ProbabilisticSampler, RateLimitingSampler
+
+from connexion_plus import Tracing, Util
+from connexion_plus.TracingHandler import TracingHandler
+
+
+def search():
+    return "search"
+
+
+def failing():
+    return "failing", 500
+
+
+class Test_Sampler(unittest.TestCase):
+    def test_make_sampler(self):
+        self.assertIsInstance(Tracing.make_sampler("const", 1), ConstSampler)
+        self.assertFalse(Tracing.make_sampler("const", "false").is_sampled(1)[0])
+        self.assertIsInstance(Tracing.make_sampler("probabilistic", 0.1), ProbabilisticSampler)
+        self.assertIsInstance(Tracing.make_sampler("ratelimiting", 5), RateLimitingSampler)
+        self.assertRaises(ValueError, Tracing.make_sampler, "unknown", 1)
+
+    def test_default(self):
+        self.assertIsInstance(Tracing.create_sampler(), RateLimitingSampler)
+
+        sampler = ConstSampler(True)
+        self.assertIs(Tracing.create_sampler(sampler), sampler)
+
+    def test_env_override(self):
+        env = {"TRACER_SAMPLER_TYPE": "probabilistic", "TRACER_SAMPLER_PARAM": "0.25"}
+        with mock.patch.dict(os.environ, env):
+            sampler = Tracing.create_sampler({"type": "const", "param": 1})
+
+        self.assertIsInstance(sampler, ProbabilisticSampler)
+        self.assertEqual(sampler.rate, 0.25)
+
+    def test_operations(self):
+        app = Flask(__name__)
+        app.add_url_rule("/search", "search", search)
+
+        sampler = Tracing.create_sampler({
+            "type": "const",
+            "param": 0,
+            "operations": {
+                "{}.search".format(__name__): 1.0,
+                "client": {"type": "const", "param": 1},
+            },
+        })
+        self.assertIsInstance(sampler, Tracing.OperationSampler)
+
+        with app.app_context():
+            # the endpoint is resolved to the operation id
+            self.assertTrue(sampler.is_sampled(1, "search")[0])
+
+        self.assertTrue(sampler.is_sampled(1, "client")[0])
+        self.assertFalse(sampler.is_sampled(1, "other")[0])
+
+    def test_configure_sampler(self):
+        configured = Tracing.configure_sampler({"sampler": Tracing.default_sampler_config, "logging": True})
+        self.assertIsInstance(configured["sampler"], RateLimitingSampler)
+        self.assertTrue(configured["logging"])
+
+    def test_remote_sampling(self):
+        # jaeger samples remotely without a type
+        for sampler in ({"type": "remote"}, {}, {"type": ""}, None):
+            config = {"logging": True} if sampler is None else {"sampler": sampler}
+            self.assertEqual(Tracing.configure_sampler(config)["sampler"], {})
+
+        # the samplers of the operations need a local default
+        configured = Tracing.configure_sampler({"sampler": {"operations": {"search": 1}}})
+        self.assertIsInstance(configured["sampler"], Tracing.OperationSampler)
+
+
+class Test_SampleOnError(unittest.TestCase):
+    def setUp(self):
+        self.reporter = InMemoryReporter()
+        tracer = Tracer("test", self.reporter, ConstSampler(False))
+
+        self.app = Flask(__name__)
+        self.app.add_url_rule("/search", "search", search)
+        self.app.add_url_rule("/failing", "failing", failing)
+
+        tracing = FlaskTracing(tracer, True, self.app)
+        Tracing.sample_on_error(self.app, tracing)
+        self.client = self.app.test_client()
+
+    def test_error_is_sampled(self):
+        self.client.get("/search")
+        self.assertEqual(self.reporter.get_spans(), [])
+
+        self.client.get("/failing")
+        spans = self.reporter.get_spans()
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0].operation_name, "failing")
+        self.assertTrue(spans[0].is_sampled())
+
+
+class CountingFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def format(self, record):
+        self.calls += 1
+        return super().format(record)
+
+
+class Test_TracingHandler(unittest.TestCase):
+    def setUp(self):
+        self.reporter = InMemoryReporter()
+        self.formatter = CountingFormatter()
+        self.logger = logging.getLogger("test_tracing_handler")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def create_app(self, sampled):
+        tracer = Tracer("test", self.reporter, ConstSampler(sampled))
+        app = Flask(__name__)
+
+        def view():
+            for i in range(5):
+                self.logger.debug("message %s", i)
+            # formatting is deferred until the span finishes
+            self.assertEqual(self.formatter.calls, 0)
+            return "view", int(request.args.get("status", 200))
+
+        app.add_url_rule("/view", "view", view)
+
+        tracing = FlaskTracing(tracer, True, app)
+        handler = TracingHandler(tracer, max_logs=3)
+        handler.setFormatter(self.formatter)
+        handler.init_app(app, tracing)
+        Tracing.sample_on_error(app, tracing)
+
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+        return app, handler
+
+    def test_sampled(self):
+        app, handler = self.create_app(True)
+        app.test_client().get("/view")
+
+        span = self.reporter.get_spans()[0]
+        self.assertEqual(len(span.logs), 3)
+        self.assertEqual(self.formatter.calls, 3)
+        self.assertEqual(handler.dropped, 2)
+        self.assertEqual(handler._buffers, {})
+
+    def test_unsampled(self):
+        app, handler = self.create_app(False)
+        app.test_client().get("/view")
+
+        self.assertEqual(self.reporter.get_spans(), [])
+        self.assertEqual(self.formatter.calls, 0)
+        self.assertEqual(handler._buffers, {})
+
+    def test_error_keeps_logs(self):
+        app, handler = self.create_app(False)
+        app.test_client().get("/view?status=500")
+
+        span = self.reporter.get_spans()[0]
+        self.assertEqual(len(span.logs), 3)
+
+    def test_without_span(self):
+        tracer = Tracer("test", self.reporter, ConstSampler(True))
+        handler = TracingHandler(tracer)
+        handler.setFormatter(self.formatter)
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+
+        self.logger.debug("no span")
+        self.assertEqual(self.formatter.calls, 0)
+
+        # spans outside of a request are logged directly
+        with tracer.start_active_span("job") as scope:
+            self.logger.debug("in span")
+            self.assertEqual(len(scope.span.logs), 1)
+
+
+class Test_Exclusion(unittest.TestCase):
+    def setUp(self):
+        self.reporter = InMemoryReporter()
+        self.tracer = Tracer("test", self.reporter, ConstSampler(True))
+
+    def create_app(self, tracing_class, **kwargs):
+        app = Flask(__name__)
+        app.add_url_rule("/search", "search", search)
+        app.add_url_rule("/health/live", "live", search)
+        app.add_url_rule("/metrics", "metrics", search)
+        tracing_class(self.tracer, True, app, **kwargs)
+        return app.test_client()
+
+    def test_matcher(self):
+        matcher = Tracing.ExclusionMatcher(
+            paths=["/health", "/metrics"], endpoints=["search"], methods=["head"])
+        app = Flask(__name__)
+        app.add_url_rule("/search", "search", search)
+        app.add_url_rule("/other", "other", search)
+
+        for path, method, excluded in [
+            ("/health/ready", "GET", True),
+            ("/metrics", "GET", True),
+            ("/search", "GET", True),
+            ("/other", "HEAD", True),
+            ("/other", "GET", False),
+            ("/api/health", "GET", False),
+        ]:
+            with app.test_request_context(path, method=method):
+                self.assertEqual(matcher(request), excluded, path)
+
+    def test_default_excludes_metrics(self):
+        client = self.create_app(Tracing.ExcludingFlaskTracing)
+
+        client.get("/metrics")
+        client.options("/search")
+        self.assertEqual(self.reporter.get_spans(), [])
+
+        client.get("/search")
+        self.assertEqual(len(self.reporter.get_spans()), 1)
+
+    def test_per_app(self):
+        exclude = Tracing.ExclusionMatcher.from_config({"exclude_paths": ["/health"]})
+        client = self.create_app(Tracing.ExcludingFlaskTracing, exclude=exclude)
+        other = self.create_app(FlaskTracing)
+
+        client.get("/health/live")
+        self.assertEqual(self.reporter.get_spans(), [])
+
+        # the class of FlaskTracing is not patched
+        other.get("/health/live")
+        other.get("/metrics")
+        self.assertEqual(len(self.reporter.get_spans()), 2)
+
+
+class Client(object):
+    def call(self):
+        return "original"
+
+
+class Test_ClientHooks(unittest.TestCase):
+    def test_skip_untraced(self):
+        original = Client.call
+        patched = Tracing.skip_untraced(original, lambda self: "patched")
+
+        client = Client()
+        self.assertEqual(patched(client), "patched")
+
+        with Util.untraced():
+            self.assertEqual(patched(client), "original")
+
+        self.assertEqual(patched(Util.mark_untraced(Client())), "original")
+        self.assertEqual(patched(client), "patched")
+
+    def test_unknown_integration(self):
+        with self.assertLogs("", "WARNING"):
+            self.assertEqual(Tracing.install_client_hooks(["unknown"]), [])
+
+    def test_empty(self):
+        self.assertEqual(Tracing.install_client_hooks([]), [])
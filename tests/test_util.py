@@ -1,4 +1,15 @@
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
 import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yaml
+
 from connexion_plus import Util
 
 
@@ -57,3 +68,201 @@ class Test_Util(unittest.TestCase):
 
         strlist = ";".join(oai_list)
         self.assertEqual(Util.load_oai(strlist), self.oai_list)
+
+
+class Test_OperationId(unittest.TestCase):
+    def test_operation_id(self):
+        from functools import wraps
+
+        def search():
+            pass
+
+        @wraps(search)
+        def wrapper():
+            return search()
+
+        self.assertEqual(Util.operation_id(wrapper),
+                         "{}.{}".format(__name__, search.__qualname__))
+        self.assertIsNone(Util.operation_id(None))
+
+
+class SpecHandler(BaseHTTPRequestHandler):
+    """
+    Serves tests/petstore.yaml with an ETag, like a spec repository does.
+    """
+
+    delay = 0
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("If-None-Match")))
+        time.sleep(self.delay)
+
+        if self.path == "/missing":
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        with open("tests/petstore.yaml", "rb") as f:
+            body = f.read()
+        etag = '"{}"'.format(hashlib.sha256(body).hexdigest())
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Test_LoadOai(unittest.TestCase):
+    def setUp(self):
+        SpecHandler.delay = 0
+        SpecHandler.requests = []
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SpecHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_address[1])
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+        with open("tests/petstore.yaml") as f:
+            self.oai = yaml.full_load(f)
+
+    def test_parallel(self):
+        SpecHandler.delay = 0.3
+        urls = [self.url + str(i) for i in range(4)]
+
+        start = time.time()
+        self.assertEqual(Util.load_oai(";".join(urls)), [self.oai] * 4)
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(sorted(path for path, _ in SpecHandler.requests), ["/0", "/1", "/2", "/3"])
+
+    def test_cache(self):
+        self.assertEqual(Util.internal_load_oai(self.url, cache_dir=self.cache_dir), self.oai)
+        self.assertEqual(Util.internal_load_oai(self.url, cache_dir=self.cache_dir), self.oai)
+
+        # the second request was revalidated with the ETag
+        self.assertIsNone(SpecHandler.requests[0][1])
+        self.assertIsNotNone(SpecHandler.requests[1][1])
+
+        # the cached file is used, if the server is gone
+        url = self.url
+        self.server.shutdown()
+        self.server.server_close()
+
+        with self.assertLogs("", "WARNING"):
+            self.assertEqual(Util.internal_load_oai(url, cache_dir=self.cache_dir), self.oai)
+
+    def test_timeout(self):
+        import requests
+
+        SpecHandler.delay = 1
+        with self.assertRaises(requests.Timeout):
+            Util.internal_load_oai(self.url, timeout=0.1)
+
+    def test_http_error(self):
+        import requests
+
+        with self.assertRaises(requests.HTTPError):
+            Util.internal_load_oai(self.url + "missing")
+
+    def test_compiled_url(self):
+        spec = Util.load_compiled_oai(self.url, cache_dir=self.cache_dir)
+        self.assertEqual(spec, Util.compile_oai(self.oai))
+        self.assertTrue(any(name.endswith(".compiled") for name in os.listdir(self.cache_dir)))
+
+        with mock.patch("yaml.load") as load:
+            self.assertEqual(Util.load_oai([self.url, self.url], cache_dir=self.cache_dir, compiled=True), [spec, spec])
+        load.assert_not_called()
+
+
+def get_nodes():
+    return {"children": [{"children": []}]}
+
+
+recursive_spec = """
+swagger: "2.0"
+info: {title: tree, version: "1.0"}
+paths:
+  /nodes:
+    get:
+      operationId: """ + __name__ + """.get_nodes
+      responses:
+        "200":
+          description: ok
+          schema: {$ref: "#/definitions/Node"}
+definitions:
+  Node:
+    type: object
+    properties:
+      children:
+        type: array
+        items: {$ref: "#/definitions/Node"}
+"""
+
+
+class Test_CompiledOai(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        self.path = os.path.join(self.directory, "petstore.yaml")
+        shutil.copy("tests/petstore.yaml", self.path)
+
+    def test_compile(self):
+        with open(self.path) as f:
+            expected = Util.compile_oai(yaml.full_load(f))
+
+        self.assertEqual(Util.load_compiled_oai(self.path), expected)
+        self.assertTrue(os.path.exists(self.path + ".compiled"))
+
+        # the compiled file is used without parsing the yaml
+        with mock.patch("yaml.load") as load:
+            self.assertEqual(Util.load_compiled_oai(self.path), expected)
+        load.assert_not_called()
+
+    def test_invalidation(self):
+        Util.load_compiled_oai(self.path)
+
+        with open(self.path, "a") as f:
+            f.write("x-changed: true\n")
+
+        self.assertTrue(Util.load_compiled_oai(self.path)["x-changed"])
+
+    def test_broken_compiled_file(self):
+        Util.load_compiled_oai(self.path)
+
+        with open(self.path + ".compiled", "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            f.truncate(f.tell() - 10)
+
+        with self.assertLogs("", "WARNING"):
+            self.assertIn("paths", Util.load_compiled_oai(self.path))
+
+    def test_recursive(self):
+        from connexion import FlaskApp
+
+        path = os.path.join(self.directory, "tree.yaml")
+        with open(path, "w") as f:
+            f.write(recursive_spec)
+
+        Util.load_compiled_oai(path)
+
+        # connexion accepts the spec from the compiled file
+        app = FlaskApp(__name__)
+        app.add_api(Util.load_oai(path, compiled=True)[0], validate_responses=True)
+
+        response = app.app.test_client().get("/nodes")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), get_nodes())